@@ -0,0 +1,305 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+import click
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Alert, AlertRecipient, AlertCounter, User
+from rollups import upsert_counters
+
+logger = logging.getLogger(__name__)
+
+def fan_out_alert(alert, user_ids):
+    """Store an alert once and deliver it to user_ids with one bulk insert
+    
+    Runs inside the caller's transaction; returns the flushed alert.
+    """
+    db.session.add(alert)
+    db.session.flush()  # Get the ID and created_at
+    
+    user_ids = list(dict.fromkeys(user_ids))
+    if user_ids:
+        db.session.execute(db.insert(AlertRecipient), [{
+            'alert_id': alert.id,
+            'user_id': user_id,
+            'created_at': alert.created_at
+        } for user_id in user_ids])
+        
+        # Every recipient gains an unread alert of this severity
+        upsert_counters(AlertCounter.__table__, ('user_id', 'severity'), ('unread',), [{
+            'user_id': user_id,
+            'severity': alert.severity or 0,
+            'unread': 1
+        } for user_id in user_ids])
+        
+        # Pushed to connected clients once the transaction commits
+        db.session.info.setdefault('alert_events', []).append((user_ids, alert_event(alert)))
+    
+    return alert
+
+def user_ids_with_roles(roles, active_only=False):
+    """Return the ids of users having any of the given roles"""
+    query = db.session.query(User.id).filter(User.role.in_(roles))
+    if active_only:
+        query = query.filter(User.is_active == True)
+    return [user_id for (user_id,) in query]
+
+# Unread counters
+
+def mark_read(recipient):
+    """Mark a delivered alert as read, keeping the unread counter in step"""
+    if recipient.read:
+        return
+    
+    recipient.read = True
+    AlertCounter.query.filter_by(
+        user_id=recipient.user_id,
+        severity=recipient.alert.severity or 0
+    ).update({
+        'unread': db.case((AlertCounter.unread > 0, AlertCounter.unread - 1), else_=0)
+    }, synchronize_session=False)
+
+def unread_counts(user_id):
+    """Return (total, {severity: count}) of a user's unread alerts"""
+    rows = db.session.query(AlertCounter.severity, AlertCounter.unread).filter(
+        AlertCounter.user_id == user_id,
+        AlertCounter.unread > 0
+    ).all()
+    
+    by_severity = {severity: unread for severity, unread in rows}
+    return sum(by_severity.values()), by_severity
+
+def reconcile_alert_counters():
+    """Recompute every unread counter from alert_recipient"""
+    severity = db.func.coalesce(Alert.severity, 0)
+    unread = db.select(
+        AlertRecipient.user_id,
+        severity,
+        db.func.count()
+    ).join(
+        Alert, Alert.id == AlertRecipient.alert_id
+    ).filter(
+        AlertRecipient.read == False
+    ).group_by(
+        AlertRecipient.user_id,
+        severity
+    )
+    
+    try:
+        db.session.execute(db.delete(AlertCounter))
+        db.session.execute(
+            db.insert(AlertCounter).from_select(['user_id', 'severity', 'unread'], unread)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error reconciling alert counters: {str(e)}")
+        raise
+    
+    return AlertCounter.query.count()
+
+@click.command('reconcile-alert-counters')
+@with_appcontext
+def reconcile_alert_counters_command():
+    """Recompute unread alert counters; run periodically from cron."""
+    count = reconcile_alert_counters()
+    click.echo(f"Reconciled {count} alert counters")
+
+def coalesce_key(alert):
+    """Key under which repeat detections of an alert are merged"""
+    parts = (alert.alert_type, alert.pathogen_id, alert.antibiotic_id, alert.region)
+    return ':'.join('' if part is None else str(part) for part in parts)
+
+def raise_alert(alert, user_ids, occurrences=1):
+    """Fan out a new alert, or merge it into an open alert with the same key
+    
+    An alert stays open for ALERT_COALESCE_WINDOW_MINUTES after it was last
+    seen. Returns (alert, created); callers notify users only when created.
+    """
+    now = datetime.utcnow()
+    window = timedelta(minutes=current_app.config.get('ALERT_COALESCE_WINDOW_MINUTES', 60))
+    key = coalesce_key(alert)
+    
+    open_alert = Alert.query.filter(
+        Alert.coalesce_key == key,
+        Alert.last_seen_at >= now - window
+    ).order_by(Alert.last_seen_at.desc()).first()
+    
+    if open_alert:
+        # Counted in SQL so concurrent ingest workers do not lose increments
+        Alert.query.filter_by(id=open_alert.id).update({
+            'occurrence_count': db.func.coalesce(Alert.occurrence_count, 1) + occurrences,
+            'last_seen_at': now
+        }, synchronize_session=False)
+        db.session.expire(open_alert, ['occurrence_count', 'last_seen_at'])
+        return open_alert, False
+    
+    alert.coalesce_key = key
+    alert.occurrence_count = occurrences
+    alert.created_at = now
+    alert.last_seen_at = now
+    return fan_out_alert(alert, user_ids), True
+
+def alert_event(alert):
+    """Serialize an alert for the stream and long-poll APIs"""
+    return {
+        'id': alert.id,
+        'title': alert.title,
+        'message': alert.message,
+        'alert_type': alert.alert_type,
+        'severity': alert.severity,
+        'region': alert.region,
+        'created_at': alert.created_at.strftime('%Y-%m-%d %H:%M:%S') if alert.created_at else None
+    }
+
+# In-process pub/sub for connected alert clients
+
+class AlertBroker:
+    """Hand committed alerts to the stream subscribers of this process
+    
+    Alerts committed by this process are published after commit; those of
+    other processes arrive through the AlertWatcher. Either may publish an
+    alert more than once, so subscribers skip ids they have already sent.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> set of queues
+        self._count = 0
+    
+    def subscribe(self, user_id, maxsize=100, limit=None):
+        """Return a queue of the user's alerts, or None when ``limit`` subscriptions are open"""
+        subscription = queue.Queue(maxsize=maxsize)
+        subscription.overflowed = False
+        with self._lock:
+            if limit is not None and self._count >= limit:
+                return None
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+        return subscription
+    
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+                if not subscriptions:
+                    del self._subscribers[user_id]
+    
+    def publish(self, user_ids, event):
+        with self._lock:
+            for user_id in user_ids:
+                for subscription in list(self._subscribers.get(user_id, ())):
+                    try:
+                        subscription.put_nowait(event)
+                    except queue.Full:
+                        # Slow client: drop it so it reconnects and resumes from the database
+                        subscription.overflowed = True
+                        self._subscribers[user_id].discard(subscription)
+                        self._count -= 1
+    
+    @property
+    def subscriber_count(self):
+        return self._count
+
+alert_broker = AlertBroker()
+
+class AlertWatcher:
+    """One background poller per process for alerts committed elsewhere
+    
+    While anyone is subscribed it reads alerts newer than the last one it
+    saw, every ALERT_WATCH_INTERVAL_SECONDS, and publishes them to the
+    broker; the database cost is one query per interval per process, not
+    per connected client. It stops when the last subscriber leaves.
+    """
+    
+    def __init__(self, broker):
+        self._broker = broker
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def ensure_running(self, app, since_id):
+        """Start watching for alerts after since_id unless already running"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(app, since_id),
+                                                name='alert-watcher', daemon=True)
+                self._thread.start()
+    
+    def _run(self, app, last_id):
+        interval = app.config.get('ALERT_WATCH_INTERVAL_SECONDS', 5)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if not self._broker.subscriber_count:
+                    self._thread = None
+                    return
+            
+            with app.app_context():
+                try:
+                    last_id = self._publish_new(last_id)
+                except Exception as e:
+                    logger.error(f"Error watching for new alerts: {str(e)}")
+                finally:
+                    db.session.remove()
+    
+    def _publish_new(self, last_id, limit=500):
+        alerts = Alert.query.filter(Alert.id > last_id).order_by(Alert.id).limit(limit).all()
+        if not alerts:
+            return last_id
+        
+        recipients = {}
+        for alert_id, user_id in db.session.query(AlertRecipient.alert_id, AlertRecipient.user_id).filter(
+                AlertRecipient.alert_id.in_([alert.id for alert in alerts])):
+            recipients.setdefault(alert_id, []).append(user_id)
+        
+        for alert in alerts:
+            self._broker.publish(recipients.get(alert.id, []), alert_event(alert))
+        return alerts[-1].id
+
+alert_watcher = AlertWatcher(alert_broker)
+
+@event.listens_for(Session, 'after_commit')
+def _publish_after_commit(session):
+    for user_ids, alert_data in session.info.pop('alert_events', []):
+        alert_broker.publish(user_ids, alert_data)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('alert_events', None)
+
+def missed_alert_events(user_id, after_id, limit=100):
+    """Alerts delivered to a user after after_id, for Last-Event-ID resume
+    
+    Read from the database, so alerts committed by other processes are
+    included.
+    """
+    if after_id is None:
+        return []
+    
+    alerts = Alert.query.join(
+        AlertRecipient, AlertRecipient.alert_id == Alert.id
+    ).filter(
+        AlertRecipient.user_id == user_id,
+        Alert.id > after_id
+    ).order_by(Alert.id).limit(limit).all()
+    
+    return [alert_event(alert) for alert in alerts]
+
+def latest_alert_id():
+    """Newest alert id, where a new stream starts from"""
+    return db.session.query(db.func.max(Alert.id)).scalar() or 0
+
+def format_sse(alert_data):
+    """Format an alert as a Server-Sent Events message"""
+    return f"id: {alert_data['id']}\nevent: alert\ndata: {json.dumps(alert_data)}\n\n"
@@ -0,0 +1,314 @@
+import json
+import hashlib
+import logging
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from models import ResistanceRollup, Antibiotic, Facility
+from cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+# Supported trend bucket sizes
+GRANULARITIES = ('day', 'week', 'month')
+
+# Default trend window per granularity, in days
+DEFAULT_TREND_DAYS = {'day': 30, 'week': 182, 'month': 365}
+
+# Normal quantile for the 95% Wilson score intervals on risk scores
+WILSON_Z = 1.96
+
+def truncate_date(value, granularity):
+    """Return the first day of the bucket containing value"""
+    if granularity == 'month':
+        return value.replace(day=1)
+    if granularity == 'week':
+        return value - timedelta(days=value.weekday())  # Monday
+    return value
+
+def next_bucket(value, granularity):
+    """Return the first day of the bucket after the one starting at value"""
+    if granularity == 'month':
+        return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+    if granularity == 'week':
+        return value + timedelta(days=7)
+    return value + timedelta(days=1)
+
+def _bucket_expression(granularity):
+    """SQL expression truncating the rollup day to the start of its bucket"""
+    day = ResistanceRollup.day
+    dialect = db.session.get_bind().dialect.name
+    
+    if dialect == 'postgresql':
+        return db.func.date(db.func.date_trunc(granularity, day))
+    
+    if dialect == 'sqlite':
+        if granularity == 'month':
+            return db.func.date(day, 'start of month')
+        if granularity == 'week':
+            # Monday on or before the day
+            return db.func.date(day, '-6 days', 'weekday 1')
+        return db.func.date(day)
+    
+    # Other databases group by day; buckets are merged in Python below
+    return day
+
+def resistance_trend(granularity='month', start=None, end=None,
+                     facility_id=None, pathogen_id=None, antibiotic_id=None):
+    """Resistance counts per day, week or month from a single grouped query
+    
+    Returns one entry per bucket between start and end (inclusive), with
+    empty buckets filled in: {'bucket': date, 'total', 'resistant',
+    'percentage'}.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=DEFAULT_TREND_DAYS[granularity])
+    start = truncate_date(start, granularity)
+    
+    bucket = _bucket_expression(granularity)
+    query = db.session.query(
+        bucket.label('bucket'),
+        db.func.sum(ResistanceRollup.total).label('total'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant')
+    ).filter(
+        ResistanceRollup.day >= start,
+        ResistanceRollup.day <= end
+    )
+    
+    # Optional filters, all part of the rollup key
+    if facility_id:
+        query = query.filter(ResistanceRollup.facility_id == facility_id)
+    if pathogen_id:
+        query = query.filter(ResistanceRollup.pathogen_id == pathogen_id)
+    if antibiotic_id:
+        query = query.filter(ResistanceRollup.antibiotic_id == antibiotic_id)
+    
+    counts = {}
+    for row in query.group_by(bucket).all():
+        key = row.bucket
+        if isinstance(key, str):
+            key = date.fromisoformat(key[:10])
+        elif isinstance(key, datetime):
+            key = key.date()
+        key = truncate_date(key, granularity)
+        
+        total, resistant = counts.get(key, (0, 0))
+        counts[key] = (total + (row.total or 0), resistant + (row.resistant or 0))
+    
+    # Fill empty buckets so charts get a continuous series
+    trend = []
+    current = start
+    while current <= end:
+        total, resistant = counts.get(current, (0, 0))
+        trend.append({
+            'bucket': current,
+            'total': total,
+            'resistant': resistant,
+            'percentage': round(resistant / total * 100, 2) if total > 0 else 0
+        })
+        current = next_bucket(current, granularity)
+    
+    return trend
+
+def antibiotic_susceptibility(pathogen_id, region=None, facility_id=None, start=None, end=None):
+    """S/I/R counts per antibiotic for one pathogen from a single grouped query
+    
+    Optionally limited to a region (facility state) or facility and a date
+    window. Counts every result, not first isolates; the treatment chart
+    uses it only for arbitrary date windows, which the yearly antibiogram
+    cannot answer.
+    Returns [{'antibiotic_id', 'antibiotic', 'total', 'susceptible',
+    'intermediate', 'resistant', 'percentage'}] ordered by antibiotic name.
+    """
+    query = db.session.query(
+        Antibiotic.id,
+        Antibiotic.name,
+        db.func.sum(ResistanceRollup.total).label('total'),
+        db.func.sum(ResistanceRollup.susceptible).label('susceptible'),
+        db.func.sum(ResistanceRollup.intermediate).label('intermediate'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant')
+    ).join(
+        ResistanceRollup, ResistanceRollup.antibiotic_id == Antibiotic.id
+    ).filter(
+        ResistanceRollup.pathogen_id == pathogen_id
+    )
+    
+    if region:
+        query = query.join(
+            Facility, Facility.id == ResistanceRollup.facility_id
+        ).filter(
+            Facility.state == region
+        )
+    if facility_id:
+        query = query.filter(ResistanceRollup.facility_id == facility_id)
+    if start:
+        query = query.filter(ResistanceRollup.day >= start)
+    if end:
+        query = query.filter(ResistanceRollup.day <= end)
+    
+    rows = query.group_by(
+        Antibiotic.id,
+        Antibiotic.name
+    ).order_by(
+        Antibiotic.name
+    ).all()
+    
+    return [{
+        'antibiotic_id': row.id,
+        'antibiotic': row.name,
+        'total': row.total,
+        'susceptible': row.susceptible,
+        'intermediate': row.intermediate,
+        'resistant': row.resistant,
+        'percentage': round(row.resistant / row.total * 100) if row.total else 0
+    } for row in rows if row.total]
+
+class RiskMatrix:
+    """Resistance risk scores for a grid of pathogens by region
+    
+    ``resistant`` and ``total`` are integer arrays of shape
+    (len(pathogen_ids), len(regions)); ``risk`` is the resistant
+    percentage (0 where nothing was tested) and ``lower``/``upper`` the
+    95% Wilson interval in percent (NaN where nothing was tested), or None
+    when intervals were not requested.
+    """
+    
+    def __init__(self, pathogen_ids, regions, resistant, total, with_ci=False):
+        self.pathogen_ids = pathogen_ids
+        self.regions = regions
+        self.pathogen_index = {pathogen_id: i for i, pathogen_id in enumerate(pathogen_ids)}
+        self.region_index = {region: j for j, region in enumerate(regions)}
+        self.resistant = resistant
+        self.total = total
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proportion = np.where(total > 0, resistant / total, 0.0)
+        self.risk = proportion * 100
+        self.lower, self.upper = wilson_interval(resistant, total) if with_ci else (None, None)
+    
+    def score(self, pathogen_id, region):
+        """Risk score of one cell, 0 for a pathogen or region outside the matrix"""
+        i = self.pathogen_index.get(pathogen_id)
+        j = self.region_index.get(region)
+        if i is None or j is None:
+            return 0
+        return float(self.risk[i, j])
+    
+    def to_dict(self):
+        """JSON-ready form, NaN intervals as null"""
+        def cells(array):
+            return [[None if np.isnan(value) else round(float(value), 2) for value in row] for row in array]
+        
+        data = {
+            'pathogen_ids': self.pathogen_ids,
+            'regions': self.regions,
+            'resistant': self.resistant.tolist(),
+            'total': self.total.tolist(),
+            'risk': cells(self.risk)
+        }
+        if self.lower is not None:
+            data['lower'] = cells(self.lower)
+            data['upper'] = cells(self.upper)
+        return data
+
+def wilson_interval(resistant, total, z=WILSON_Z):
+    """Vectorized Wilson score interval for resistant/total, in percent"""
+    resistant = np.asarray(resistant, dtype=float)
+    total = np.asarray(total, dtype=float)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportion = resistant / total
+        denominator = 1 + z ** 2 / total
+        center = (proportion + z ** 2 / (2 * total)) / denominator
+        half_width = z * np.sqrt(proportion * (1 - proportion) / total + z ** 2 / (4 * total ** 2)) / denominator
+    
+    lower = np.where(total > 0, np.clip(center - half_width, 0, 1) * 100, np.nan)
+    upper = np.where(total > 0, np.clip(center + half_width, 0, 1) * 100, np.nan)
+    return lower, upper
+
+def resistance_risk_matrix(pathogen_ids=None, regions=None, with_ci=False):
+    """Resistance risk for every (pathogen, region) pair from one grouped query
+    
+    Regions are facility states. With ``pathogen_ids`` or ``regions`` the
+    matrix covers exactly those, in the given order, with zero counts where
+    there is no data; otherwise it covers every pathogen and region with
+    results. Counts are cached until the data version changes.
+    """
+    pathogen_ids = list(pathogen_ids) if pathogen_ids is not None else None
+    regions = list(regions) if regions is not None else None
+    
+    subset = json.dumps([pathogen_ids, regions])
+    key = f"risk_matrix:{hashlib.sha1(subset.encode('utf-8')).hexdigest()}"
+    try:
+        cache = get_cache()
+        counts = cache.get(key)
+        version = cache.data_version() if counts is None else None
+    except Exception as e:
+        logger.error(f"Error reading risk matrix cache: {str(e)}")
+        cache, counts = None, None
+    
+    if counts is None:
+        counts = _risk_counts(pathogen_ids, regions)
+        if cache is not None:
+            try:
+                cache.set(key, counts, current_app.config.get('CACHE_DEFAULT_TTL', 300), version)
+            except Exception as e:
+                logger.error(f"Error writing risk matrix cache: {str(e)}")
+    
+    return RiskMatrix(
+        counts['pathogen_ids'],
+        counts['regions'],
+        np.array(counts['resistant'], dtype=np.int64).reshape(len(counts['pathogen_ids']), len(counts['regions'])),
+        np.array(counts['total'], dtype=np.int64).reshape(len(counts['pathogen_ids']), len(counts['regions'])),
+        with_ci
+    )
+
+def _risk_counts(pathogen_ids, regions):
+    """Resistant and total counts per (pathogen, region) as JSON-ready lists"""
+    query = db.session.query(
+        ResistanceRollup.pathogen_id,
+        Facility.state,
+        db.func.sum(ResistanceRollup.resistant).label('resistant'),
+        db.func.sum(ResistanceRollup.total).label('total')
+    ).join(
+        Facility, Facility.id == ResistanceRollup.facility_id
+    ).filter(
+        Facility.state.isnot(None)
+    )
+    
+    if pathogen_ids is not None:
+        query = query.filter(ResistanceRollup.pathogen_id.in_(pathogen_ids))
+    if regions is not None:
+        query = query.filter(Facility.state.in_(regions))
+    
+    rows = query.group_by(
+        ResistanceRollup.pathogen_id,
+        Facility.state
+    ).all()
+    
+    if pathogen_ids is None:
+        pathogen_ids = sorted({row.pathogen_id for row in rows})
+    if regions is None:
+        regions = sorted({row.state for row in rows})
+    pathogen_index = {pathogen_id: i for i, pathogen_id in enumerate(pathogen_ids)}
+    region_index = {region: j for j, region in enumerate(regions)}
+    
+    resistant = np.zeros((len(pathogen_ids), len(regions)), dtype=np.int64)
+    total = np.zeros((len(pathogen_ids), len(regions)), dtype=np.int64)
+    for row in rows:
+        i, j = pathogen_index[row.pathogen_id], region_index[row.state]
+        resistant[i, j] = row.resistant or 0
+        total[i, j] = row.total or 0
+    
+    return {
+        'pathogen_ids': pathogen_ids,
+        'regions': regions,
+        'resistant': resistant.ravel().tolist(),
+        'total': total.ravel().tolist()
+    }
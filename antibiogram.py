@@ -0,0 +1,302 @@
+import logging
+import threading
+from datetime import datetime
+
+import click
+import numpy as np
+import pandas as pd
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import db
+from models import Antibiogram, Antibiotic, LabReport, ResistanceProfile, Facility
+from rollups import RESULT_COLUMNS
+from cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Columns keying each antibiogram scope; every scope is also split by pathogen
+SCOPES = {
+    'facility': ('facility_id', 'region'),
+    'region': ('region',),
+    'overall': ()
+}
+
+def collection_date():
+    """Date an isolate counts towards: sample collection, else report date"""
+    return db.func.coalesce(LabReport.sample_collection_date, LabReport.report_date)
+
+def first_isolate_mask(groups, patient, day, report_id, antibiotic):
+    """Select the results of each patient's first isolate per group (CLSI M39)
+    
+    ``groups`` is a list of integer code arrays that together identify the
+    group (scope and pathogen); the other arguments are arrays of the same
+    length, one entry per susceptibility result. The first isolate is the
+    patient's earliest collection day in the group, and of its results only
+    the first per antibiotic is kept, so repeat cultures count once. Returns
+    a boolean mask over the input rows.
+    """
+    mask = np.zeros(len(report_id), dtype=bool)
+    if not len(report_id):
+        return mask
+    
+    # Sort by group, patient, day and report; np.lexsort takes the primary key last
+    keys = list(groups) + [patient]
+    order = np.lexsort([report_id, day] + keys[::-1])
+    
+    # Start of each (group, patient) run and the day of its first row
+    run_start = np.zeros(len(order), dtype=bool)
+    run_start[0] = True
+    for key in keys:
+        sorted_key = key[order]
+        run_start[1:] |= sorted_key[1:] != sorted_key[:-1]
+    run = np.cumsum(run_start) - 1
+    sorted_day = day[order]
+    on_first_day = sorted_day == sorted_day[run_start][run]
+    
+    # One result per antibiotic within the first isolate, lowest report id first
+    candidates = order[on_first_day]
+    candidate_run = run[on_first_day]
+    order = np.lexsort((report_id[candidates], antibiotic[candidates], candidate_run))
+    candidates = candidates[order]
+    candidate_run = candidate_run[order]
+    candidate_antibiotic = antibiotic[candidates]
+    
+    first = np.ones(len(candidates), dtype=bool)
+    first[1:] = (candidate_run[1:] != candidate_run[:-1]) | (candidate_antibiotic[1:] != candidate_antibiotic[:-1])
+    mask[candidates[first]] = True
+    return mask
+
+def compute_antibiogram(frame):
+    """Count first-isolate results per scope, pathogen and antibiotic
+    
+    ``frame`` holds one row per result with report_id, patient, facility_id,
+    region, collected, pathogen_id, antibiotic_id and result columns.
+    Returns a list of antibiogram row dicts without the period.
+    """
+    if frame.empty:
+        return []
+    
+    report_id = frame['report_id'].to_numpy(dtype=np.int64)
+    pathogen = frame['pathogen_id'].to_numpy(dtype=np.int64)
+    antibiotic = frame['antibiotic_id'].to_numpy(dtype=np.int64)
+    day = pd.to_datetime(frame['collected']).to_numpy().astype('datetime64[D]').astype(np.int64)
+    
+    # Results without a patient identifier cannot be deduplicated; each report stands alone
+    patient_codes, _ = pd.factorize(frame['patient'].where(frame['patient'] != ''))
+    patient = np.where(patient_codes >= 0, patient_codes, -report_id)
+    
+    codes = {
+        'facility_id': frame['facility_id'].to_numpy(dtype=np.int64),
+        'region': pd.factorize(frame['region'])[0]
+    }
+    
+    rows = []
+    for scope, columns in SCOPES.items():
+        mask = first_isolate_mask([codes[column] for column in columns] + [pathogen],
+                                  patient, day, report_id, antibiotic)
+        selected = frame[mask]
+        if scope == 'region':
+            selected = selected[selected['region'].notna()]
+        if selected.empty:
+            continue
+        
+        counts = selected.groupby(
+            list(columns) + ['pathogen_id', 'antibiotic_id', 'result'], dropna=False
+        ).size().unstack('result', fill_value=0).reindex(columns=list(RESULT_COLUMNS), fill_value=0)
+        
+        for row in counts.rename(columns=RESULT_COLUMNS).reset_index().to_dict('records'):
+            region = row.get('region')
+            rows.append({
+                'region': region if isinstance(region, str) else None,
+                'facility_id': int(row['facility_id']) if 'facility_id' in row else None,
+                'pathogen_id': int(row['pathogen_id']),
+                'antibiotic_id': int(row['antibiotic_id']),
+                'susceptible': int(row['susceptible']),
+                'intermediate': int(row['intermediate']),
+                'resistant': int(row['resistant']),
+                'total': int(row['susceptible'] + row['intermediate'] + row['resistant'])
+            })
+    
+    return rows
+
+def _load_results(period, pathogen_ids=None):
+    """Read the S/I/R results collected in one calendar year, optionally for some pathogens only"""
+    collected = collection_date()
+    query = db.select(
+        LabReport.id.label('report_id'),
+        LabReport.patient_identifier.label('patient'),
+        LabReport.facility_id,
+        Facility.state.label('region'),
+        collected.label('collected'),
+        ResistanceProfile.pathogen_id,
+        ResistanceProfile.antibiotic_id,
+        ResistanceProfile.result
+    ).join(
+        LabReport, LabReport.id == ResistanceProfile.lab_report_id
+    ).join(
+        Facility, Facility.id == LabReport.facility_id
+    ).filter(
+        ResistanceProfile.result.in_(list(RESULT_COLUMNS)),
+        collected >= datetime(period, 1, 1),
+        collected < datetime(period + 1, 1, 1)
+    )
+    if pathogen_ids is not None:
+        query = query.filter(ResistanceProfile.pathogen_id.in_(pathogen_ids))
+    return pd.read_sql(query, db.session.connection())
+
+def _all_periods():
+    """Every calendar year with lab data"""
+    collected = collection_date()
+    first, last = db.session.query(db.func.min(collected), db.func.max(collected)).one()
+    if first is None:
+        return []
+    return list(range(pd.Timestamp(first).year, pd.Timestamp(last).year + 1))
+
+# pg_advisory_xact_lock key serializing antibiogram refreshes
+ANTIBIOGRAM_LOCK_KEY = 20240301
+
+def _lock_antibiogram():
+    """Take a database-wide lock on the antibiogram for the current transaction
+    
+    Refreshes delete and re-insert rows, so two running at once, in any
+    process, could both insert the same rows. PostgreSQL uses a transaction
+    advisory lock; SQLite takes its write lock up front (BEGIN IMMEDIATE).
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': ANTIBIOGRAM_LOCK_KEY})
+    elif connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def rebuild_antibiogram(periods=None, pathogen_ids=None):
+    """Recompute the antibiogram tables for the given years (all years by default)
+    
+    With ``pathogen_ids`` only those pathogens' rows are recomputed; every
+    first-isolate group is per pathogen, so the others stay valid.
+    """
+    if periods is None:
+        periods = _all_periods()
+    if pathogen_ids is not None:
+        pathogen_ids = sorted(pathogen_ids)
+    
+    written = 0
+    try:
+        for period in sorted(periods):
+            # Held until the commit, so refreshes from other processes cannot interleave
+            _lock_antibiogram()
+            rows = compute_antibiogram(_load_results(period, pathogen_ids))
+            computed_at = datetime.utcnow()
+            for row in rows:
+                row['period'] = period
+                row['computed_at'] = computed_at
+            
+            # Replace the year in one transaction so lookups never see it half-written
+            stale = db.delete(Antibiogram).where(Antibiogram.period == period)
+            if pathogen_ids is not None:
+                stale = stale.where(Antibiogram.pathogen_id.in_(pathogen_ids))
+            db.session.execute(stale)
+            if rows:
+                db.session.execute(db.insert(Antibiogram), rows)
+            db.session.commit()
+            written += len(rows)
+        
+        bump_data_version()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error rebuilding antibiogram: {str(e)}")
+        raise
+    
+    return written
+
+_pending_periods = set()  # (year, pathogen_id) pairs
+_pending_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+def request_refresh(periods):
+    """Recompute the given (year, pathogen_id) pairs on the background worker pool
+    
+    Requests that arrive while a refresh is running are merged into it.
+    """
+    periods = set(periods)
+    if not periods:
+        return
+    with _pending_lock:
+        _pending_periods.update(periods)
+    
+    from jobs import submit
+    submit(_refresh_pending)
+
+def _refresh_pending():
+    while _pending_periods:
+        if not _refresh_lock.acquire(blocking=False):
+            # The running refresh will pick up the new pairs
+            return
+        try:
+            while True:
+                with _pending_lock:
+                    periods = set(_pending_periods)
+                    _pending_periods.clear()
+                if not periods:
+                    break
+                
+                pathogens_by_year = {}
+                for period, pathogen_id in periods:
+                    pathogens_by_year.setdefault(period, set()).add(pathogen_id)
+                for period, pathogen_ids in sorted(pathogens_by_year.items()):
+                    rebuild_antibiogram([period], pathogen_ids)
+        finally:
+            _refresh_lock.release()
+
+def antibiogram_for(pathogen_id, region=None, facility_id=None, period=None):
+    """Look up the precomputed antibiogram of one pathogen
+    
+    Uses the facility rows when ``facility_id`` is given, else the region
+    rows, else the overall rows, for ``period`` or the latest year
+    available. Returns (period, stats) where stats is a list of
+    {'antibiotic_id', 'antibiotic', 'total', 'susceptible', 'intermediate',
+    'resistant', 'percentage', 'sufficient'} ordered by antibiotic name;
+    ``sufficient`` is False below the configured minimum isolate count.
+    """
+    scope = Antibiogram.query.filter(Antibiogram.pathogen_id == pathogen_id)
+    if facility_id:
+        scope = scope.filter(Antibiogram.facility_id == facility_id)
+    elif region:
+        scope = scope.filter(Antibiogram.facility_id.is_(None), Antibiogram.region == region)
+    else:
+        scope = scope.filter(Antibiogram.facility_id.is_(None), Antibiogram.region.is_(None))
+    
+    if period is None:
+        period = scope.with_entities(db.func.max(Antibiogram.period)).scalar()
+        if period is None:
+            return None, []
+    
+    rows = scope.filter(
+        Antibiogram.period == period
+    ).join(
+        Antibiotic, Antibiotic.id == Antibiogram.antibiotic_id
+    ).with_entities(
+        Antibiogram, Antibiotic.name
+    ).order_by(
+        Antibiotic.name
+    ).all()
+    
+    min_isolates = current_app.config.get('ANTIBIOGRAM_MIN_ISOLATES', 30)
+    return period, [{
+        'antibiotic_id': row.antibiotic_id,
+        'antibiotic': name,
+        'total': row.total,
+        'susceptible': row.susceptible,
+        'intermediate': row.intermediate,
+        'resistant': row.resistant,
+        'percentage': round(row.resistant / row.total * 100) if row.total else 0,
+        'sufficient': row.total >= min_isolates
+    } for row, name in rows if row.total]
+
+@click.command('rebuild-antibiogram')
+@click.option('--year', 'years', type=int, multiple=True, help='Year to recompute; repeatable. Defaults to all years.')
+@with_appcontext
+def rebuild_antibiogram_command(years):
+    """Recompute the cumulative antibiogram tables from raw lab data."""
+    count = rebuild_antibiogram(list(years) or None)
+    click.echo(f"Rebuilt {count} antibiogram rows")
@@ -19,6 +19,7 @@ login_manager = LoginManager()
 
 # Create the Flask application
 app = Flask(__name__)
+app.config.from_object('config.Config')
 app.secret_key = os.environ.get("SESSION_SECRET", "development-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
@@ -57,8 +58,10 @@ login_manager.login_view = 'auth.login'
 with app.app_context():
     import models
     
-    # Create database tables
-    db.create_all()
+    # Apply schema migrations (tables, columns, indexes) unless deploys run them
+    if app.config.get('AUTO_MIGRATE', True):
+        from migrations import upgrade_database
+        upgrade_database()
 
 # Import and register blueprints
 from routes.auth import auth_bp
@@ -75,6 +78,21 @@ app.register_blueprint(alerts_bp)
 app.register_blueprint(admin_bp)
 app.register_blueprint(treatment_bp)
 
+# Register maintenance commands
+from rollups import rebuild_rollups_command
+from migrations import upgrade_db_command
+from notifications import dispatch_notifications_command
+from alerting import reconcile_alert_counters_command
+from antibiogram import rebuild_antibiogram_command
+from jobs import recover_ingest_jobs_command
+
+app.cli.add_command(rebuild_rollups_command)
+app.cli.add_command(upgrade_db_command)
+app.cli.add_command(dispatch_notifications_command)
+app.cli.add_command(reconcile_alert_counters_command)
+app.cli.add_command(rebuild_antibiogram_command)
+app.cli.add_command(recover_ingest_jobs_command)
+
 # Setup login manager user loader
 @login_manager.user_loader
 def load_user(user_id):
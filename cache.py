@@ -0,0 +1,288 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, Response
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Entries read within this many seconds are not re-touched for LRU ordering
+TOUCH_INTERVAL = 60
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 500
+
+class SQLiteCache:
+    """Cache in a local SQLite file, shared by every worker process on the host
+    
+    Entries are stamped with the data version they were computed from and
+    only served while that version is current, so bumping the version
+    invalidates everything at once.
+    """
+    
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entry ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed ON cache_entry (accessed_at)')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)')
+        connection.execute('INSERT OR IGNORE INTO cache_version (id, version) VALUES (1, 0)')
+    
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+    
+    def get(self, key):
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT e.value, e.expires_at, e.accessed_at FROM cache_entry e '
+            'JOIN cache_version v ON v.id = 1 AND e.version = v.version '
+            'WHERE e.key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] < now:
+            return None
+        
+        if now - row[2] > TOUCH_INTERVAL:
+            connection.execute('UPDATE cache_entry SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+    
+    def set(self, key, value, ttl, version):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, version, expires_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, json.dumps(value), version, now + ttl, now)
+        )
+        
+        # Drop stale and expired entries, then the least recently used beyond the bound
+        connection.execute(
+            'DELETE FROM cache_entry WHERE expires_at < ? '
+            'OR version < (SELECT version FROM cache_version WHERE id = 1)', (now,)
+        )
+        connection.execute(
+            'DELETE FROM cache_entry WHERE key IN ('
+            'SELECT key FROM cache_entry ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+    
+    def data_version(self):
+        return self._connection().execute('SELECT version FROM cache_version WHERE id = 1').fetchone()[0]
+    
+    def bump_data_version(self):
+        self._connection().execute('UPDATE cache_version SET version = version + 1 WHERE id = 1')
+
+class MemoryCache:
+    """Per-process LRU cache; a local stand-in for single-process deployments"""
+    
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, version, expires_at = entry
+            if version != self._version or expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl, version):
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = (value, version, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def data_version(self):
+        return self._version
+    
+    def bump_data_version(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+class NullCache:
+    """Cache that stores nothing, for tests and debugging"""
+    
+    def get(self, key):
+        return None
+    
+    def set(self, key, value, ttl, version):
+        pass
+    
+    def data_version(self):
+        return 0
+    
+    def bump_data_version(self):
+        pass
+
+def get_cache():
+    """Return the cache backend configured for this app"""
+    cache = current_app.extensions.get('amr_cache')
+    if cache is None:
+        config = current_app.config
+        backend = config.get('CACHE_BACKEND', 'sqlite')
+        max_entries = config.get('CACHE_MAX_ENTRIES', 1000)
+        
+        if backend == 'sqlite':
+            path = config.get('CACHE_PATH', 'cache.sqlite3')
+            if not os.path.isabs(path):
+                os.makedirs(current_app.instance_path, exist_ok=True)
+                path = os.path.join(current_app.instance_path, path)
+            cache = SQLiteCache(path, max_entries)
+        elif backend == 'memory':
+            cache = MemoryCache(max_entries)
+        elif backend == 'null':
+            cache = NullCache()
+        else:
+            raise ValueError(f"Unknown cache backend: {backend}")
+        
+        current_app.extensions['amr_cache'] = cache
+    return cache
+
+def bump_data_version():
+    """Invalidate cached responses after new lab data has been committed"""
+    try:
+        get_cache().bump_data_version()
+    except Exception as e:
+        logger.error(f"Error bumping data version: {str(e)}")
+
+def cached_response(ttl=None):
+    """Cache a view's successful response, keyed by endpoint, URL and query args
+    
+    Only for views whose response is the same for every user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            view_args = ','.join(f'{k}={v}' for k, v in sorted((request.view_args or {}).items()))
+            query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+            key = f"{request.endpoint}/{view_args}?{query}"
+            
+            try:
+                cache = get_cache()
+                entry = cache.get(key)
+                # Stamp a miss with the version seen before computing, so data
+                # committed meanwhile is not hidden behind the new version
+                version = cache.data_version() if entry is None else None
+            except Exception as e:
+                logger.error(f"Error reading response cache: {str(e)}")
+                cache, entry = None, None
+            
+            if entry is not None:
+                return Response(entry['body'], status=200, mimetype=entry['mimetype'])
+            
+            response = current_app.make_response(view(*args, **kwargs))
+            if cache is not None and response.status_code == 200 and not response.direct_passthrough:
+                try:
+                    cache.set(key, {
+                        'body': response.get_data(as_text=True),
+                        'mimetype': response.mimetype
+                    }, ttl or current_app.config.get('CACHE_DEFAULT_TTL', 300), version)
+                except Exception as e:
+                    logger.error(f"Error writing response cache: {str(e)}")
+            return response
+        return wrapper
+    return decorator
+
+def conditional_response(view):
+    """Serve a data-derived view with a strong ETag and a compressed body
+
+    The ETag is derived from the data version, the request and the cache
+    TTL period, so an unchanged dashboard is revalidated with a 304 without
+    running the view. Only for views whose response is the same for every user.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        encoding = _choose_encoding(request.headers.get('Accept-Encoding', ''))
+        
+        try:
+            version = get_cache().data_version()
+        except Exception as e:
+            logger.error(f"Error reading data version: {str(e)}")
+            return view(*args, **kwargs)
+        
+        # Rotate with the cache TTL so data changed outside the app is picked up
+        period = int(time.time() // current_app.config.get('CACHE_DEFAULT_TTL', 300))
+        request_key = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+        identity_etag = f"{version}-{period}-{request_key}"
+        etag = f"{identity_etag}-{encoding}" if encoding else identity_etag
+        
+        headers = {
+            'ETag': f'"{etag}"',
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'private, no-cache'
+        }
+        
+        # Small bodies are sent uncompressed under the identity ETag
+        if etag in request.if_none_match or identity_etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.direct_passthrough:
+            return response
+        
+        body = response.get_data()
+        if encoding and len(body) >= MIN_COMPRESS_SIZE:
+            response.set_data(brotli.compress(body) if encoding == 'br' else gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = encoding
+        else:
+            headers['ETag'] = f'"{identity_etag}"'
+        
+        response.headers.update(headers)
+        return response
+    return wrapper
+
+def _choose_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, or None"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
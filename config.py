@@ -8,16 +8,116 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///amr_network.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Run `flask upgrade-db` automatically at startup; disable when deploys run it
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'true').lower() == 'true'
+    
     # Firebase configuration
     FIREBASE_API_KEY = os.environ.get('FIREBASE_API_KEY')
     FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID')
     FIREBASE_APP_ID = os.environ.get('FIREBASE_APP_ID')
     
     # File upload configuration
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload
+    # Uploads are streamed in batches, so the limit only bounds disk spooling
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 4 * 1024 * 1024 * 1024))  # 4 GB max upload
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'csv', 'json'}
     
+    # Ingest configuration
+    INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 1000))  # records per bulk INSERT
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))  # background ingest threads per process
+    INGEST_MAX_STORED_REJECTS = 100  # rejected rows kept on the job for the progress API
+    
+    # Wide-format (WHONET-style) import: antibiotic column codes and organism codes to names
+    ANTIBIOTIC_CODES = {
+        'AMC': 'Amoxicillin/clavulanic acid',
+        'AMK': 'Amikacin',
+        'AMP': 'Ampicillin',
+        'AZM': 'Azithromycin',
+        'CAZ': 'Ceftazidime',
+        'CIP': 'Ciprofloxacin',
+        'CLI': 'Clindamycin',
+        'COL': 'Colistin',
+        'CRO': 'Ceftriaxone',
+        'CTX': 'Cefotaxime',
+        'CZO': 'Cefazolin',
+        'ERY': 'Erythromycin',
+        'ETP': 'Ertapenem',
+        'FEP': 'Cefepime',
+        'FOS': 'Fosfomycin',
+        'FOX': 'Cefoxitin',
+        'GEN': 'Gentamicin',
+        'IPM': 'Imipenem',
+        'LNZ': 'Linezolid',
+        'LVX': 'Levofloxacin',
+        'MEM': 'Meropenem',
+        'NIT': 'Nitrofurantoin',
+        'OXA': 'Oxacillin',
+        'PEN': 'Penicillin G',
+        'SXT': 'Trimethoprim/sulfamethoxazole',
+        'TCY': 'Tetracycline',
+        'TZP': 'Piperacillin/tazobactam',
+        'VAN': 'Vancomycin'
+    }
+    ORGANISM_CODES = {
+        'aba': 'Acinetobacter baumannii',
+        'ecl': 'Enterobacter cloacae',
+        'eco': 'Escherichia coli',
+        'efa': 'Enterococcus faecalis',
+        'efm': 'Enterococcus faecium',
+        'kpn': 'Klebsiella pneumoniae',
+        'ngo': 'Neisseria gonorrhoeae',
+        'pae': 'Pseudomonas aeruginosa',
+        'pmi': 'Proteus mirabilis',
+        'sau': 'Staphylococcus aureus',
+        'spn': 'Streptococcus pneumoniae'
+    }
+    
+    # Alert configuration
+    # Repeat detections within this window are merged into the open alert
+    ALERT_COALESCE_WINDOW_MINUTES = int(os.environ.get('ALERT_COALESCE_WINDOW_MINUTES', 60))
+    ALERT_STREAM_HEARTBEAT_SECONDS = 15  # keep-alive comment on idle /alerts/stream connections
+    ALERT_STREAM_RETRY_MS = 5000  # client reconnect delay sent to EventSource
+    ALERT_STREAM_QUEUE_SIZE = 100  # events buffered per client before it is dropped
+    ALERT_POLL_TIMEOUT_SECONDS = 25  # long-poll fallback wait
+    ALERT_STREAM_MAX_SECONDS = 300  # streams end after this and resume via Last-Event-ID
+    # Open streams and long polls per process. Each holds one gunicorn thread
+    # (mostly asleep, no database connection), so this is the thread count less
+    # the threads kept free for page requests; add workers for more clients.
+    ALERT_STREAM_MAX_CLIENTS = int(os.environ.get('ALERT_STREAM_MAX_CLIENTS',
+                                                  int(os.environ.get('GUNICORN_THREADS', 256)) - 32))
+    ALERT_WATCH_INTERVAL_SECONDS = 5  # how often each process checks for alerts committed elsewhere
+    ALERT_BUSY_RETRY_SECONDS = 30  # poll interval once every stream slot is taken
+    
+    # Notification configuration
+    # Transport per channel: log (prints locally), smtp or http
+    NOTIFY_EMAIL_TRANSPORT = os.environ.get('NOTIFY_EMAIL_TRANSPORT', 'log')
+    NOTIFY_SMS_TRANSPORT = os.environ.get('NOTIFY_SMS_TRANSPORT', 'log')
+    NOTIFY_PUSH_TRANSPORT = os.environ.get('NOTIFY_PUSH_TRANSPORT', 'log')
+    NOTIFY_SMTP_HOST = os.environ.get('NOTIFY_SMTP_HOST', 'localhost')
+    NOTIFY_SMTP_PORT = int(os.environ.get('NOTIFY_SMTP_PORT', 25))
+    NOTIFY_SMTP_USERNAME = os.environ.get('NOTIFY_SMTP_USERNAME')
+    NOTIFY_SMTP_PASSWORD = os.environ.get('NOTIFY_SMTP_PASSWORD')
+    NOTIFY_SMTP_USE_TLS = os.environ.get('NOTIFY_SMTP_USE_TLS', 'false').lower() == 'true'
+    NOTIFY_SENDER = os.environ.get('NOTIFY_SENDER', 'alerts@amr-network.local')
+    NOTIFY_HTTP_URL = os.environ.get('NOTIFY_HTTP_URL')  # batches are POSTed to <url>/<channel>
+    NOTIFY_HTTP_TIMEOUT = 10
+    NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', 100))  # messages per transport call
+    NOTIFY_MAX_PARALLEL = int(os.environ.get('NOTIFY_MAX_PARALLEL', 4))  # concurrent transport calls
+    NOTIFY_MAX_ATTEMPTS = 5
+    NOTIFY_RETRY_BASE_SECONDS = 30  # doubled after each failed attempt
+    NOTIFY_LEASE_SECONDS = 300  # messages stuck in "sending" longer than this are retried
+    
+    # Antibiogram configuration
+    # Antibiotics tested on fewer first isolates than this are flagged as unreliable (CLSI M39)
+    ANTIBIOGRAM_MIN_ISOLATES = int(os.environ.get('ANTIBIOGRAM_MIN_ISOLATES', 30))
+    
+    # Response cache configuration
+    # sqlite (shared by the workers on a host), memory (per process) or null
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')
+    CACHE_PATH = os.environ.get('CACHE_PATH', 'cache.sqlite3')  # relative paths live in the instance folder
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))  # seconds
+    CACHE_MAX_ENTRIES = 1000
+    
     # Application configuration
     APP_NAME = 'AMR Early-Warning & Mitigation Network'
     
@@ -25,16 +125,19 @@ class Config:
     MAPBOX_TOKEN = os.environ.get('MAPBOX_TOKEN')
     
     # Privacy configuration
-    PATIENT_ID_SALT = os.environ.get('PATIENT_ID_SALT', 'default-salt')
+    # HMAC key for patient identifiers; the default matches the one older releases hashed with
+    PATIENT_ID_SALT = os.environ.get('PATIENT_ID_SALT', 'default_salt')
+    PATIENT_ID_CACHE_SIZE = 100000  # recently hashed identifiers kept per process
 
 class DevelopmentConfig(Config):
     DEBUG = True
-    
+
 class ProductionConfig(Config):
     DEBUG = False
-    
+
 class TestingConfig(Config):
     TESTING = True
+    CACHE_BACKEND = 'null'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
 
 config = {
@@ -1,19 +1,63 @@
 import pandas as pd
+import numpy as np
 import json
 import logging
+import math
+from collections import Counter
 from datetime import datetime
 import uuid
 
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
 from app import db
 from models import (
     Pathogen, Antibiotic, LabReport, ResistanceProfile, 
-    Facility, User, Alert, UserRole, EnvironmentalSample
+    Facility, User, Alert, UserRole, EnvironmentalSample, ResistanceRollup
+)
+from utils import (
+    hash_patient_ids, format_date, infer_date_format, parse_date_column, generate_report_id,
+    calculate_resistance_risk, batched, send_alert
 )
-from utils import hash_patient_id, format_date, generate_report_id, calculate_resistance_risk
+from ml_models import predict_outbreak, detect_outbreaks, OUTBREAK_WINDOW_DAYS
+from rollups import update_rollups, update_outbreak_series, prune_outbreak_series
+from alerting import raise_alert, user_ids_with_roles
+from cache import bump_data_version
+
+# Default number of records written per multi-row INSERT
+DEFAULT_CHUNK_SIZE = 1000
+
+REQUIRED_FIELDS = ('pathogen', 'antibiotic', 'result')
+DATE_FIELDS = ('report_date', 'sample_date')
+VALID_RESULTS = {'S', 'I', 'R'}
+
+def process_lab_data(data, facility_id, user_id, chunk_size=None):
+    """Process lab data and save to database
+    
+    Records are validated, resolved and written in chunks of ``chunk_size``
+    using set-based lookups and multi-row inserts instead of per-record
+    queries. Returns a summary with the number of records parsed, inserted
+    and rejected, a list of per-row rejects ({'row': n, 'reason': ...})
+    where ``row`` is the 1-based position of the record in the input, and
+    the sets of outbreak series and (collection year, pathogen) pairs the
+    upload touched.
+    """
+    if not chunk_size:
+        chunk_size = current_app.config.get('INGEST_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    
+    return process_lab_batches(batched(data, chunk_size), facility_id, user_id)
 
-def process_lab_data(data, facility_id, user_id):
-    """Process lab data and save to database"""
-    processed_count = 0
+def process_lab_batches(batches, facility_id, user_id, progress=None):
+    """Process an iterable of record batches, committing after each batch
+    
+    Used with the streaming parsers in utils so only one batch of an upload
+    is held in memory. ``progress`` is called with the running summary after
+    each batch is written, before it is committed, so it can record how far
+    the upload got. If a batch fails, the batches committed before it stay
+    in the database and the error is re-raised.
+    """
+    summary = {'parsed': 0, 'inserted': 0, 'rejected': 0, 'rejects': [], 'outbreak_series': set(), 'antibiogram_periods': set()}
+    committed = 0
     
     try:
         # Get facility
@@ -26,111 +70,296 @@ def process_lab_data(data, facility_id, user_id):
         if not user:
             raise ValueError("Invalid user ID")
         
-        # Process each record
-        for record in data:
-            try:
-                # Check if required fields are present
-                required_fields = ['pathogen', 'antibiotic', 'result']
-                if not all(field in record for field in required_fields):
-                    logging.warning(f"Missing required fields in record: {record}")
-                    continue
-                
-                # Create or get pathogen
-                pathogen_name = record['pathogen']
-                pathogen = Pathogen.query.filter_by(name=pathogen_name).first()
-                if not pathogen:
-                    pathogen = Pathogen(
-                        name=pathogen_name,
-                        scientific_name=record.get('scientific_name', ''),
-                        pathogen_type=record.get('pathogen_type', '')
-                    )
-                    db.session.add(pathogen)
-                    db.session.flush()  # Get the ID
-                
-                # Create or get antibiotic
-                antibiotic_name = record['antibiotic']
-                antibiotic = Antibiotic.query.filter_by(name=antibiotic_name).first()
-                if not antibiotic:
-                    antibiotic = Antibiotic(
-                        name=antibiotic_name,
-                        drug_class=record.get('drug_class', '')
-                    )
-                    db.session.add(antibiotic)
-                    db.session.flush()  # Get the ID
-                
-                # Process dates
-                report_date = datetime.utcnow()
-                if 'report_date' in record:
-                    try:
-                        report_date = format_date(record['report_date'])
-                    except:
-                        pass
-                
-                sample_date = None
-                if 'sample_date' in record:
-                    try:
-                        sample_date = format_date(record['sample_date'])
-                    except:
-                        pass
-                
-                # Process patient info (with privacy protections)
-                patient_id = record.get('patient_id', '')
-                if patient_id:
-                    patient_id = hash_patient_id(patient_id)
-                
-                # Create lab report
-                lab_report = LabReport(
-                    report_id=generate_report_id(),
-                    facility_id=facility.id,
-                    user_id=user.id,
-                    report_date=report_date,
-                    sample_collection_date=sample_date,
-                    sample_type=record.get('sample_type', ''),
-                    patient_age=record.get('patient_age'),
-                    patient_gender=record.get('patient_gender', ''),
-                    patient_identifier=patient_id,
-                    clinical_diagnosis=record.get('clinical_diagnosis', '')
-                )
-                db.session.add(lab_report)
-                db.session.flush()  # Get the ID
-                
-                # Create resistance profile
-                resistance_profile = ResistanceProfile(
-                    lab_report_id=lab_report.id,
-                    pathogen_id=pathogen.id,
-                    antibiotic_id=antibiotic.id,
-                    result=record['result'],
-                    mic_value=record.get('mic_value'),
-                    mutation_data=record.get('mutation_data')
-                )
-                db.session.add(resistance_profile)
-                
-                processed_count += 1
-                
-                # Check for critical resistance and create alerts if necessary
-                if record['result'] == 'R' and record.get('is_critical', False):
-                    create_resistance_alert(resistance_profile, facility)
-            
-            except Exception as e:
-                logging.error(f"Error processing record: {str(e)}")
-                continue
+        # Name -> id lookups and inferred date formats shared by all batches of this upload,
+        # and the isolate reports of the previous batch
+        pathogen_ids = {}
+        antibiotic_ids = {}
+        date_formats = {}
+        isolates = {}
         
-        # Commit all changes
-        db.session.commit()
+        for batch in batches:
+            _ingest_chunk(batch, facility, user, pathogen_ids, antibiotic_ids, date_formats, isolates, summary)
+            
+            if progress:
+                progress(summary)
+            
+            db.session.commit()
+            committed = summary['parsed']
+            
+            # Cached dashboard aggregates are stale once the batch is visible
+            bump_data_version()
         
-        return processed_count
+        return summary
     
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error in process_lab_data: {str(e)}")
+        logging.error(f"Error in process_lab_data after {committed} committed rows: {str(e)}")
         raise
 
-def create_resistance_alert(resistance_profile, facility):
+def _ingest_chunk(records, facility, user, pathogen_ids, antibiotic_ids, date_formats, isolates, summary):
+    """Validate one chunk of records and write it with bulk inserts
+    
+    Rows of the same isolate (see _isolate_key) share one lab report.
+    ``isolates`` maps the keys of the previous chunk to their report rows,
+    so an isolate split across a chunk boundary keeps one report; it is
+    replaced by this chunk's keys, which bounds it to one chunk.
+    """
+    offset = summary['parsed']
+    summary['parsed'] += len(records)
+    
+    # Validate records, keeping their position for the rejects report
+    valid = []
+    for position, record in enumerate(records, start=offset + 1):
+        reason = _validate_record(record)
+        if reason:
+            _reject(summary, position, reason)
+        else:
+            valid.append((position, record))
+    
+    # Parse the date columns at once; unparseable dates reject the row
+    dates = {}
+    rejected = np.zeros(len(valid), dtype=bool)
+    for field in DATE_FIELDS:
+        values = [record.get(field) for _, record in valid]
+        if not date_formats.get(field):
+            date_formats[field] = infer_date_format(values)
+        dates[field], invalid = parse_date_column(values, date_formats[field])
+        for index in np.flatnonzero(invalid & ~rejected):
+            position, record = valid[index]
+            _reject(summary, position, f"Invalid {field}: {record.get(field)}")
+        rejected |= invalid
+    
+    valid = [entry for entry, bad in zip(valid, rejected) if not bad]
+    for field in DATE_FIELDS:
+        dates[field] = [value for value, bad in zip(dates[field], rejected) if not bad]
+    
+    if not valid:
+        return
+    
+    records = [record for _, record in valid]
+    
+    # Resolve pathogen and antibiotic names, creating missing ones in one batch
+    _resolve_names(Pathogen, pathogen_ids, records, 'pathogen', lambda record: {
+        'name': record['pathogen'],
+        'scientific_name': _clean(record.get('scientific_name')) or '',
+        'pathogen_type': _clean(record.get('pathogen_type')) or ''
+    })
+    _resolve_names(Antibiotic, antibiotic_ids, records, 'antibiotic', lambda record: {
+        'name': record['antibiotic'],
+        'drug_class': _clean(record.get('drug_class')) or ''
+    })
+    
+    # Pseudonymize the chunk's patient identifiers, each distinct one once
+    patient_ids = hash_patient_ids([_clean(record.get('patient_id')) for record in records])
+    
+    # One report per isolate; its first row supplies the report columns
+    report_rows = []
+    chunk_isolates = {}
+    record_reports = []
+    now = datetime.utcnow()
+    for record, report_date, sample_date, patient_id in zip(
+            records, dates['report_date'], dates['sample_date'], patient_ids):
+        specimen_id = _clean(record.get('specimen_id'))
+        sample_type = _clean(record.get('sample_type')) or ''
+        key = _isolate_key(patient_id, sample_date, sample_type, specimen_id, pathogen_ids[record['pathogen']])
+        
+        report = None
+        if key:
+            report = chunk_isolates.get(key) or isolates.get(key)
+        if report is None:
+            patient_age = _clean(record.get('patient_age'))
+            
+            report = {
+                'report_id': generate_report_id(),
+                'facility_id': facility.id,
+                'user_id': user.id,
+                # Reports without a report date are dated on arrival
+                'report_date': report_date or now,
+                'sample_collection_date': sample_date,
+                'sample_type': sample_type,
+                'specimen_id': str(specimen_id) if specimen_id is not None else None,
+                'patient_age': int(float(patient_age)) if patient_age is not None else None,
+                'patient_gender': _clean(record.get('patient_gender')) or '',
+                'patient_identifier': patient_id,
+                'clinical_diagnosis': _clean(record.get('clinical_diagnosis')) or ''
+            }
+            report_rows.append(report)
+        if key:
+            chunk_isolates[key] = report
+        
+        record_reports.append(report)
+    
+    try:
+        # A savepoint per chunk keeps earlier chunks when one chunk fails
+        with db.session.begin_nested():
+            if report_rows:
+                report_ids = db.session.scalars(
+                    db.insert(LabReport).returning(LabReport.id, sort_by_parameter_order=True),
+                    [{column: value for column, value in report.items() if column != 'id'} for report in report_rows]
+                ).all()
+                for report, report_id in zip(report_rows, report_ids):
+                    report['id'] = report_id
+            
+            profile_rows = [{
+                'lab_report_id': report['id'],
+                'pathogen_id': pathogen_ids[record['pathogen']],
+                'antibiotic_id': antibiotic_ids[record['antibiotic']],
+                'result': record['result'],
+                'mic_value': _to_float(record.get('mic_value')),
+                'mutation_data': _clean(record.get('mutation_data'))
+            } for report, record in zip(record_reports, records)]
+            
+            db.session.execute(db.insert(ResistanceProfile), profile_rows)
+            
+            # Keep the dashboard rollups in step with the raw rows
+            update_rollups(
+                (report['report_date'].date(), facility.id, profile['pathogen_id'],
+                 profile['antibiotic_id'], profile['result'])
+                for report, profile in zip(record_reports, profile_rows)
+            )
+            
+            # Update the outbreak series touched by this chunk
+            touched_series = update_outbreak_series(
+                ((report['report_date'].date(), profile['pathogen_id'], profile['result'])
+                 for report, profile in zip(record_reports, profile_rows)),
+                facility
+            )
+    
+    except SQLAlchemyError as e:
+        logging.error(f"Error inserting lab data chunk: {str(e)}")
+        for position, _ in valid:
+            _reject(summary, position, "Database error while inserting record")
+        return
+    
+    # The next chunk attaches its rows to these reports
+    isolates.clear()
+    isolates.update(chunk_isolates)
+    
+    summary['inserted'] += len(records)
+    summary['outbreak_series'].update(touched_series)
+    summary['antibiogram_periods'].update(
+        ((report['sample_collection_date'] or report['report_date']).year, profile['pathogen_id'])
+        for report, profile in zip(record_reports, profile_rows)
+    )
+    
+    # Check for critical resistance and create alerts if necessary,
+    # one per pathogen/antibiotic pair however many records hit it
+    critical = Counter(
+        (pathogen_ids[record['pathogen']], antibiotic_ids[record['antibiotic']])
+        for record in records
+        if record['result'] == 'R' and _is_true(record.get('is_critical'))
+    )
+    for (pathogen_id, antibiotic_id), occurrences in critical.items():
+        create_resistance_alert(pathogen_id, antibiotic_id, facility, occurrences)
+
+def _validate_record(record):
+    """Normalize a record in place and return a reject reason, if any"""
+    # Check if required fields are present
+    missing = [field for field in REQUIRED_FIELDS if _clean(record.get(field)) is None]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    
+    record['pathogen'] = str(record['pathogen']).strip()
+    record['antibiotic'] = str(record['antibiotic']).strip()
+    record['result'] = str(record['result']).strip().upper()
+    
+    if record['result'] not in VALID_RESULTS:
+        return f"Invalid result: {record['result']}"
+    
+    patient_age = _clean(record.get('patient_age'))
+    if patient_age is not None:
+        try:
+            int(float(patient_age))
+        except (TypeError, ValueError):
+            return f"Invalid patient age: {patient_age}"
+    
+    try:
+        _to_float(record.get('mic_value'))
+    except ValueError:
+        return f"Invalid MIC value: {record.get('mic_value')}"
+    
+    return None
+
+def _isolate_key(patient_id, sample_date, sample_type, specimen_id, pathogen_id):
+    """Key grouping the rows of one isolate, or None if a row cannot be grouped
+    
+    Rows without a patient identifier or specimen ID could belong to
+    anyone, and rows without a sample date to any culture of the patient,
+    so each of them keeps a report of its own.
+    """
+    if sample_date is None or (not patient_id and specimen_id is None):
+        return None
+    return (patient_id, sample_date, sample_type, None if specimen_id is None else str(specimen_id), pathogen_id)
+
+def _resolve_names(model, ids_by_name, records, field, build_row):
+    """Fill ids_by_name for the names used in records, inserting missing rows"""
+    names = {record[field] for record in records} - ids_by_name.keys()
+    if not names:
+        return
+    
+    # One query for every name not seen in an earlier chunk
+    for row_id, name in db.session.query(model.id, model.name).filter(model.name.in_(names)):
+        ids_by_name.setdefault(name, row_id)
+    
+    # One multi-row insert for the names that do not exist yet
+    missing = {}
+    for record in records:
+        name = record[field]
+        if name not in ids_by_name and name not in missing:
+            missing[name] = build_row(record)
+    
+    if missing:
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            
+            # A concurrent upload may create the same names first; names are unique
+            stmt = insert(model).on_conflict_do_nothing(index_elements=[model.name])
+        else:
+            stmt = db.insert(model)
+        db.session.execute(stmt, list(missing.values()))
+        
+        # Read the ids back, whichever upload inserted the rows
+        for row_id, name in db.session.query(model.id, model.name).filter(model.name.in_(list(missing))):
+            ids_by_name[name] = row_id
+
+def _reject(summary, position, reason):
+    """Record a rejected input row"""
+    summary['rejected'] += 1
+    summary['rejects'].append({'row': position, 'reason': reason})
+    logging.warning(f"Rejected lab record {position}: {reason}")
+
+def _clean(value):
+    """Return None for missing values (including pandas NaN), else the value"""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str) and not value.strip():
+        return None
+    return value
+
+def _to_float(value):
+    """Convert an optional numeric field to float"""
+    value = _clean(value)
+    return float(value) if value is not None else None
+
+def _is_true(value):
+    """Interpret boolean flags from JSON (bools) and CSV (strings)"""
+    value = _clean(value)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'y', '1')
+    return bool(value)
+
+def create_resistance_alert(pathogen_id, antibiotic_id, facility, occurrences=1):
     """Create alerts for critical resistance patterns"""
     try:
         # Get related objects
-        pathogen = Pathogen.query.get(resistance_profile.pathogen_id)
-        antibiotic = Antibiotic.query.get(resistance_profile.antibiotic_id)
+        pathogen = Pathogen.query.get(pathogen_id)
+        antibiotic = Antibiotic.query.get(antibiotic_id)
         
         # Create alert
         alert = Alert(
@@ -147,19 +376,9 @@ def create_resistance_alert(resistance_profile, facility):
             antibiotic_id=antibiotic.id
         )
         
-        # Create alerts for relevant users
-        # Alert doctors and public health officials
-        relevant_users = User.query.filter(
-            User.role.in_([UserRole.DOCTOR, UserRole.PUBLIC_HEALTH_OFFICIAL])
-        ).all()
-        
-        for user in relevant_users:
-            alert_copy = Alert(**alert.__dict__)
-            alert_copy.user_id = user.id
-            db.session.add(alert_copy)
-        
-        db.session.flush()
-        
+        # Alert doctors and public health officials, merging repeats into an open alert
+        raise_alert(alert, user_ids_with_roles([UserRole.DOCTOR, UserRole.PUBLIC_HEALTH_OFFICIAL]), occurrences)
+    
     except Exception as e:
         logging.error(f"Error creating resistance alert: {str(e)}")
 
@@ -188,17 +407,14 @@ def process_environmental_sample(data, user_id):
             # Get or create pathogen
             pathogen_name = data.get('pathogen_name')
             if pathogen_name:
-                pathogen = Pathogen.query.filter_by(name=pathogen_name).first()
-                if not pathogen:
-                    pathogen = Pathogen(
-                        name=pathogen_name,
-                        scientific_name=data.get('scientific_name', ''),
-                        pathogen_type=data.get('pathogen_type', 'bacteria')
-                    )
-                    db.session.add(pathogen)
-                    db.session.flush()
+                pathogen_ids = {}
+                _resolve_names(Pathogen, pathogen_ids, [{'pathogen': pathogen_name}], 'pathogen', lambda record: {
+                    'name': pathogen_name,
+                    'scientific_name': data.get('scientific_name', ''),
+                    'pathogen_type': data.get('pathogen_type', 'bacteria')
+                })
                 
-                pathogen_id = pathogen.id
+                pathogen_id = pathogen_ids[pathogen_name]
                 pathogen_load = data.get('pathogen_load')
         
         # Create environmental sample record
@@ -219,12 +435,15 @@ def process_environmental_sample(data, user_id):
         db.session.add(sample)
         db.session.commit()
         
+        # The resistance map includes environmental samples
+        bump_data_version()
+        
         # Create alert if pathogen detected
         if pathogen_detected and pathogen_id:
             create_environmental_alert(sample)
         
         return sample.id
-        
+    
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error in process_environmental_sample: {str(e)}")
@@ -261,18 +480,60 @@ def create_environmental_alert(sample):
             pathogen_id=pathogen.id
         )
         
-        # Alert public health officials
-        users = User.query.filter_by(role=UserRole.PUBLIC_HEALTH_OFFICIAL).all()
-        for user in users:
-            alert_copy = Alert(**alert.__dict__)
-            alert_copy.user_id = user.id
-            db.session.add(alert_copy)
+        # Alert public health officials, merging repeats into an open alert
+        raise_alert(alert, user_ids_with_roles([UserRole.PUBLIC_HEALTH_OFFICIAL]))
         
         db.session.commit()
-        
+    
     except Exception as e:
         logging.error(f"Error creating environmental alert: {str(e)}")
 
+def check_for_outbreaks(series=None):
+    """Check for potential outbreaks based on recent data
+    
+    When ``series`` (the outbreak_series set from an ingest summary) is
+    given only those series are re-scored; otherwise the whole window is.
+    """
+    try:
+        if series is not None:
+            # Re-score only the series touched by the new data
+            prune_outbreak_series(OUTBREAK_WINDOW_DAYS)
+            db.session.commit()
+            potential_outbreaks = detect_outbreaks(series)
+        else:
+            # Use machine learning model to predict outbreaks
+            potential_outbreaks = predict_outbreak()
+        
+        if potential_outbreaks:
+            # Send alert to all public health officials
+            users = User.query.filter_by(role=UserRole.PUBLIC_HEALTH_OFFICIAL).all()
+            
+            for outbreak in potential_outbreaks:
+                # Create alerts for the outbreak
+                alert = Alert(
+                    title=f"Potential {outbreak['pathogen']} outbreak detected",
+                    message=f"Our system has detected a potential outbreak of {outbreak['pathogen']} in {outbreak['location']}. " +
+                            f"Resistance level: {outbreak['resistance_level']}. Please take appropriate measures.",
+                    alert_type="outbreak",
+                    severity=outbreak['severity'],
+                    latitude=outbreak['latitude'],
+                    longitude=outbreak['longitude'],
+                    region=outbreak['location'],
+                    pathogen_id=outbreak['pathogen_id']
+                )
+                
+                alert, created = raise_alert(alert, [user.id for user in users])
+                
+                # Send notification (email, SMS, etc.) only for a new alert
+                if created:
+                    for user in users:
+                        send_alert(user, alert)
+                
+                db.session.commit()
+    
+    except Exception as e:
+        logging.error(f"Error checking for outbreaks: {str(e)}")
+
 def generate_resistance_map():
     """Generate geospatial data for resistance mapping"""
     try:
@@ -282,27 +543,32 @@ def generate_resistance_map():
             Facility.city, Facility.state, Facility.country
         ).all()
         
+        # Resistance counts for every facility and pathogen in one grouped query
+        resistance_rows = db.session.query(
+            ResistanceRollup.facility_id,
+            Pathogen.name,
+            db.func.sum(ResistanceRollup.total).label('total'),
+            db.func.sum(ResistanceRollup.resistant).label('resistant')
+        ).join(
+            ResistanceRollup, ResistanceRollup.pathogen_id == Pathogen.id
+        ).group_by(
+            ResistanceRollup.facility_id,
+            Pathogen.name
+        ).all()
+        
+        # Build per-facility pathogen breakdowns in a single pass
+        resistance_by_facility = {}
+        for row in resistance_rows:
+            resistance_by_facility.setdefault(row.facility_id, []).append(row)
+        
         map_data = []
         
         for facility in facilities:
             # Skip facilities without coordinates
             if not facility.latitude or not facility.longitude:
                 continue
-                
-            # Get resistance data for this facility
-            resistance_data = db.session.query(
-                Pathogen.name, 
-                db.func.count(ResistanceProfile.id).label('total'),
-                db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant')
-            ).join(
-                ResistanceProfile, ResistanceProfile.pathogen_id == Pathogen.id
-            ).join(
-                LabReport, LabReport.id == ResistanceProfile.lab_report_id
-            ).filter(
-                LabReport.facility_id == facility.id
-            ).group_by(
-                Pathogen.name
-            ).all()
+            
+            resistance_data = resistance_by_facility.get(facility.id, [])
             
             # Calculate overall resistance percentage
             total_samples = sum(row.total for row in resistance_data)
@@ -402,7 +668,7 @@ def generate_resistance_map():
             })
         
         return map_data
-        
+    
     except Exception as e:
         logging.error(f"Error generating resistance map: {str(e)}")
         return []
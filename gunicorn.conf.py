@@ -0,0 +1,33 @@
+# Gunicorn settings for the AMR Early Warning System
+import os
+import subprocess
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Alert streams (/alerts/stream) and long polls hold a request open, so the
+# default sync worker (one request at a time) would stall every other page.
+# Threaded workers serve those alongside normal requests; an idle stream is a
+# sleeping thread, so the pool is sized for hundreds of clinicians per worker.
+# The app keeps 32 threads free for pages (ALERT_STREAM_MAX_CLIENTS).
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 256))
+
+# With threaded workers this is the worker heartbeat timeout, not a per-request
+# limit; streams end themselves after ALERT_STREAM_MAX_SECONDS
+timeout = 30
+
+def on_starting(server):
+    """Migrate the database and settle interrupted ingest jobs, once per server
+    
+    Runs in the master before any worker exists, so no job it finds running
+    is still alive and the derived-table backfills run once, not in every
+    worker. Separate processes keep the app out of the master.
+    """
+    environment = dict(os.environ, AUTO_MIGRATE='false')
+    for command in ('upgrade-db', 'recover-ingest-jobs'):
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', command], env=environment, check=True)
+    
+    # Workers inherit this and skip the migration at import
+    os.environ['AUTO_MIGRATE'] = 'false'
@@ -0,0 +1,249 @@
+import os
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.utils import secure_filename
+
+from app import db
+from models import IngestJob, Facility
+from utils import ALLOWED_EXTENSIONS, iter_csv_batches, iter_json_batches
+from data_processing import process_lab_batches, check_for_outbreaks
+from antibiogram import request_refresh
+
+logger = logging.getLogger(__name__)
+
+# Worker pool shared by all background work in this process
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the process-wide worker pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('INGEST_WORKERS', 2),
+                thread_name_prefix='amr-worker'
+            )
+    return _executor
+
+def submit(func, *args):
+    """Run func(*args) on the worker pool inside an application context"""
+    app = current_app._get_current_object()
+    
+    def run():
+        with app.app_context():
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Background task {func.__name__} failed: {str(e)}")
+            finally:
+                db.session.remove()
+    
+    return get_executor().submit(run)
+
+def get_upload_folder():
+    """Return the upload spool directory, creating it if needed"""
+    folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
+    if not os.path.isabs(folder):
+        folder = os.path.join(current_app.instance_path, folder)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def enqueue_ingest_job(file, facility_id, user_id):
+    """Spool an uploaded file to disk and queue it for background ingest
+    
+    Raises ValueError for an unsupported file type or an unknown facility,
+    before anything is written.
+    """
+    # Take the extension from the original name; secure_filename drops
+    # non-ASCII characters and can take the dot with them
+    file_format = os.path.splitext(file.filename or '')[1][1:].lower()
+    if file_format not in ALLOWED_EXTENSIONS:
+        raise ValueError('Unsupported file format')
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(f".{file_format}"):
+        filename = f"upload.{file_format}"
+    
+    try:
+        facility = Facility.query.get(int(facility_id))
+    except (TypeError, ValueError):
+        facility = None
+    if facility is None:
+        raise ValueError('Please select a valid facility')
+    
+    # Stream the upload to disk so the request never holds the whole file
+    file_path = os.path.join(get_upload_folder(), f"{uuid.uuid4().hex}.{file_format}")
+    file.save(file_path)
+    
+    job = IngestJob(
+        user_id=user_id,
+        facility_id=facility.id,
+        filename=filename,
+        file_path=file_path,
+        file_format=file_format,
+        status='queued'
+    )
+    db.session.add(job)
+    db.session.commit()
+    
+    submit(run_ingest_job, job.id)
+    
+    return job
+
+def run_ingest_job(job_id):
+    """Ingest a spooled upload, recording progress on the job row"""
+    # Claim the job so it only runs once even if it is submitted twice
+    claimed = IngestJob.query.filter_by(id=job_id, status='queued').update({
+        'status': 'running',
+        'started_at': datetime.utcnow()
+    })
+    db.session.commit()
+    if not claimed:
+        return
+    
+    job = IngestJob.query.get(job_id)
+    max_rejects = current_app.config.get('INGEST_MAX_STORED_REJECTS', 100)
+    
+    def record_progress(summary):
+        # Committed together with the batch it describes
+        job.rows_parsed = summary['parsed']
+        job.rows_inserted = summary['inserted']
+        job.rows_rejected = summary['rejected']
+        job.rejects = json.dumps(summary['rejects'][:max_rejects])
+    
+    try:
+        batch_size = current_app.config.get('INGEST_CHUNK_SIZE', 1000)
+        
+        # Wide (one row per isolate) files are melted to long records by the parsers
+        antibiotic_codes = current_app.config.get('ANTIBIOTIC_CODES')
+        organism_codes = current_app.config.get('ORGANISM_CODES')
+        
+        with open(job.file_path, 'rb') as stream:
+            if job.file_format == 'csv':
+                batches = iter_csv_batches(stream, batch_size, antibiotic_codes, organism_codes)
+            else:
+                batches = iter_json_batches(stream, batch_size, antibiotic_codes, organism_codes)
+            
+            summary = process_lab_batches(batches, job.facility_id, job.user_id, progress=record_progress)
+        
+        # Re-score the outbreak series this file touched
+        check_for_outbreaks(summary['outbreak_series'])
+        
+        # Recompute the antibiogram years and pathogens the file added isolates to
+        request_refresh(summary['antibiogram_periods'])
+        
+        job.status = 'completed'
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Ingest job {job_id} failed: {str(e)}")
+        _fail_job(job, str(e))
+    
+    finally:
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        
+        try:
+            os.remove(job.file_path)
+        except OSError as e:
+            logger.warning(f"Could not remove spooled upload {job.file_path}: {str(e)}")
+
+def _fail_job(job, error):
+    """Mark a job failed, noting the rows its committed batches saved"""
+    job.status = 'failed'
+    job.error = error
+    
+    # Batches committed before the failure are kept; the progress counters,
+    # reloaded by the rollback, still describe them
+    if job.rows_parsed:
+        job.error += f" (rows 1-{job.rows_parsed} were saved before the failure)"
+
+def recover_ingest_jobs():
+    """Resolve ingest jobs left behind when the server last stopped
+    
+    Jobs still running then may have committed part of their file, so they
+    are marked failed rather than run again, and spooled files that no
+    queued job refers to are removed. This assumes no worker is running
+    jobs, so it runs once per server before any worker starts (the
+    gunicorn on_starting hook, or ``flask recover-ingest-jobs``); queued
+    jobs are picked up by the workers with resume_queued_jobs.
+    """
+    try:
+        for job in IngestJob.query.filter_by(status='running'):
+            _fail_job(job, 'Interrupted by a server restart')
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        
+        # Files of queued and running jobs are kept, whatever happens to be running by now
+        spooled = {
+            os.path.abspath(file_path) for file_path, in db.session.query(IngestJob.file_path).filter(
+                IngestJob.status.in_(['queued', 'running']),
+                IngestJob.file_path.isnot(None)
+            )
+        }
+        
+        folder = get_upload_folder()
+        for name in os.listdir(folder):
+            path = os.path.abspath(os.path.join(folder, name))
+            if path not in spooled and os.path.isfile(path):
+                os.remove(path)
+                logger.info(f"Removed orphaned spooled upload {path}")
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error recovering ingest jobs: {str(e)}")
+
+def resume_queued_jobs():
+    """Submit the queued ingest jobs to this process's worker pool
+    
+    Safe in every worker: the claim in run_ingest_job lets only one of
+    them run each job.
+    """
+    try:
+        queued = [job_id for job_id, in db.session.query(IngestJob.id).filter_by(status='queued')]
+        for job_id in queued:
+            submit(run_ingest_job, job_id)
+        if queued:
+            logger.info(f"Resubmitted {len(queued)} queued ingest jobs")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error resuming queued ingest jobs: {str(e)}")
+
+@click.command('recover-ingest-jobs')
+@with_appcontext
+def recover_ingest_jobs_command():
+    """Fail ingest jobs interrupted by a shutdown and remove orphaned uploads."""
+    recover_ingest_jobs()
+
+def job_status(job):
+    """Serialize an ingest job for the progress API"""
+    elapsed = None
+    throughput = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        if elapsed > 0:
+            throughput = round(job.rows_parsed / elapsed, 1)
+    
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'rows_parsed': job.rows_parsed,
+        'rows_inserted': job.rows_inserted,
+        'rows_rejected': job.rows_rejected,
+        'rejects': json.loads(job.rejects) if job.rejects else [],
+        'error': job.error,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        'started_at': job.started_at.strftime('%Y-%m-%d %H:%M:%S') if job.started_at else None,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+        'elapsed_seconds': round(elapsed, 2) if elapsed is not None else None,
+        'rows_per_second': throughput
+    }
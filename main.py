@@ -1,4 +1,10 @@
 from app import app
+from jobs import resume_queued_jobs
+
+# Pick up uploads still queued when the server last stopped; interrupted
+# ones are settled once per server by the gunicorn on_starting hook
+with app.app_context():
+    resume_queued_jobs()
 
 # This file is used by gunicorn to run the application
 if __name__ == "__main__":
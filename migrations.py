@@ -0,0 +1,196 @@
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.schema import CreateColumn
+
+from app import db
+from models import Alert, LabReport
+
+logger = logging.getLogger(__name__)
+
+def upgrade_database():
+    """Bring the database schema up to date with models.py
+    
+    Creates missing tables, adds missing nullable columns to existing tables
+    and creates any index that does not exist yet, recreating indexes that
+    have been made unique since. Every step is idempotent, so this is safe
+    to run on each deploy.
+    """
+    engine = db.engine
+    existing_tables = set(db.inspect(engine).get_table_names())
+    
+    # New tables are created together with their indexes
+    db.metadata.create_all(engine)
+    
+    inspector = db.inspect(engine)
+    changes = 0
+    
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            # Columns added to models after the table was created
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.warning(f"Cannot add NOT NULL column {table.name}.{column.name} without a server default")
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {engine.dialect.identifier_preparer.format_table(table)} ADD COLUMN {ddl}')
+                logger.info(f"Added column {table.name}.{column.name}")
+                changes += 1
+    
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            # Indexes declared after the table was created, or made unique since
+            existing_indexes = {index['name']: index['unique'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes and (existing_indexes[index.name] or not index.unique):
+                    continue
+                if index.unique and _has_duplicates(connection, index):
+                    logger.warning(f"Cannot create unique index {index.name}: {table.name} has duplicate "
+                                   f"{', '.join(column.name for column in index.columns)} values to merge first")
+                    continue
+                if index.name in existing_indexes:
+                    index.drop(connection)
+                index.create(connection)
+                logger.info(f"Created index {index.name}")
+                changes += 1
+    
+    changes += _migrate_alert_recipients(engine)
+    changes += _rekey_patient_identifiers(engine)
+    
+    # Derived tables start out empty; fill them from existing rows
+    if not {'resistance_rollup', 'outbreak_series_day'} <= existing_tables:
+        from rollups import rebuild_rollups
+        rebuild_rollups()
+        changes += 1
+    if 'alert_counter' not in existing_tables:
+        from alerting import reconcile_alert_counters
+        reconcile_alert_counters()
+        changes += 1
+    if 'cumulative_antibiogram' not in existing_tables:
+        from antibiogram import rebuild_antibiogram
+        rebuild_antibiogram()
+        changes += 1
+    
+    return changes
+
+def _has_duplicates(connection, index):
+    """Whether the table holds rows that would violate a unique index"""
+    columns = list(index.columns)
+    duplicate = connection.execute(
+        db.select(*columns).group_by(*columns).having(db.func.count() > 1).limit(1)
+    ).first()
+    return duplicate is not None
+
+def _rekey_patient_identifiers(engine, batch_size=10000):
+    """Re-key patient identifiers stored by the legacy SHA256(id + salt) scheme
+    
+    Those hashes cannot be reversed, but the current pseudonym is derived
+    from them, so each is re-keyed in place and the patient's old and new
+    reports keep matching. Uses the configured PATIENT_ID_SALT, which must be
+    the salt the old rows were hashed with.
+    """
+    from utils import get_patient_hasher, PATIENT_ID_VERSION
+    
+    hasher = get_patient_hasher()
+    table = LabReport.__table__
+    rekeyed = 0
+    
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                db.select(table.c.id, table.c.patient_identifier).where(
+                    table.c.patient_id_version.is_(None)
+                ).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            
+            connection.execute(
+                table.update().where(table.c.id == db.bindparam('row_id')).values(
+                    patient_identifier=db.bindparam('identifier'),
+                    patient_id_version=PATIENT_ID_VERSION
+                ),
+                [{
+                    'row_id': row_id,
+                    'identifier': hasher.rekey(identifier) if identifier else identifier
+                } for row_id, identifier in rows]
+            )
+            rekeyed += len(rows)
+    
+    if rekeyed:
+        logger.info(f"Re-keyed {rekeyed} legacy patient identifiers")
+    return 1 if rekeyed else 0
+
+# Per-user columns that used to live on the alert table
+LEGACY_ALERT_COLUMNS = ('user_id', 'read', 'action_taken')
+
+def _migrate_alert_recipients(engine):
+    """Move per-user alert state from legacy alert columns to alert_recipient"""
+    inspector = db.inspect(engine)
+    existing_columns = {column['name'] for column in inspector.get_columns('alert')}
+    if 'user_id' not in existing_columns:
+        return 0
+    
+    preparer = engine.dialect.identifier_preparer
+    changes = 0
+    
+    # Older databases may lack the read/action_taken flags altogether
+    flags = ', '.join(
+        f'COALESCE({preparer.quote(column)}, FALSE)' if column in existing_columns else 'FALSE'
+        for column in ('read', 'action_taken')
+    )
+    
+    with engine.begin() as connection:
+        result = connection.exec_driver_sql(
+            'INSERT INTO alert_recipient (alert_id, user_id, "read", action_taken, created_at) '
+            f'SELECT id, user_id, {flags}, created_at '
+            'FROM alert WHERE user_id IS NOT NULL AND NOT EXISTS ('
+            'SELECT 1 FROM alert_recipient WHERE alert_recipient.alert_id = alert.id)'
+        )
+        logger.info(f"Copied {result.rowcount} alert deliveries to alert_recipient")
+        changes += 1
+    
+    for index in inspector.get_indexes('alert'):
+        if set(index['column_names']) & set(LEGACY_ALERT_COLUMNS):
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f'DROP INDEX {preparer.quote(index["name"])}')
+    
+    if engine.dialect.name == 'sqlite':
+        # SQLite cannot drop a column referenced by a foreign key, so copy
+        # the alert table without the legacy columns instead
+        rebuilt = Alert.__table__.to_metadata(db.metadata, name='alert__rebuild')
+        columns = ', '.join(preparer.quote(column.name) for column in rebuilt.columns)
+        
+        # Index names are schema-wide and still taken by the old table, so
+        # the indexes are created once it has been replaced
+        rebuilt.indexes.clear()
+        try:
+            with engine.begin() as connection:
+                rebuilt.create(connection)
+                connection.exec_driver_sql(f'INSERT INTO alert__rebuild ({columns}) SELECT {columns} FROM alert')
+                connection.exec_driver_sql('DROP TABLE alert')
+                connection.exec_driver_sql('ALTER TABLE alert__rebuild RENAME TO alert')
+                for index in Alert.__table__.indexes:
+                    index.create(connection)
+        finally:
+            db.metadata.remove(rebuilt)
+    else:
+        with engine.begin() as connection:
+            for column in LEGACY_ALERT_COLUMNS:
+                if column in existing_columns:
+                    connection.exec_driver_sql(f'ALTER TABLE alert DROP COLUMN {preparer.quote(column)}')
+    logger.info("Dropped legacy per-user columns from alert")
+    changes += 1
+    
+    return changes
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables, columns and indexes."""
+    changes = upgrade_database()
+    click.echo(f"Database schema up to date ({changes} changes applied)")
@@ -5,7 +5,21 @@ from datetime import datetime, timedelta
 import json
 
 from app import db
-from models import ResistanceProfile, LabReport, Facility, Pathogen, Antibiotic
+from models import Facility, Pathogen, ResistanceRollup, OutbreakSeriesDay
+from utils import batched
+from antibiogram import antibiogram_for
+
+# Outbreak detection thresholds
+OUTBREAK_WINDOW_DAYS = 30  # days of history scored per series
+OUTBREAK_MIN_DAYS = 3  # observed days per series
+OUTBREAK_MIN_SAMPLES = 10  # samples per series over the window
+OUTBREAK_MIN_RESISTANCE = 50  # latest resistance percentage
+OUTBREAK_MIN_INCREASE = 15  # percentage points above the previous average
+
+SERIES_KEYS = ['state', 'city', 'pathogen_id', 'pathogen_name']
+
+# Series looked up per query by detect_outbreaks
+SERIES_QUERY_CHUNK = 500
 
 def predict_outbreak():
     """
@@ -14,27 +28,25 @@ def predict_outbreak():
     """
     try:
         # Get data from the past 30 days
-        cutoff_date = datetime.utcnow() - timedelta(days=30)
+        cutoff_date = (datetime.utcnow() - timedelta(days=OUTBREAK_WINDOW_DAYS)).date()
         
-        # Query for resistance data by location, pathogen, and date
-        query = db.session.query(
+        # Query the daily rollups by location, pathogen, and date
+        query = db.select(
             Facility.state,
             Facility.city,
             Facility.latitude,
             Facility.longitude,
             Pathogen.id.label('pathogen_id'),
             Pathogen.name.label('pathogen_name'),
-            db.func.date(LabReport.report_date).label('date'),
-            db.func.count(ResistanceProfile.id).label('total_samples'),
-            db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant_samples')
+            ResistanceRollup.day.label('date'),
+            db.func.sum(ResistanceRollup.total).label('total_samples'),
+            db.func.sum(ResistanceRollup.resistant).label('resistant_samples')
         ).join(
-            LabReport, Facility.id == LabReport.facility_id
+            ResistanceRollup, Facility.id == ResistanceRollup.facility_id
         ).join(
-            ResistanceProfile, LabReport.id == ResistanceProfile.lab_report_id
-        ).join(
-            Pathogen, ResistanceProfile.pathogen_id == Pathogen.id
+            Pathogen, ResistanceRollup.pathogen_id == Pathogen.id
         ).filter(
-            LabReport.report_date >= cutoff_date
+            ResistanceRollup.day >= cutoff_date
         ).group_by(
             Facility.state,
             Facility.city,
@@ -42,130 +54,149 @@ def predict_outbreak():
             Facility.longitude,
             Pathogen.id,
             Pathogen.name,
-            db.func.date(LabReport.report_date)
-        ).all()
+            ResistanceRollup.day
+        )
         
-        # Convert to pandas DataFrame for analysis
-        columns = ['state', 'city', 'latitude', 'longitude', 'pathogen_id', 'pathogen_name', 'date', 'total_samples', 'resistant_samples']
-        df = pd.DataFrame([{c: getattr(row, c) for c in columns} for row in query])
+        # Load the result straight into columnar form
+        df = pd.read_sql(query, db.session.connection())
         
         if df.empty:
             logging.info("No data available for outbreak prediction")
             return []
         
-        # Calculate resistance percentage
-        df['resistance_percentage'] = (df['resistant_samples'] / df['total_samples']) * 100
-        
-        # Convert date column to datetime
-        df['date'] = pd.to_datetime(df['date'])
-        
-        # Identify potential outbreaks
-        potential_outbreaks = []
-        
-        # Group by location and pathogen
-        for (state, city, path_id, path_name), group in df.groupby(['state', 'city', 'pathogen_id', 'pathogen_name']):
-            # Sort by date
-            group = group.sort_values('date')
-            
-            # Minimum number of samples needed for outbreak detection
-            if len(group) < 3 or group['total_samples'].sum() < 10:
-                continue
-                
-            # Check for increased resistance trend
-            if len(group) >= 3:
-                # Calculate 7-day moving average
-                group['rolling_resistance'] = group['resistance_percentage'].rolling(window=min(3, len(group)), min_periods=1).mean()
-                
-                # Check if current resistance is significantly higher than the past
-                latest = group.iloc[-1]
-                previous_avg = group.iloc[:-1]['resistance_percentage'].mean() if len(group) > 1 else 0
-                
-                # Check if there's a significant increase
-                threshold = 15  # percentage points
-                if latest['resistance_percentage'] > 50 and (latest['resistance_percentage'] - previous_avg) > threshold:
-                    # Get latest lat/long
-                    lat = latest['latitude']
-                    lng = latest['longitude']
-                    
-                    # Calculate severity (1-5 scale)
-                    severity = 3  # Default medium severity
-                    
-                    if latest['resistance_percentage'] > 80:
-                        severity = 5  # Very high
-                    elif latest['resistance_percentage'] > 60:
-                        severity = 4  # High
-                    
-                    # Add to potential outbreaks
-                    outbreak = {
-                        'pathogen': path_name,
-                        'pathogen_id': path_id,
-                        'location': f"{city}, {state}",
-                        'latitude': lat,
-                        'longitude': lng,
-                        'resistance_level': f"{latest['resistance_percentage']:.1f}%",
-                        'severity': severity,
-                        'total_samples': int(latest['total_samples']),
-                        'resistant_samples': int(latest['resistant_samples']),
-                        'date': latest['date'].strftime('%Y-%m-%d')
-                    }
-                    
-                    potential_outbreaks.append(outbreak)
-        
-        return potential_outbreaks
+        return score_outbreak_series(df)
         
     except Exception as e:
         logging.error(f"Error in predict_outbreak: {str(e)}")
         return []
 
-def get_treatment_recommendations(pathogen_id, region=None):
+def detect_outbreaks(series):
     """
-    Get treatment recommendations based on local resistance patterns
+    Incrementally re-score only the given (state, city, pathogen_id) series
+    Reads at most OUTBREAK_WINDOW_DAYS daily counters per series from the
+    outbreak series state table, so cost follows the size of the new batch
     """
+    if not series:
+        return []
+    
     try:
-        # Get antibiotic resistance data for this pathogen
-        query = db.session.query(
-            Antibiotic.id,
-            Antibiotic.name,
-            db.func.count(ResistanceProfile.id).label('total_samples'),
-            db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant_samples')
-        ).join(
-            ResistanceProfile, ResistanceProfile.antibiotic_id == Antibiotic.id
-        ).filter(
-            ResistanceProfile.pathogen_id == pathogen_id
-        )
+        cutoff_date = (datetime.utcnow() - timedelta(days=OUTBREAK_WINDOW_DAYS)).date()
+        series_key = db.tuple_(OutbreakSeriesDay.state, OutbreakSeriesDay.city, OutbreakSeriesDay.pathogen_id)
         
-        # Filter by region if provided
-        if region:
-            query = query.join(
-                LabReport, ResistanceProfile.lab_report_id == LabReport.id
+        frames = []
+        for chunk in batched(sorted(series), SERIES_QUERY_CHUNK):
+            query = db.select(
+                OutbreakSeriesDay.state,
+                OutbreakSeriesDay.city,
+                OutbreakSeriesDay.latitude,
+                OutbreakSeriesDay.longitude,
+                OutbreakSeriesDay.pathogen_id,
+                Pathogen.name.label('pathogen_name'),
+                OutbreakSeriesDay.day.label('date'),
+                OutbreakSeriesDay.total.label('total_samples'),
+                OutbreakSeriesDay.resistant.label('resistant_samples')
             ).join(
-                Facility, LabReport.facility_id == Facility.id
+                Pathogen, OutbreakSeriesDay.pathogen_id == Pathogen.id
             ).filter(
-                Facility.state == region
+                OutbreakSeriesDay.day >= cutoff_date,
+                series_key.in_(chunk)
             )
+            frames.append(pd.read_sql(query, db.session.connection()))
         
-        # Group by antibiotic
-        query = query.group_by(
-            Antibiotic.id,
-            Antibiotic.name
-        ).all()
+        df = pd.concat(frames, ignore_index=True)
+        if df.empty:
+            return []
+        
+        return score_outbreak_series(df)
+        
+    except Exception as e:
+        logging.error(f"Error in detect_outbreaks: {str(e)}")
+        return []
+
+def score_outbreak_series(df):
+    """
+    Score daily (location, pathogen) resistance series for outbreaks
+    Expects the columns in SERIES_KEYS plus latitude, longitude, date,
+    total_samples and resistant_samples; all series are scored at once
+    """
+    df = df.dropna(subset=SERIES_KEYS)
+    df = df[df['total_samples'] > 0].copy()
+    if df.empty:
+        return []
+    
+    # Calculate resistance percentage
+    df['date'] = pd.to_datetime(df['date'])
+    df['resistance_percentage'] = (df['resistant_samples'] / df['total_samples']) * 100
+    df = df.sort_values(SERIES_KEYS + ['date'], kind='stable')
+    
+    # Per-series size, sample count and percentage sum
+    grouped = df.groupby(SERIES_KEYS, sort=False)
+    df['days'] = grouped['date'].transform('size')
+    df['series_samples'] = grouped['total_samples'].transform('sum')
+    df['percentage_sum'] = grouped['resistance_percentage'].transform('sum')
+    
+    # Latest observation per series, compared with the mean of the earlier ones
+    latest = df.drop_duplicates(SERIES_KEYS, keep='last')
+    previous_days = (latest['days'] - 1).where(latest['days'] > 1)
+    previous_avg = ((latest['percentage_sum'] - latest['resistance_percentage']) / previous_days).fillna(0)
+    
+    is_outbreak = (
+        (latest['days'] >= OUTBREAK_MIN_DAYS) &
+        (latest['series_samples'] >= OUTBREAK_MIN_SAMPLES) &
+        (latest['resistance_percentage'] > OUTBREAK_MIN_RESISTANCE) &
+        (latest['resistance_percentage'] - previous_avg > OUTBREAK_MIN_INCREASE)
+    )
+    outbreaks = latest[is_outbreak]
+    
+    # Calculate severity (1-5 scale)
+    percentage = outbreaks['resistance_percentage'].to_numpy()
+    severity = np.select([percentage > 80, percentage > 60], [5, 4], default=3)
+    
+    potential_outbreaks = []
+    for row, row_severity in zip(outbreaks.itertuples(index=False), severity):
+        potential_outbreaks.append({
+            'pathogen': row.pathogen_name,
+            'pathogen_id': int(row.pathogen_id),
+            'location': f"{row.city}, {row.state}",
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'resistance_level': f"{row.resistance_percentage:.1f}%",
+            'severity': int(row_severity),
+            'total_samples': int(row.total_samples),
+            'resistant_samples': int(row.resistant_samples),
+            'date': row.date.strftime('%Y-%m-%d')
+        })
+    
+    return potential_outbreaks
+
+def get_treatment_recommendations(pathogen_id, region=None):
+    """
+    Get treatment recommendations based on local resistance patterns
+    
+    Reads the latest cumulative antibiogram, so repeat cultures from the
+    same patient do not inflate resistance.
+    """
+    try:
+        # First-isolate susceptibility for this pathogen, region-wide if given
+        period, stats = antibiogram_for(pathogen_id, region=region)
         
         # Calculate resistance percentages
         recommendations = []
         
-        for row in query:
-            if row.total_samples > 0:
-                resistance_percentage = (row.resistant_samples / row.total_samples) * 100
-                
-                recommendation = {
-                    'antibiotic_id': row.id,
-                    'antibiotic_name': row.name,
-                    'resistance_percentage': resistance_percentage,
-                    'total_samples': row.total_samples,
-                    'effectiveness': 'High' if resistance_percentage < 20 else 'Medium' if resistance_percentage < 50 else 'Low'
-                }
-                
-                recommendations.append(recommendation)
+        for stat in stats:
+            resistance_percentage = (stat['resistant'] / stat['total']) * 100
+            
+            recommendation = {
+                'antibiotic_id': stat['antibiotic_id'],
+                'antibiotic_name': stat['antibiotic'],
+                'resistance_percentage': resistance_percentage,
+                'total_samples': stat['total'],
+                'period': period,
+                'sufficient_data': stat['sufficient'],
+                'effectiveness': 'High' if resistance_percentage < 20 else 'Medium' if resistance_percentage < 50 else 'Low'
+            }
+            
+            recommendations.append(recommendation)
         
         # Sort by effectiveness (most effective first)
         recommendations.sort(key=lambda x: x['resistance_percentage'])
@@ -31,11 +31,11 @@ class User(UserMixin, db.Model):
     
     # Relationships
     reports = db.relationship('LabReport', backref='submitted_by', lazy='dynamic')
-    alerts_received = db.relationship('Alert', foreign_keys='Alert.user_id', backref='user', lazy='dynamic')
+    alerts_received = db.relationship('AlertRecipient', backref='user', lazy='dynamic')
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
-        
+    
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
@@ -49,7 +49,7 @@ class Facility(db.Model):
     facility_type = db.Column(db.String(50))  # hospital, lab, clinic, etc.
     address = db.Column(db.String(200))
     city = db.Column(db.String(100))
-    state = db.Column(db.String(100))
+    state = db.Column(db.String(100), index=True)  # region used by dashboards
     country = db.Column(db.String(100))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
@@ -66,7 +66,7 @@ class Facility(db.Model):
 # Pathogen model
 class Pathogen(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, unique=True, index=True)  # get-or-create lookup key
     scientific_name = db.Column(db.String(150))
     pathogen_type = db.Column(db.String(50))  # bacteria, virus, fungus, etc.
     description = db.Column(db.Text)
@@ -80,7 +80,7 @@ class Pathogen(db.Model):
 # Antibiotic model
 class Antibiotic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, unique=True, index=True)  # get-or-create lookup key
     drug_class = db.Column(db.String(100))
     description = db.Column(db.Text)
     
@@ -92,16 +92,25 @@ class Antibiotic(db.Model):
 
 # Lab report model
 class LabReport(db.Model):
+    __table_args__ = (
+        # Facility filters, optionally ordered or bounded by date
+        db.Index('ix_lab_report_facility_date', 'facility_id', 'report_date'),
+        # Keyset pagination on (report_date, id)
+        db.Index('ix_lab_report_date_id', 'report_date', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     report_id = db.Column(db.String(50), unique=True)
     facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    report_date = db.Column(db.DateTime, default=datetime.utcnow)
+    report_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     sample_collection_date = db.Column(db.DateTime)
     sample_type = db.Column(db.String(50))  # blood, urine, etc.
+    specimen_id = db.Column(db.String(100))  # laboratory specimen/accession number
     patient_age = db.Column(db.Integer)
     patient_gender = db.Column(db.String(20))
     patient_identifier = db.Column(db.String(100))  # hashed identifier
+    patient_id_version = db.Column(db.Integer, default=2)  # utils.PATIENT_ID_VERSION; NULL for legacy hashes
     clinical_diagnosis = db.Column(db.String(200))
     
     # Relationships
@@ -112,10 +121,15 @@ class LabReport(db.Model):
 
 # Resistance profile model
 class ResistanceProfile(db.Model):
+    __table_args__ = (
+        # Pathogen/antibiotic susceptibility breakdowns
+        db.Index('ix_resistance_profile_pathogen_antibiotic_result', 'pathogen_id', 'antibiotic_id', 'result'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    lab_report_id = db.Column(db.Integer, db.ForeignKey('lab_report.id'), nullable=False)
+    lab_report_id = db.Column(db.Integer, db.ForeignKey('lab_report.id'), nullable=False, index=True)
     pathogen_id = db.Column(db.Integer, db.ForeignKey('pathogen.id'), nullable=False)
-    antibiotic_id = db.Column(db.Integer, db.ForeignKey('antibiotic.id'), nullable=False)
+    antibiotic_id = db.Column(db.Integer, db.ForeignKey('antibiotic.id'), nullable=False, index=True)
     
     # Susceptibility result (R: Resistant, I: Intermediate, S: Susceptible)
     result = db.Column(db.String(1), nullable=False)
@@ -131,17 +145,97 @@ class ResistanceProfile(db.Model):
     def __repr__(self):
         return f'<ResistanceProfile {self.id}>'
 
-# Alert model for notification system
+# Daily S/I/R counts per facility, pathogen and antibiotic, maintained on ingest
+class ResistanceRollup(db.Model):
+    __table_args__ = (
+        # Upsert key; also serves date-range scans
+        db.UniqueConstraint('day', 'facility_id', 'pathogen_id', 'antibiotic_id'),
+        db.Index('ix_resistance_rollup_pathogen_antibiotic', 'pathogen_id', 'antibiotic_id'),
+        db.Index('ix_resistance_rollup_facility', 'facility_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)  # date of LabReport.report_date
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
+    pathogen_id = db.Column(db.Integer, db.ForeignKey('pathogen.id'), nullable=False)
+    antibiotic_id = db.Column(db.Integer, db.ForeignKey('antibiotic.id'), nullable=False)
+    
+    susceptible = db.Column(db.Integer, nullable=False, default=0)
+    intermediate = db.Column(db.Integer, nullable=False, default=0)
+    resistant = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ResistanceRollup {self.day} {self.facility_id}/{self.pathogen_id}/{self.antibiotic_id}>'
+
+# Daily S/R counters per (state, city, pathogen) series for incremental outbreak scoring
+class OutbreakSeriesDay(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('state', 'city', 'pathogen_id', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    state = db.Column(db.String(100), nullable=False)
+    city = db.Column(db.String(100), nullable=False)
+    pathogen_id = db.Column(db.Integer, db.ForeignKey('pathogen.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False, index=True)
+    
+    total = db.Column(db.Integer, nullable=False, default=0)
+    resistant = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Coordinates of the most recently reporting facility
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    
+    def __repr__(self):
+        return f'<OutbreakSeriesDay {self.city}, {self.state} {self.pathogen_id} {self.day}>'
+
+# Cumulative antibiogram (first isolate per patient, CLSI M39) per year and scope;
+# facility rows have a facility_id, region rows only a region, overall rows neither
+class Antibiogram(db.Model):
+    # The legacy 'antibiogram' table of older databases has a different layout
+    __tablename__ = 'cumulative_antibiogram'
+    __table_args__ = (
+        # Treatment guidance lookup
+        db.Index('ix_cumulative_antibiogram_pathogen_period', 'pathogen_id', 'period', 'region', 'facility_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.Integer, nullable=False)  # calendar year of sample collection
+    region = db.Column(db.String(100))  # Facility.state
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'))
+    pathogen_id = db.Column(db.Integer, db.ForeignKey('pathogen.id'), nullable=False)
+    antibiotic_id = db.Column(db.Integer, db.ForeignKey('antibiotic.id'), nullable=False)
+    
+    # Results of the first isolates tested against the antibiotic
+    susceptible = db.Column(db.Integer, nullable=False, default=0)
+    intermediate = db.Column(db.Integer, nullable=False, default=0)
+    resistant = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Antibiogram {self.period} {self.region}/{self.facility_id} {self.pathogen_id}/{self.antibiotic_id}>'
+
+# Alert model for notification system, stored once per alert
 class Alert(db.Model):
+    __table_args__ = (
+        # Open-alert lookup when coalescing repeat detections
+        db.Index('ix_alert_coalesce_key_last_seen', 'coalesce_key', 'last_seen_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     message = db.Column(db.Text, nullable=False)
     alert_type = db.Column(db.String(50))  # outbreak, new resistance, etc.
     severity = db.Column(db.Integer)  # 1-5 scale
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    read = db.Column(db.Boolean, default=False)
-    action_taken = db.Column(db.Boolean, default=False)
+    
+    # Coalescing of repeat detections (alert_type, pathogen, antibiotic, region)
+    coalesce_key = db.Column(db.String(300))
+    occurrence_count = db.Column(db.Integer, default=1)
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Geographic information
     latitude = db.Column(db.Float)
@@ -155,10 +249,65 @@ class Alert(db.Model):
     # Relationships
     pathogen = db.relationship('Pathogen')
     antibiotic = db.relationship('Antibiotic')
+    recipients = db.relationship('AlertRecipient', backref='alert', lazy='dynamic')
     
     def __repr__(self):
         return f'<Alert {self.id}: {self.title}>'
 
+# Per-user delivery state of an alert
+class AlertRecipient(db.Model):
+    __table_args__ = (
+        # Per-user unread lists and counts, newest first
+        db.Index('ix_alert_recipient_user_read_created', 'user_id', 'read', 'created_at'),
+        # Keyset pagination of a user's alerts on (created_at, alert_id)
+        db.Index('ix_alert_recipient_user_created_alert', 'user_id', 'created_at', 'alert_id'),
+    )
+    
+    alert_id = db.Column(db.Integer, db.ForeignKey('alert.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    read = db.Column(db.Boolean, nullable=False, default=False)
+    action_taken = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # copy of Alert.created_at for ordering
+    
+    def __repr__(self):
+        return f'<AlertRecipient {self.alert_id} -> {self.user_id}>'
+
+# Per-user unread alert counts by severity, kept in step with alert_recipient
+class AlertCounter(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    severity = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 for alerts without one
+    unread = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<AlertCounter {self.user_id} severity {self.severity}: {self.unread}>'
+
+# Outbound notification waiting for (or done with) delivery by notifications.py
+class NotificationOutbox(db.Model):
+    __table_args__ = (
+        # Dispatcher scan for due messages
+        db.Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    alert_id = db.Column(db.Integer, db.ForeignKey('alert.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    channel = db.Column(db.String(20), nullable=False)  # email, sms, push
+    recipient = db.Column(db.String(200), nullable=False)  # address, phone number or user id
+    subject = db.Column(db.String(300))
+    body = db.Column(db.Text)
+    
+    # Delivery state
+    status = db.Column(db.String(20), default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)  # lease expiry while sending
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<NotificationOutbox {self.id} {self.channel} {self.status}>'
+
 # Treatment Guideline model
 class TreatmentGuideline(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -198,3 +347,31 @@ class EnvironmentalSample(db.Model):
     
     def __repr__(self):
         return f'<EnvironmentalSample {self.sample_id}>'
+
+# Background ingest job for an uploaded lab data file
+class IngestJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facility.id'), nullable=False)
+    filename = db.Column(db.String(255))
+    file_path = db.Column(db.String(500))  # spooled upload on local disk
+    file_format = db.Column(db.String(10))  # csv, json
+    status = db.Column(db.String(20), default='queued')  # queued, running, completed, failed
+    
+    # Progress counters, updated after every committed batch
+    rows_parsed = db.Column(db.Integer, default=0)
+    rows_inserted = db.Column(db.Integer, default=0)
+    rows_rejected = db.Column(db.Integer, default=0)
+    rejects = db.Column(db.Text)  # JSON list of the first rejected rows
+    error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    # Relationships
+    submitted_by = db.relationship('User')
+    facility = db.relationship('Facility')
+    
+    def __repr__(self):
+        return f'<IngestJob {self.id}: {self.status}>'
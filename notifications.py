@@ -0,0 +1,353 @@
+import logging
+import smtplib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+import requests
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('email', 'sms', 'push')
+
+# Transports
+
+class LogTransport:
+    """Local stub transport that logs and prints messages instead of sending them"""
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def send_batch(self, channel, messages):
+        for message in messages:
+            logger.info(f"{channel} notification to {message['recipient']}: {message['subject']}")
+            print(f"[{channel.upper()}] To: {message['recipient']}, Subject: {message['subject']}, Body: {message['body']}")
+        return {message['id']: None for message in messages}
+
+class StubTransport:
+    """In-memory transport for tests that records messages and fails on demand
+    
+    Messages to a recipient listed in NOTIFY_STUB_FAIL_RECIPIENTS fail one
+    by one; NOTIFY_STUB_UNAVAILABLE makes every call raise, like a provider
+    that cannot be reached.
+    """
+    
+    sent = []  # (channel, message) pairs, shared by every instance
+    _lock = threading.Lock()
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def send_batch(self, channel, messages):
+        if self.config.get('NOTIFY_STUB_UNAVAILABLE'):
+            raise ConnectionError("Stub transport unavailable")
+        
+        failing = self.config.get('NOTIFY_STUB_FAIL_RECIPIENTS', ())
+        results = {}
+        with self._lock:
+            for message in messages:
+                if message['recipient'] in failing:
+                    results[message['id']] = f"Stub rejected {message['recipient']}"
+                else:
+                    self.sent.append((channel, message))
+                    results[message['id']] = None
+        return results
+
+class SMTPTransport:
+    """Send an email batch over one SMTP connection"""
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def send_batch(self, channel, messages):
+        results = {}
+        with smtplib.SMTP(self.config['NOTIFY_SMTP_HOST'], self.config['NOTIFY_SMTP_PORT'], timeout=30) as smtp:
+            if self.config.get('NOTIFY_SMTP_USE_TLS'):
+                smtp.starttls()
+            if self.config.get('NOTIFY_SMTP_USERNAME'):
+                smtp.login(self.config['NOTIFY_SMTP_USERNAME'], self.config['NOTIFY_SMTP_PASSWORD'])
+            
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.config['NOTIFY_SENDER']
+                email['To'] = message['recipient']
+                email['Subject'] = message['subject']
+                email.set_content(message['body'] or '')
+                try:
+                    smtp.send_message(email)
+                    results[message['id']] = None
+                except smtplib.SMTPException as e:
+                    results[message['id']] = str(e)
+        return results
+
+class HTTPTransport:
+    """POST a batch as JSON to an SMS/push gateway (or a local stub server)"""
+    
+    def __init__(self, config):
+        self.config = config
+    
+    def send_batch(self, channel, messages):
+        url = self.config.get('NOTIFY_HTTP_URL')
+        if not url:
+            raise RuntimeError("NOTIFY_HTTP_URL is not configured")
+        
+        response = requests.post(
+            f"{url.rstrip('/')}/{channel}",
+            json={'messages': messages},
+            timeout=self.config.get('NOTIFY_HTTP_TIMEOUT', 10)
+        )
+        response.raise_for_status()
+        
+        # Gateways may report per-message failures as {"errors": {"<id>": "reason"}}
+        errors = {}
+        if response.content:
+            try:
+                errors = response.json().get('errors') or {}
+            except (ValueError, AttributeError):
+                errors = {}
+        return {message['id']: errors.get(str(message['id'])) for message in messages}
+
+TRANSPORTS = {
+    'log': LogTransport,
+    'stub': StubTransport,
+    'smtp': SMTPTransport,
+    'http': HTTPTransport
+}
+
+def get_transport(channel, config):
+    """Return the transport configured for a channel"""
+    name = config.get(f'NOTIFY_{channel.upper()}_TRANSPORT', 'log')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown notification transport: {name}")
+    return TRANSPORTS[name](config)
+
+# Outbox
+
+def enqueue_notifications(user, alert):
+    """Queue an alert for delivery to a user in the caller's transaction
+    
+    Messages are sent by the dispatcher once the transaction commits.
+    """
+    messages = []
+    
+    if user.email:
+        messages.append(NotificationOutbox(
+            channel='email',
+            recipient=user.email,
+            subject=f"AMR Alert: {alert.title}",
+            body=alert.message
+        ))
+    
+    # SMS notification for high severity alerts
+    if user.phone_number and alert.severity and alert.severity >= 4:
+        messages.append(NotificationOutbox(
+            channel='sms',
+            recipient=user.phone_number,
+            subject=f"AMR Alert: {alert.title[:50]}",
+            body=f"AMR Alert: {alert.title[:50]}..."
+        ))
+    
+    # Push notification (if using Firebase)
+    if current_app.config.get('FIREBASE_INITIALIZED', False):
+        messages.append(NotificationOutbox(
+            channel='push',
+            recipient=str(user.id),
+            subject=alert.title,
+            body=alert.message[:100]
+        ))
+    
+    for message in messages:
+        message.alert_id = alert.id
+        message.user_id = user.id
+    db.session.add_all(messages)
+    
+    # Ask for a dispatch after this transaction commits
+    db.session.info['notifications_pending'] = True
+    return messages
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_after_commit(session):
+    if session.info.pop('notifications_pending', False):
+        try:
+            request_dispatch()
+        except Exception as e:
+            logger.error(f"Could not schedule notification dispatch: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('notifications_pending', None)
+
+# Dispatcher
+
+_dispatch_lock = threading.Lock()
+_dispatch_requested = threading.Event()
+
+def request_dispatch():
+    """Drain the outbox on the background worker pool"""
+    from jobs import submit
+    submit(dispatch_pending)
+
+def dispatch_pending():
+    """Send every due outbox message, one dispatcher per process at a time"""
+    _dispatch_requested.set()
+    if not _dispatch_lock.acquire(blocking=False):
+        # The running dispatcher will pick up the new messages
+        return 0
+    
+    sent = 0
+    try:
+        while _dispatch_requested.is_set():
+            _dispatch_requested.clear()
+            while True:
+                batch_sent, claimed = _dispatch_claimed_batch()
+                sent += batch_sent
+                if not claimed:
+                    break
+    finally:
+        _dispatch_lock.release()
+    
+    _schedule_retry()
+    return sent
+
+def _dispatch_claimed_batch():
+    """Claim one batch of due messages, send it and record the results"""
+    config = current_app.config
+    now = datetime.utcnow()
+    batch_size = config.get('NOTIFY_BATCH_SIZE', 100)
+    
+    # Due messages include those whose "sending" lease expired
+    due_ids = [message_id for (message_id,) in db.session.query(NotificationOutbox.id).filter(
+        NotificationOutbox.status.in_(['pending', 'sending']),
+        NotificationOutbox.next_attempt_at <= now
+    ).order_by(NotificationOutbox.next_attempt_at).limit(batch_size * config.get('NOTIFY_MAX_PARALLEL', 4))]
+    if not due_ids:
+        return 0, 0
+    
+    # Claim with a conditional update so concurrent dispatchers never share a message
+    token = uuid.uuid4().hex
+    NotificationOutbox.query.filter(
+        NotificationOutbox.id.in_(due_ids),
+        NotificationOutbox.status.in_(['pending', 'sending']),
+        NotificationOutbox.next_attempt_at <= now
+    ).update({
+        'status': 'sending',
+        'claim_token': token,
+        'next_attempt_at': now + timedelta(seconds=config.get('NOTIFY_LEASE_SECONDS', 300))
+    }, synchronize_session=False)
+    db.session.commit()
+    
+    messages = NotificationOutbox.query.filter_by(claim_token=token, status='sending').all()
+    if not messages:
+        return 0, len(due_ids)
+    
+    # Batch per channel, then send the batches with bounded parallelism
+    batches = []
+    for channel in CHANNELS:
+        payload = [{
+            'id': message.id,
+            'recipient': message.recipient,
+            'subject': message.subject,
+            'body': message.body
+        } for message in messages if message.channel == channel]
+        for start in range(0, len(payload), batch_size):
+            batches.append((channel, payload[start:start + batch_size]))
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=config.get('NOTIFY_MAX_PARALLEL', 4)) as pool:
+        futures = [(pool.submit(_send_batch, channel, payload, config), payload) for channel, payload in batches]
+        for future, payload in futures:
+            results.update(future.result())
+    
+    sent = 0
+    finished_at = datetime.utcnow()
+    max_attempts = config.get('NOTIFY_MAX_ATTEMPTS', 5)
+    for message in messages:
+        error = results.get(message.id, 'No result from transport')
+        message.attempts = (message.attempts or 0) + 1
+        message.claim_token = None
+        if error is None:
+            message.status = 'sent'
+            message.sent_at = finished_at
+            message.last_error = None
+            sent += 1
+        elif message.attempts >= max_attempts:
+            message.status = 'failed'
+            message.last_error = error
+            logger.error(f"Giving up on {message.channel} notification {message.id}: {error}")
+        else:
+            # Exponential backoff before the next attempt
+            delay = config.get('NOTIFY_RETRY_BASE_SECONDS', 30) * 2 ** (message.attempts - 1)
+            message.status = 'pending'
+            message.next_attempt_at = finished_at + timedelta(seconds=delay)
+            message.last_error = error
+    db.session.commit()
+    
+    return sent, len(due_ids)
+
+def _send_batch(channel, payload, config):
+    """Send one channel batch, turning a transport failure into per-message errors"""
+    try:
+        return get_transport(channel, config).send_batch(channel, payload)
+    except Exception as e:
+        logger.warning(f"{channel} transport failed for {len(payload)} messages: {str(e)}")
+        return {message['id']: str(e) for message in payload}
+
+_retry_timer = None
+
+def _schedule_retry():
+    """Wake the dispatcher when the next backed-off message becomes due"""
+    global _retry_timer
+    next_attempt = db.session.query(db.func.min(NotificationOutbox.next_attempt_at)).filter(
+        NotificationOutbox.status.in_(['pending', 'sending'])
+    ).scalar()
+    db.session.commit()
+    if next_attempt is None:
+        return
+    
+    app = current_app._get_current_object()
+    delay = max((next_attempt - datetime.utcnow()).total_seconds(), 1)
+    
+    def wake():
+        with app.app_context():
+            request_dispatch()
+    
+    if _retry_timer is not None:
+        _retry_timer.cancel()
+    _retry_timer = threading.Timer(delay, wake)
+    _retry_timer.daemon = True
+    _retry_timer.start()
+
+def delivery_status(alert_id):
+    """Count outbox messages for an alert by channel and status"""
+    rows = db.session.query(
+        NotificationOutbox.channel,
+        NotificationOutbox.status,
+        db.func.count(NotificationOutbox.id)
+    ).filter(
+        NotificationOutbox.alert_id == alert_id
+    ).group_by(
+        NotificationOutbox.channel,
+        NotificationOutbox.status
+    ).all()
+    
+    status = {}
+    for channel, state, count in rows:
+        status.setdefault(channel, {})[state] = count
+    return status
+
+@click.command('dispatch-notifications')
+@with_appcontext
+def dispatch_notifications_command():
+    """Send all due notifications from the outbox."""
+    sent = dispatch_pending()
+    click.echo(f"Sent {sent} notifications")
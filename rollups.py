@@ -0,0 +1,209 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+
+from app import db
+from models import ResistanceRollup, OutbreakSeriesDay, ResistanceProfile, LabReport, Facility
+from cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+# Rollup column incremented for each susceptibility result
+RESULT_COLUMNS = {'S': 'susceptible', 'I': 'intermediate', 'R': 'resistant'}
+
+ROLLUP_KEY = ('day', 'facility_id', 'pathogen_id', 'antibiotic_id')
+
+# Unique key of the outbreak series state table
+SERIES_KEY = ('state', 'city', 'pathogen_id', 'day')
+
+def update_rollups(results):
+    """Add results to the daily rollups inside the caller's transaction
+
+    ``results`` is an iterable of (day, facility_id, pathogen_id,
+    antibiotic_id, result) tuples; they are aggregated in memory and applied
+    with one upsert statement.
+    """
+    counts = Counter()
+    for day, facility_id, pathogen_id, antibiotic_id, result in results:
+        if result not in RESULT_COLUMNS:
+            continue
+        counts[(day, facility_id, pathogen_id, antibiotic_id, result)] += 1
+    
+    if not counts:
+        return
+    
+    rows = {}
+    for (day, facility_id, pathogen_id, antibiotic_id, result), count in counts.items():
+        key = (day, facility_id, pathogen_id, antibiotic_id)
+        row = rows.setdefault(key, {
+            'day': day,
+            'facility_id': facility_id,
+            'pathogen_id': pathogen_id,
+            'antibiotic_id': antibiotic_id,
+            'susceptible': 0,
+            'intermediate': 0,
+            'resistant': 0,
+            'total': 0
+        })
+        row[RESULT_COLUMNS[result]] += count
+        row['total'] += count
+    
+    upsert_counters(ResistanceRollup.__table__, ROLLUP_KEY,
+            ('susceptible', 'intermediate', 'resistant', 'total'), list(rows.values()))
+
+def update_outbreak_series(results, facility):
+    """Add one facility's results to the outbreak series counters
+
+    ``results`` is an iterable of (day, pathogen_id, result) tuples. Returns
+    the set of (state, city, pathogen_id) series that were touched.
+    """
+    if not facility.state or not facility.city:
+        return set()
+    
+    rows = {}
+    for day, pathogen_id, result in results:
+        if result not in RESULT_COLUMNS:
+            continue
+        row = rows.setdefault((day, pathogen_id), {
+            'state': facility.state,
+            'city': facility.city,
+            'pathogen_id': pathogen_id,
+            'day': day,
+            'total': 0,
+            'resistant': 0,
+            'latitude': facility.latitude,
+            'longitude': facility.longitude
+        })
+        row['total'] += 1
+        if result == 'R':
+            row['resistant'] += 1
+    
+    if not rows:
+        return set()
+    
+    upsert_counters(OutbreakSeriesDay.__table__, SERIES_KEY, ('total', 'resistant'),
+            list(rows.values()), replace=('latitude', 'longitude'))
+    
+    return {(facility.state, facility.city, pathogen_id) for _, pathogen_id in rows}
+
+def upsert_counters(table, key, counters, rows, replace=()):
+    """Insert rows, adding to the counters (and overwriting the replace
+    columns) of rows whose key already exists"""
+    dialect = db.session.get_bind().dialect.name
+    
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        stmt = insert(table)
+        updates = {column: table.c[column] + stmt.excluded[column] for column in counters}
+        updates.update({column: stmt.excluded[column] for column in replace})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[column] for column in key],
+            set_=updates
+        )
+        db.session.execute(stmt, rows)
+        return
+    
+    # Portable fallback: update in place, insert the keys that were missing
+    for row in rows:
+        updates = {column: table.c[column] + row[column] for column in counters}
+        updates.update({column: row[column] for column in replace})
+        updated = db.session.execute(
+            table.update().where(
+                *[table.c[column] == row[column] for column in key]
+            ).values(updates)
+        ).rowcount
+        if not updated:
+            db.session.execute(table.insert(), row)
+
+def prune_outbreak_series(window_days):
+    """Drop outbreak series counters older than the scoring window"""
+    cutoff = (datetime.utcnow() - timedelta(days=window_days)).date()
+    db.session.execute(db.delete(OutbreakSeriesDay).where(OutbreakSeriesDay.day < cutoff))
+
+def rebuild_rollups():
+    """Recompute all rollups and outbreak series from the raw resistance_profile table"""
+    day = db.func.date(LabReport.report_date)
+    
+    aggregate = db.select(
+        day,
+        LabReport.facility_id,
+        ResistanceProfile.pathogen_id,
+        ResistanceProfile.antibiotic_id,
+        db.func.sum(db.case((ResistanceProfile.result == 'S', 1), else_=0)),
+        db.func.sum(db.case((ResistanceProfile.result == 'I', 1), else_=0)),
+        db.func.sum(db.case((ResistanceProfile.result == 'R', 1), else_=0)),
+        db.func.count(ResistanceProfile.id)
+    ).join(
+        LabReport, LabReport.id == ResistanceProfile.lab_report_id
+    ).filter(
+        ResistanceProfile.result.in_(list(RESULT_COLUMNS))
+    ).group_by(
+        day,
+        LabReport.facility_id,
+        ResistanceProfile.pathogen_id,
+        ResistanceProfile.antibiotic_id
+    )
+    
+    series_day = db.func.date(LabReport.report_date)
+    series = db.select(
+        Facility.state,
+        Facility.city,
+        ResistanceProfile.pathogen_id,
+        series_day,
+        db.func.count(ResistanceProfile.id),
+        db.func.sum(db.case((ResistanceProfile.result == 'R', 1), else_=0)),
+        db.func.max(Facility.latitude),
+        db.func.max(Facility.longitude)
+    ).join(
+        LabReport, LabReport.id == ResistanceProfile.lab_report_id
+    ).join(
+        Facility, Facility.id == LabReport.facility_id
+    ).filter(
+        ResistanceProfile.result.in_(list(RESULT_COLUMNS)),
+        Facility.state.isnot(None),
+        Facility.city.isnot(None)
+    ).group_by(
+        Facility.state,
+        Facility.city,
+        ResistanceProfile.pathogen_id,
+        series_day
+    )
+    
+    try:
+        db.session.execute(db.delete(ResistanceRollup))
+        db.session.execute(
+            db.insert(ResistanceRollup).from_select(
+                list(ROLLUP_KEY) + ['susceptible', 'intermediate', 'resistant', 'total'],
+                aggregate
+            )
+        )
+        
+        db.session.execute(db.delete(OutbreakSeriesDay))
+        db.session.execute(
+            db.insert(OutbreakSeriesDay).from_select(
+                list(SERIES_KEY) + ['total', 'resistant', 'latitude', 'longitude'],
+                series
+            )
+        )
+        db.session.commit()
+        bump_data_version()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error rebuilding resistance rollups: {str(e)}")
+        raise
+    
+    return ResistanceRollup.query.count()
+
+@click.command('rebuild-rollups')
+@with_appcontext
+def rebuild_rollups_command():
+    """Backfill the resistance rollup tables from raw lab data."""
+    count = rebuild_rollups()
+    click.echo(f"Rebuilt {count} resistance rollup rows")
@@ -1,18 +1,22 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session, abort
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import contains_eager
 import os
-import json
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 import logging
 
 from app import db
-from models import User, UserRole, Facility, Pathogen, Antibiotic, LabReport, ResistanceProfile, Alert, TreatmentGuideline, EnvironmentalSample
-from utils import allowed_file, parse_csv, parse_json, send_alert, calculate_resistance_risk
-from data_processing import process_lab_data, generate_resistance_map
-from ml_models import predict_outbreak
+from models import User, UserRole, Facility, Pathogen, LabReport, Alert, AlertRecipient, TreatmentGuideline, EnvironmentalSample, ResistanceRollup
+from utils import allowed_file, calculate_resistance_risk, keyset_paginate
+from alerting import mark_read
+from cache import cached_response, conditional_response
+from data_processing import generate_resistance_map
+from jobs import enqueue_ingest_job
+from analytics import resistance_trend
+from antibiogram import antibiogram_for
 
 # Blueprints
 auth_bp = Blueprint('auth', __name__)
@@ -135,15 +139,19 @@ def update_profile():
 def home():
     # Get resistance statistics
     recent_reports = LabReport.query.order_by(LabReport.report_date.desc()).limit(10).all()
-    resistance_count = ResistanceProfile.query.filter_by(result='R').count()
+    resistance_count = db.session.query(
+        db.func.coalesce(db.func.sum(ResistanceRollup.resistant), 0)
+    ).scalar()
     facility_count = Facility.query.count()
     pathogen_count = Pathogen.query.count()
     
     # Get alerts for the user
-    recent_alerts = Alert.query.filter_by(user_id=current_user.id, read=False).order_by(Alert.created_at.desc()).limit(5).all()
-    
-    # Generate resistance map data
-    map_data = generate_resistance_map()
+    recent_alerts = Alert.query.join(
+        AlertRecipient, AlertRecipient.alert_id == Alert.id
+    ).filter(
+        AlertRecipient.user_id == current_user.id,
+        AlertRecipient.read == False
+    ).order_by(AlertRecipient.created_at.desc()).limit(5).all()
     
     return render_template(
         'dashboard.html',
@@ -151,15 +159,20 @@ def home():
         resistance_count=resistance_count,
         facility_count=facility_count,
         pathogen_count=pathogen_count,
-        recent_alerts=recent_alerts,
-        map_data=json.dumps(map_data)
+        recent_alerts=recent_alerts
     )
 
 @dashboard_bp.route('/map')
 @login_required
 def view_map():
-    map_data = generate_resistance_map()
-    return render_template('maps.html', map_data=json.dumps(map_data))
+    return render_template('maps.html')
+
+@dashboard_bp.route('/api/resistance_map')
+@login_required
+@conditional_response
+@cached_response()
+def resistance_map():
+    return jsonify(generate_resistance_map())
 
 # Data upload and management routes
 @data_bp.route('/upload', methods=['GET', 'POST'])
@@ -178,28 +191,19 @@ def upload_data():
         
         if file and allowed_file(file.filename):
             try:
-                # Process the uploaded file
-                filename = file.filename
                 facility_id = request.form.get('facility_id')
                 
-                if filename.endswith('.csv'):
-                    data = parse_csv(file)
-                elif filename.endswith('.json'):
-                    data = parse_json(file)
-                else:
-                    flash('Unsupported file format', 'danger')
-                    return redirect(request.url)
+                # Spool the file and ingest it (plus the outbreak check) in the background
+                job = enqueue_ingest_job(file, facility_id, current_user.id)
                 
-                # Process the data and save to database
-                processed_count = process_lab_data(data, facility_id, current_user.id)
-                
-                flash(f'Successfully processed {processed_count} records', 'success')
-                
-                # Check for potential outbreaks
-                check_for_outbreaks()
+                flash(f'Upload queued for processing (job #{job.id})', 'success')
                 
                 return redirect(url_for('dashboard.home'))
-                
+            
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(request.url)
+            
             except Exception as e:
                 flash(f'Error processing file: {str(e)}', 'danger')
                 logging.error(f"Data upload error: {str(e)}")
@@ -212,62 +216,34 @@ def upload_data():
     facilities = Facility.query.all()
     return render_template('data_upload.html', facilities=facilities)
 
-def check_for_outbreaks():
-    """Check for potential outbreaks based on recent data"""
-    try:
-        # Use machine learning model to predict outbreaks
-        potential_outbreaks = predict_outbreak()
-        
-        if potential_outbreaks:
-            for outbreak in potential_outbreaks:
-                # Create alerts for the outbreak
-                alert = Alert(
-                    title=f"Potential {outbreak['pathogen']} outbreak detected",
-                    message=f"Our system has detected a potential outbreak of {outbreak['pathogen']} in {outbreak['location']}. " +
-                            f"Resistance level: {outbreak['resistance_level']}. Please take appropriate measures.",
-                    alert_type="outbreak",
-                    severity=outbreak['severity'],
-                    latitude=outbreak['latitude'],
-                    longitude=outbreak['longitude'],
-                    region=outbreak['location'],
-                    pathogen_id=outbreak['pathogen_id']
-                )
-                
-                # Send alert to all public health officials
-                users = User.query.filter_by(role=UserRole.PUBLIC_HEALTH_OFFICIAL).all()
-                for user in users:
-                    alert_copy = Alert(**alert.__dict__)
-                    alert_copy.user_id = user.id
-                    db.session.add(alert_copy)
-                    
-                    # Send notification (email, SMS, etc.)
-                    send_alert(user, alert_copy)
-                
-                db.session.commit()
-    
-    except Exception as e:
-        logging.error(f"Error checking for outbreaks: {str(e)}")
-
 # Alert routes
 @alerts_bp.route('/alerts')
 @login_required
 def view_alerts():
-    page = request.args.get('page', 1, type=int)
-    alerts = Alert.query.filter_by(user_id=current_user.id).order_by(Alert.created_at.desc()).paginate(
-        page=page, per_page=10
+    query = AlertRecipient.query.join(
+        Alert, Alert.id == AlertRecipient.alert_id
+    ).options(
+        contains_eager(AlertRecipient.alert)
+    ).filter(
+        AlertRecipient.user_id == current_user.id
     )
+    try:
+        alerts = keyset_paginate(query, (AlertRecipient.created_at, AlertRecipient.alert_id),
+                                 cursor=request.args.get('cursor'), per_page=10)
+    except ValueError:
+        abort(400)
     return render_template('alerts.html', alerts=alerts)
 
 @alerts_bp.route('/alerts/<int:alert_id>/mark-read', methods=['POST'])
 @login_required
 def mark_alert_read(alert_id):
-    alert = Alert.query.get_or_404(alert_id)
+    recipient = db.session.get(AlertRecipient, (alert_id, current_user.id))
     
-    # Check if alert belongs to current user
-    if alert.user_id != current_user.id:
+    # Check if alert was sent to current user
+    if not recipient:
         abort(403)
     
-    alert.read = True
+    mark_read(recipient)
     db.session.commit()
     
     return jsonify({'success': True})
@@ -275,13 +251,13 @@ def mark_alert_read(alert_id):
 @alerts_bp.route('/alerts/<int:alert_id>/mark-action', methods=['POST'])
 @login_required
 def mark_alert_action(alert_id):
-    alert = Alert.query.get_or_404(alert_id)
+    recipient = db.session.get(AlertRecipient, (alert_id, current_user.id))
     
-    # Check if alert belongs to current user
-    if alert.user_id != current_user.id:
+    # Check if alert was sent to current user
+    if not recipient:
         abort(403)
     
-    alert.action_taken = True
+    recipient.action_taken = True
     db.session.commit()
     
     return jsonify({'success': True})
@@ -376,111 +352,68 @@ def pathogen_guidance(pathogen_id):
     pathogen = Pathogen.query.get_or_404(pathogen_id)
     guidelines = TreatmentGuideline.query.filter_by(pathogen_id=pathogen_id).all()
     
-    # Get resistance data for this pathogen
-    resistance_data = db.session.query(
-        Antibiotic.name,
-        db.func.count(ResistanceProfile.id).label('total'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant')
-    ).join(
-        ResistanceProfile, ResistanceProfile.antibiotic_id == Antibiotic.id
-    ).filter(
-        ResistanceProfile.pathogen_id == pathogen_id
-    ).group_by(
-        Antibiotic.name
-    ).all()
-    
-    # Calculate resistance percentages
-    resistance_stats = []
-    for name, total, resistant in resistance_data:
-        if total > 0:
-            percentage = (resistant / total) * 100
-            resistance_stats.append({
-                'antibiotic': name,
-                'percentage': round(percentage, 1),
-                'total': total,
-                'resistant': resistant
-            })
+    # Get resistance data for this pathogen from the cumulative antibiogram
+    antibiogram_period, resistance_stats = antibiogram_for(pathogen_id, region=request.args.get('region'))
     
     return render_template(
         'treatment_guidance.html',
         pathogen=pathogen,
         guidelines=guidelines,
-        resistance_stats=resistance_stats
+        resistance_stats=resistance_stats,
+        antibiogram_period=antibiogram_period
     )
 
 # API routes for AJAX calls
 
 @dashboard_bp.route('/api/resistance-trends')
 @login_required
+@conditional_response
 def resistance_trends_api():
     # Get resistance trends over time
     # We'll calculate monthly resistance percentages for the past year
     
     try:
-        # Get current date
-        now = datetime.utcnow()
+        # First day of the month eleven months ago
+        today = datetime.utcnow().date()
+        start = today.replace(day=1)
+        for _ in range(11):
+            start = (start - timedelta(days=1)).replace(day=1)
         
-        # Build query for monthly resistance data
-        monthly_data = []
+        trend = resistance_trend(
+            granularity='month',
+            start=start,
+            end=today,
+            facility_id=request.args.get('facility_id', type=int),
+            pathogen_id=request.args.get('pathogen_id', type=int),
+            antibiotic_id=request.args.get('antibiotic_id', type=int)
+        )
         
-        for i in range(11, -1, -1):
-            # Calculate month start and end
-            month_start = datetime(now.year - ((now.month - i - 1) // 12), 
-                                ((now.month - i - 1) % 12) + 1, 1)
-            
-            if i > 0:
-                month_end = datetime(now.year - ((now.month - i) // 12), 
-                                    ((now.month - i) % 12) + 1, 1)
-            else:
-                # Current month - use current date
-                month_end = now
-            
-            # Get counts for this month
-            total_count = db.session.query(db.func.count(ResistanceProfile.id)).join(
-                LabReport, ResistanceProfile.lab_report_id == LabReport.id
-            ).filter(
-                LabReport.report_date >= month_start,
-                LabReport.report_date < month_end
-            ).scalar() or 0
-            
-            resistant_count = db.session.query(db.func.count(ResistanceProfile.id)).join(
-                LabReport, ResistanceProfile.lab_report_id == LabReport.id
-            ).filter(
-                LabReport.report_date >= month_start,
-                LabReport.report_date < month_end,
-                ResistanceProfile.result == 'R'
-            ).scalar() or 0
-            
-            # Calculate percentage
-            percentage = 0
-            if total_count > 0:
-                percentage = (resistant_count / total_count) * 100
-            
-            # Add to monthly data
-            monthly_data.append({
-                'month': month_start.strftime('%b %Y'),
-                'percentage': round(percentage, 1),
-                'total': total_count,
-                'resistant': resistant_count
-            })
+        monthly_data = [{
+            'month': point['bucket'].strftime('%b %Y'),
+            'percentage': round(point['percentage'], 1),
+            'total': point['total'],
+            'resistant': point['resistant']
+        } for point in trend]
         
         return jsonify(monthly_data)
-        
+    
     except Exception as e:
         logging.error(f"Error generating resistance trends: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @dashboard_bp.route('/api/top-pathogens')
 @login_required
+@conditional_response
+@cached_response()
 def top_pathogens_api():
     # Get top pathogens by resistance prevalence
     try:
         top_pathogens = db.session.query(
             Pathogen.name,
-            db.func.count(ResistanceProfile.id).label('total'),
-            db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant')
+            db.func.sum(ResistanceRollup.total).label('total'),
+            db.func.sum(ResistanceRollup.resistant).label('resistant')
         ).join(
-            ResistanceProfile, ResistanceProfile.pathogen_id == Pathogen.id
+            ResistanceRollup, ResistanceRollup.pathogen_id == Pathogen.id
         ).group_by(
             Pathogen.name
         ).order_by(
@@ -499,7 +432,7 @@ def top_pathogens_api():
                 })
         
         return jsonify(result)
-        
+    
     except Exception as e:
         logging.error(f"Error generating top pathogens: {str(e)}")
         return jsonify({'error': str(e)}), 500
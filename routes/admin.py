@@ -4,6 +4,7 @@ from functools import wraps
 
 from app import db
 from models import User, Facility, UserRole
+from cache import bump_data_version
 
 # Helper function to check if user is admin
 def admin_required(f):
@@ -80,6 +81,9 @@ def add_facility():
         db.session.add(facility)
         db.session.commit()
         
+        # Facilities appear on the cached resistance map
+        bump_data_version()
+        
         flash('Facility added successfully', 'success')
         return redirect(url_for('admin.admin_dashboard'))
     
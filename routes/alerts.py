@@ -1,73 +1,120 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, current_app
 from flask_login import login_required, current_user
 import logging
+import queue
+import time
 from datetime import datetime, timedelta
 
+from sqlalchemy.orm import contains_eager
+
 from app import db
-from models import Alert, Pathogen, Antibiotic, User, UserRole
-from utils import send_alert
+from models import Alert, AlertRecipient, Pathogen, Antibiotic, User, UserRole
+from utils import send_alert, keyset_paginate
+from alerting import (
+    fan_out_alert, alert_event, alert_broker, alert_watcher, missed_alert_events, latest_alert_id, format_sse,
+    mark_read, unread_counts
+)
+from notifications import delivery_status
 
 logger = logging.getLogger(__name__)
 
 alerts_bp = Blueprint('alerts', __name__, url_prefix='/alerts')
 
+# Alerts per page; pages are addressed by cursor, not number
+ALERTS_PER_PAGE = 20
+
 @alerts_bp.route('/')
 @login_required
 def alerts_view():
     """View all alerts with filtering options"""
-    # Get filter parameters
-    alert_type = request.args.get('alert_type')
-    severity = request.args.get('severity', type=int)
-    read = request.args.get('read')
-    action_taken = request.args.get('action_taken')
+    current_filters = _alert_filters(request.args)
     
-    # Base query - get alerts for current user
-    query = Alert.query.filter(Alert.user_id == current_user.id)
+    # Execute query with keyset pagination
+    try:
+        alerts = _paginate_alerts(current_filters)
+    except ValueError:
+        flash('That page link is no longer valid', 'warning')
+        return redirect(url_for('alerts.alerts_view', **{k: v for k, v in current_filters.items() if v is not None}))
     
-    # Apply filters
-    if alert_type:
-        query = query.filter(Alert.alert_type == alert_type)
+    # Count unread alerts
+    unread_count, _ = unread_counts(current_user.id)
+    
+    return render_template('alerts.html',
+                          alerts=alerts,
+                          unread_count=unread_count,
+                          current_filters=current_filters)
+
+@alerts_bp.route('/api/list')
+@login_required
+def list_alerts():
+    """API endpoint to page through the current user's alerts"""
+    try:
+        alerts = _paginate_alerts(_alert_filters(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    if severity:
-        query = query.filter(Alert.severity == severity)
+    return jsonify({
+        'alerts': [dict(alert_event(recipient.alert),
+                        read=recipient.read,
+                        action_taken=recipient.action_taken) for recipient in alerts.items],
+        'next_cursor': alerts.next_cursor,
+        'prev_cursor': alerts.prev_cursor,
+        'total': alerts.total
+    })
+
+def _alert_filters(args):
+    """Read the alert list filters from the query string"""
+    return {
+        'alert_type': args.get('alert_type'),
+        'severity': args.get('severity', type=int),
+        'read': args.get('read'),
+        'action_taken': args.get('action_taken')
+    }
+
+def _paginate_alerts(filters):
+    """Return a page of the current user's alerts matching filters"""
+    # Base query - get alerts delivered to current user, loaded with their content
+    query = AlertRecipient.query.join(
+        Alert, Alert.id == AlertRecipient.alert_id
+    ).options(
+        contains_eager(AlertRecipient.alert)
+    ).filter(AlertRecipient.user_id == current_user.id)
     
-    if read is not None:
-        read_bool = read.lower() == 'true'
-        query = query.filter(Alert.read == read_bool)
+    # Apply filters
+    if filters['alert_type']:
+        query = query.filter(Alert.alert_type == filters['alert_type'])
     
-    if action_taken is not None:
-        action_bool = action_taken.lower() == 'true'
-        query = query.filter(Alert.action_taken == action_bool)
+    if filters['severity']:
+        query = query.filter(Alert.severity == filters['severity'])
     
-    # Execute query with pagination
-    page = request.args.get('page', 1, type=int)
-    alerts = query.order_by(Alert.created_at.desc()).paginate(page=page, per_page=20)
+    if filters['read'] is not None:
+        read_bool = filters['read'].lower() == 'true'
+        query = query.filter(AlertRecipient.read == read_bool)
     
-    # Count unread alerts
-    unread_count = Alert.query.filter(Alert.user_id == current_user.id, Alert.read == False).count()
+    if filters['action_taken'] is not None:
+        action_bool = filters['action_taken'].lower() == 'true'
+        query = query.filter(AlertRecipient.action_taken == action_bool)
     
-    return render_template('alerts.html',
-                          alerts=alerts,
-                          unread_count=unread_count,
-                          current_filters={
-                              'alert_type': alert_type,
-                              'severity': severity,
-                              'read': read,
-                              'action_taken': action_taken
-                          })
+    return keyset_paginate(
+        query,
+        (AlertRecipient.created_at, AlertRecipient.alert_id),
+        cursor=request.args.get('cursor'),
+        per_page=ALERTS_PER_PAGE,
+        with_total=request.args.get('with_total', '').lower() == 'true'
+    )
 
 @alerts_bp.route('/acknowledge/<int:alert_id>', methods=['POST'])
 @login_required
 def acknowledge_alert(alert_id):
     """Mark an alert as read"""
-    alert = Alert.query.get_or_404(alert_id)
+    recipient = db.session.get(AlertRecipient, (alert_id, current_user.id))
     
-    # Check if alert belongs to current user
-    if alert.user_id != current_user.id:
+    # Check if alert was sent to current user
+    if not recipient:
         flash('You do not have permission to access this alert', 'danger')
         return redirect(url_for('alerts.alerts_view'))
     
-    alert.read = True
+    mark_read(recipient)
     db.session.commit()
     
     flash('Alert marked as read', 'success')
@@ -77,14 +124,14 @@ def acknowledge_alert(alert_id):
 @login_required
 def resolve_alert(alert_id):
     """Mark an alert as action taken"""
-    alert = Alert.query.get_or_404(alert_id)
+    recipient = db.session.get(AlertRecipient, (alert_id, current_user.id))
     
-    # Check if alert belongs to current user
-    if alert.user_id != current_user.id:
+    # Check if alert was sent to current user
+    if not recipient:
         flash('You do not have permission to access this alert', 'danger')
         return redirect(url_for('alerts.alerts_view'))
     
-    alert.action_taken = True
+    recipient.action_taken = True
     db.session.commit()
     
     flash('Alert marked as resolved', 'success')
@@ -94,15 +141,15 @@ def resolve_alert(alert_id):
 @login_required
 def dismiss_alert(alert_id):
     """Mark an alert as read and action taken"""
-    alert = Alert.query.get_or_404(alert_id)
+    recipient = db.session.get(AlertRecipient, (alert_id, current_user.id))
     
-    # Check if alert belongs to current user
-    if alert.user_id != current_user.id:
+    # Check if alert was sent to current user
+    if not recipient:
         flash('You do not have permission to access this alert', 'danger')
         return redirect(url_for('alerts.alerts_view'))
     
-    alert.read = True
-    alert.action_taken = True
+    mark_read(recipient)
+    recipient.action_taken = True
     db.session.commit()
     
     flash('Alert dismissed', 'success')
@@ -132,20 +179,19 @@ def create_alert():
         else:
             users = User.query.filter(User.role == UserRole(target_role), User.is_active == True).all()
         
-        # Create alerts for each user
+        # Store the alert once and deliver it to each user
+        alert = Alert(
+            title=title,
+            message=message,
+            alert_type=alert_type,
+            severity=severity,
+            pathogen_id=pathogen_id if pathogen_id else None,
+            antibiotic_id=antibiotic_id if antibiotic_id else None
+        )
+        fan_out_alert(alert, [user.id for user in users])
+        
+        # Send notifications
         for user in users:
-            alert = Alert(
-                user_id=user.id,
-                title=title,
-                message=message,
-                alert_type=alert_type,
-                severity=severity,
-                pathogen_id=pathogen_id if pathogen_id else None,
-                antibiotic_id=antibiotic_id if antibiotic_id else None
-            )
-            db.session.add(alert)
-            
-            # Send notifications
             send_alert(user, alert)
         
         db.session.commit()
@@ -167,11 +213,13 @@ def get_latest_alerts():
     """API endpoint to get latest alerts for notification checks"""
     # Get alerts from the last 24 hours that are unread
     since = datetime.now() - timedelta(days=1)
-    alerts = Alert.query.filter(
-        Alert.user_id == current_user.id,
-        Alert.read == False,
-        Alert.created_at >= since
-    ).order_by(Alert.created_at.desc()).all()
+    alerts = Alert.query.join(
+        AlertRecipient, AlertRecipient.alert_id == Alert.id
+    ).filter(
+        AlertRecipient.user_id == current_user.id,
+        AlertRecipient.read == False,
+        AlertRecipient.created_at >= since
+    ).order_by(AlertRecipient.created_at.desc()).all()
     
     results = []
     for alert in alerts:
@@ -181,46 +229,179 @@ def get_latest_alerts():
             'message': alert.message,
             'alert_type': alert.alert_type,
             'severity': alert.severity,
-            'created_at': alert.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            'created_at': alert.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'occurrence_count': alert.occurrence_count or 1,
+            'last_seen_at': alert.last_seen_at.strftime('%Y-%m-%d %H:%M:%S') if alert.last_seen_at else None
         })
     
     return jsonify(results)
 
+@alerts_bp.route('/stream')
+@login_required
+def alert_stream():
+    """Server-Sent Events stream of new alerts for the current user
+    
+    Each open stream holds a worker thread, so streams are capped per
+    process and closed after a while; EventSource reconnects and resumes
+    with Last-Event-ID. Idle streams make no database queries; alerts from
+    other processes arrive through the per-process alert_watcher.
+    """
+    user_id = current_user.id
+    config = current_app.config
+    app = current_app._get_current_object()
+    after_id = _event_id(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    
+    # Subscribe before the resume query so nothing falls in between
+    subscription = alert_broker.subscribe(user_id, config.get('ALERT_STREAM_QUEUE_SIZE', 100),
+                                          limit=config.get('ALERT_STREAM_MAX_CLIENTS'))
+    if subscription is None:
+        # Every stream slot is taken; the client falls back to polling
+        return Response(status=503, headers={'Retry-After': str(config.get('ALERT_BUSY_RETRY_SECONDS', 30))})
+    
+    try:
+        missed = missed_alert_events(user_id, after_id)
+        start_id = after_id if after_id is not None else latest_alert_id()
+        alert_watcher.ensure_running(app, start_id)
+    except Exception:
+        alert_broker.unsubscribe(user_id, subscription)
+        raise
+    
+    # Idle connections must not hold a database connection
+    db.session.remove()
+    
+    heartbeat = config.get('ALERT_STREAM_HEARTBEAT_SECONDS', 15)
+    retry = config.get('ALERT_STREAM_RETRY_MS', 5000)
+    deadline = time.monotonic() + config.get('ALERT_STREAM_MAX_SECONDS', 300)
+    
+    def generate():
+        last_id = start_id
+        sent = set()
+        try:
+            # Set the client's Last-Event-ID even if no alert arrives before the stream ends
+            yield f"retry: {retry}\nid: {last_id}\n\n"
+            events = missed
+            
+            while True:
+                for alert_data in events:
+                    # The resume query, this process and the watcher can each deliver an alert
+                    if alert_data['id'] in sent or alert_data['id'] <= start_id:
+                        continue
+                    sent.add(alert_data['id'])
+                    last_id = max(last_id, alert_data['id'])
+                    yield format_sse(alert_data)
+                
+                try:
+                    events = [subscription.get(timeout=heartbeat)]
+                except queue.Empty:
+                    if subscription.overflowed or time.monotonic() > deadline:
+                        return  # client reconnects with Last-Event-ID
+                    events = []
+                    yield ": keep-alive\n\n"
+        finally:
+            alert_broker.unsubscribe(user_id, subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@alerts_bp.route('/api/poll')
+@login_required
+def poll_alerts():
+    """Long-polling fallback for clients without EventSource
+    
+    When every stream slot is taken the request returns at once with
+    ``retry_after``, the seconds to wait before polling again.
+    """
+    user_id = current_user.id
+    config = current_app.config
+    after_id = _event_id(request.args.get('after'))
+    
+    subscription = alert_broker.subscribe(user_id, limit=config.get('ALERT_STREAM_MAX_CLIENTS'))
+    if subscription is None:
+        alerts = missed_alert_events(user_id, after_id)
+        return jsonify({
+            'alerts': alerts,
+            'last_id': max([alert_data['id'] for alert_data in alerts], default=after_id),
+            'retry_after': config.get('ALERT_BUSY_RETRY_SECONDS', 30)
+        })
+    
+    try:
+        alerts = missed_alert_events(user_id, after_id)
+        alert_watcher.ensure_running(current_app._get_current_object(),
+                                     after_id if after_id is not None else latest_alert_id())
+        db.session.remove()
+        
+        if not alerts:
+            try:
+                alerts.append(subscription.get(timeout=config.get('ALERT_POLL_TIMEOUT_SECONDS', 25)))
+            except queue.Empty:
+                pass
+        
+        # Collect anything else published meanwhile
+        while True:
+            try:
+                alerts.append(subscription.get_nowait())
+            except queue.Empty:
+                break
+    finally:
+        alert_broker.unsubscribe(user_id, subscription)
+    
+    alerts = [alert_data for alert_data in alerts if after_id is None or alert_data['id'] > after_id]
+    alerts = list({alert_data['id']: alert_data for alert_data in alerts}.values())
+    
+    return jsonify({
+        'alerts': alerts,
+        'last_id': max([alert_data['id'] for alert_data in alerts], default=after_id)
+    })
+
+def _event_id(value):
+    """Parse a Last-Event-ID / after value, None when absent or invalid"""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
 @alerts_bp.route('/api/counts')
 @login_required
 def get_alert_counts():
     """API endpoint to get counts of different alert types"""
-    unread_count = Alert.query.filter(Alert.user_id == current_user.id, Alert.read == False).count()
-    
-    # Count by severity
-    severity_counts = db.session.query(
-        Alert.severity,
-        db.func.count(Alert.id).label('count')
-    ).filter(
-        Alert.user_id == current_user.id,
-        Alert.read == False
-    ).group_by(
-        Alert.severity
-    ).all()
+    unread_count, by_severity = unread_counts(current_user.id)
     
     # Format results
     severity_data = {}
-    for severity, count in severity_counts:
-        severity_data[str(severity)] = count
+    for severity, count in by_severity.items():
+        severity_data[str(severity) if severity else 'None'] = count
     
     return jsonify({
         'unread_count': unread_count,
         'severity_counts': severity_data
     })
 
+@alerts_bp.route('/api/delivery/<int:alert_id>')
+@login_required
+def get_alert_delivery(alert_id):
+    """API endpoint to report notification delivery status of an alert (admin only)"""
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Only administrators can view delivery status'}), 403
+    
+    Alert.query.get_or_404(alert_id)
+    
+    return jsonify({
+        'alert_id': alert_id,
+        'channels': delivery_status(alert_id)
+    })
+
 @alerts_bp.route('/treatment')
 @login_required
 def treatment_guidance():
     """Get treatment guidance based on alerts"""
     # Get alerts with pathogen information
-    alerts = Alert.query.filter(
-        Alert.user_id == current_user.id, 
+    alerts = Alert.query.join(
+        AlertRecipient, AlertRecipient.alert_id == Alert.id
+    ).filter(
+        AlertRecipient.user_id == current_user.id, 
         Alert.pathogen_id.isnot(None)
-    ).order_by(Alert.created_at.desc()).limit(10).all()
+    ).order_by(AlertRecipient.created_at.desc()).limit(10).all()
     
     return render_template('treatment_alert.html', alerts=alerts)
\ No newline at end of file
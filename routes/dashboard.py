@@ -1,11 +1,14 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_login import login_required, current_user
 import json
-from datetime import datetime, timedelta
 import logging
 
 from app import db
-from models import LabReport, Facility, Pathogen, ResistanceProfile, User, Antibiotic
+from models import LabReport, Facility, Pathogen, User, Antibiotic, ResistanceRollup
+from analytics import GRANULARITIES, resistance_trend, resistance_risk_matrix
+from cache import cached_response, conditional_response
+from utils import parse_date_arg
+from data_processing import generate_resistance_map
 
 logger = logging.getLogger(__name__)
 
@@ -19,26 +22,29 @@ def home():
     total_facilities = Facility.query.count()
     total_pathogens = Pathogen.query.count()
     
-    # Calculate resistance rates
-    resistant_count = db.session.query(db.func.count(ResistanceProfile.id)).filter(ResistanceProfile.result == 'R').scalar() or 0
-    total_tests = db.session.query(db.func.count(ResistanceProfile.id)).scalar() or 0
+    # Calculate resistance rates from the daily rollups
+    resistant_count, total_tests = db.session.query(
+        db.func.coalesce(db.func.sum(ResistanceRollup.resistant), 0),
+        db.func.coalesce(db.func.sum(ResistanceRollup.total), 0)
+    ).one()
     resistance_rate = round((resistant_count / total_tests * 100) if total_tests > 0 else 0, 2)
     
     # Get recent lab data
     recent_data = LabReport.query.order_by(LabReport.report_date.desc()).limit(5).all()
     
     # Get most common resistant pathogens
+    resistant_sum = db.func.sum(ResistanceRollup.resistant)
     common_resistant_pathogens = db.session.query(
         Pathogen.name, 
-        db.func.count(ResistanceProfile.id).label('count')
+        resistant_sum.label('count')
     ).join(
-        ResistanceProfile, ResistanceProfile.pathogen_id == Pathogen.id
-    ).filter(
-        ResistanceProfile.result == 'R'
+        ResistanceRollup, ResistanceRollup.pathogen_id == Pathogen.id
     ).group_by(
         Pathogen.id
+    ).having(
+        resistant_sum > 0
     ).order_by(
-        db.func.count(ResistanceProfile.id).desc()
+        resistant_sum.desc()
     ).limit(5).all()
     
     return render_template('dashboard.html', 
@@ -56,25 +62,35 @@ def map_view():
 
 @dashboard_bp.route('/api/map_data')
 @login_required
+@conditional_response
+@cached_response()
 def map_data():
     # Get all facilities with coordinates
     data_points = []
     
-    # Get facilities with coordinates
-    facilities = Facility.query.filter(
+    # Resistance totals per facility, aggregated in the database
+    totals = db.session.query(
+        ResistanceRollup.facility_id,
+        db.func.sum(ResistanceRollup.total).label('total'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant')
+    ).group_by(
+        ResistanceRollup.facility_id
+    ).subquery()
+    
+    # Get facilities with coordinates together with their totals
+    facilities = db.session.query(
+        Facility.id, Facility.name, Facility.latitude, Facility.longitude,
+        Facility.facility_type, totals.c.total, totals.c.resistant
+    ).outerjoin(
+        totals, totals.c.facility_id == Facility.id
+    ).filter(
         Facility.latitude.isnot(None),
         Facility.longitude.isnot(None)
     ).all()
     
     for facility in facilities:
         # Calculate resistance level at this facility
-        lab_reports = facility.reports.all()
-        resistance_profiles = []
-        for report in lab_reports:
-            resistance_profiles.extend(report.resistance_profiles.all())
-        
-        resistant_count = sum(1 for profile in resistance_profiles if profile.result == 'R')
-        resistance_level = (resistant_count / len(resistance_profiles) * 100) if resistance_profiles else 0
+        resistance_level = (facility.resistant / facility.total * 100) if facility.total else 0
         
         data_point = {
             'id': facility.id,
@@ -89,65 +105,64 @@ def map_data():
     
     return jsonify(data_points)
 
+@dashboard_bp.route('/api/resistance_map')
+@login_required
+@conditional_response
+@cached_response()
+def resistance_map():
+    """API endpoint for the facility and environmental markers of the resistance map"""
+    return jsonify(generate_resistance_map())
+
 @dashboard_bp.route('/api/resistance_trends')
 @login_required
+@conditional_response
 def resistance_trends():
-    # Calculate resistance trends over the past 12 months
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)
+    # Resistance trend, monthly over the past 12 months by default
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': f'Unsupported granularity: {granularity}'}), 400
     
-    # Get monthly resistance rates
-    results = []
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
     
-    # Iterate through each month
-    current_date = start_date
-    while current_date < end_date:
-        month_end = min(datetime(current_date.year, current_date.month + 1, 1) - timedelta(days=1), end_date)
-        
-        # Query for that month
-        month_resistant = db.session.query(db.func.count(ResistanceProfile.id)).join(
-            LabReport, ResistanceProfile.lab_report_id == LabReport.id
-        ).filter(
-            ResistanceProfile.result == 'R',
-            LabReport.report_date >= current_date,
-            LabReport.report_date <= month_end
-        ).scalar() or 0
-        
-        month_total = db.session.query(db.func.count(ResistanceProfile.id)).join(
-            LabReport, ResistanceProfile.lab_report_id == LabReport.id
-        ).filter(
-            LabReport.report_date >= current_date,
-            LabReport.report_date <= month_end
-        ).scalar() or 0
-        
-        resistance_rate = (month_resistant / month_total * 100) if month_total > 0 else 0
-        
-        results.append({
-            'date': current_date.strftime('%Y-%m'),
-            'resistance_rate': round(resistance_rate, 2)
-        })
-        
-        # Move to next month
-        if current_date.month == 12:
-            current_date = datetime(current_date.year + 1, 1, 1)
-        else:
-            current_date = datetime(current_date.year, current_date.month + 1, 1)
+    trend = resistance_trend(
+        granularity=granularity,
+        start=start,
+        end=end,
+        facility_id=request.args.get('facility_id', type=int),
+        pathogen_id=request.args.get('pathogen_id', type=int),
+        antibiotic_id=request.args.get('antibiotic_id', type=int)
+    )
+    
+    date_format = '%Y-%m' if granularity == 'month' else '%Y-%m-%d'
+    results = [{
+        'date': point['bucket'].strftime(date_format),
+        'resistance_rate': point['percentage'],
+        'total': point['total'],
+        'resistant': point['resistant']
+    } for point in trend]
     
     return jsonify(results)
 
 @dashboard_bp.route('/api/pathogen_distribution')
 @login_required
+@conditional_response
+@cached_response()
 def pathogen_distribution():
     # Get distribution of different pathogens
+    total_sum = db.func.sum(ResistanceRollup.total)
     results = db.session.query(
         Pathogen.name,
-        db.func.count(ResistanceProfile.id).label('count')
+        total_sum.label('count')
     ).join(
-        ResistanceProfile, ResistanceProfile.pathogen_id == Pathogen.id
+        ResistanceRollup, ResistanceRollup.pathogen_id == Pathogen.id
     ).group_by(
         Pathogen.id
     ).order_by(
-        db.func.count(ResistanceProfile.id).desc()
+        total_sum.desc()
     ).all()
     
     data = [{'name': name, 'count': count} for name, count in results]
@@ -155,16 +170,18 @@ def pathogen_distribution():
 
 @dashboard_bp.route('/api/antibiotic_effectiveness')
 @login_required
+@conditional_response
+@cached_response()
 def antibiotic_effectiveness():
     # Get effectiveness of different antibiotics
     results = db.session.query(
         Antibiotic.name,
-        db.func.count(ResistanceProfile.id).label('total'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'S', 1)], else_=0)).label('susceptible'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'I', 1)], else_=0)).label('intermediate'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant')
+        db.func.sum(ResistanceRollup.total).label('total'),
+        db.func.sum(ResistanceRollup.susceptible).label('susceptible'),
+        db.func.sum(ResistanceRollup.intermediate).label('intermediate'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant')
     ).join(
-        ResistanceProfile, ResistanceProfile.antibiotic_id == Antibiotic.id
+        ResistanceRollup, ResistanceRollup.antibiotic_id == Antibiotic.id
     ).group_by(
         Antibiotic.id
     ).all()
@@ -184,16 +201,16 @@ def antibiotic_effectiveness():
 
 @dashboard_bp.route('/api/regional_comparison')
 @login_required
+@conditional_response
+@cached_response()
 def regional_comparison():
     # Compare resistance rates between regions
     results = db.session.query(
         Facility.state,
-        db.func.count(ResistanceProfile.id).label('total'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant')
+        db.func.sum(ResistanceRollup.total).label('total'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant')
     ).join(
-        LabReport, LabReport.facility_id == Facility.id
-    ).join(
-        ResistanceProfile, ResistanceProfile.lab_report_id == LabReport.id
+        ResistanceRollup, ResistanceRollup.facility_id == Facility.id
     ).filter(
         Facility.state.isnot(None)
     ).group_by(
@@ -210,6 +227,27 @@ def regional_comparison():
     
     return jsonify(data)
 
+@dashboard_bp.route('/api/risk_matrix')
+@login_required
+@conditional_response
+def risk_matrix():
+    """API endpoint for the pathogen x region risk matrix behind heat maps
+    
+    Optional repeated pathogen_id and region arguments select a subset;
+    ci=1 adds 95% confidence intervals.
+    """
+    matrix = resistance_risk_matrix(
+        pathogen_ids=request.args.getlist('pathogen_id', type=int) or None,
+        regions=request.args.getlist('region') or None,
+        with_ci=request.args.get('ci') == '1'
+    )
+    
+    data = matrix.to_dict()
+    names = dict(db.session.query(Pathogen.id, Pathogen.name).filter(Pathogen.id.in_(matrix.pathogen_ids)))
+    data['pathogens'] = [names.get(pathogen_id) for pathogen_id in matrix.pathogen_ids]
+    
+    return jsonify(data)
+
 @dashboard_bp.route('/analytics')
 @login_required
 def analytics():
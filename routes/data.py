@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
+from sqlalchemy.orm import joinedload
 import pandas as pd
 import json
 import os
@@ -8,8 +8,13 @@ import logging
 from datetime import datetime
 
 from app import db
-from models import LabReport, Facility, Pathogen, Antibiotic, ResistanceProfile
-from utils import allowed_file, parse_csv, parse_json, hash_patient_id, generate_report_id
+from models import LabReport, Facility, Pathogen, Antibiotic, ResistanceProfile, IngestJob, UserRole, ResistanceRollup
+from utils import allowed_file, hash_patient_id, generate_report_id, keyset_paginate
+from jobs import enqueue_ingest_job, job_status, submit
+from rollups import update_rollups, update_outbreak_series
+from data_processing import check_for_outbreaks
+from antibiogram import request_refresh
+from cache import bump_data_version, cached_response, conditional_response
 
 logger = logging.getLogger(__name__)
 
@@ -35,23 +40,19 @@ def upload():
                 return redirect(request.url)
             
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
                 facility_id = request.form.get('facility_id')
                 
                 try:
-                    if filename.endswith('.csv'):
-                        data = parse_csv(file)
-                        success_count = process_csv_data(data, facility_id)
-                    elif filename.endswith('.json'):
-                        data = parse_json(file)
-                        success_count = process_json_data(data, facility_id)
-                    else:
-                        flash('Unsupported file format', 'danger')
-                        return redirect(request.url)
+                    # Spool the file and ingest it in the background
+                    job = enqueue_ingest_job(file, facility_id, current_user.id)
                     
-                    flash(f'Successfully processed {success_count} records', 'success')
+                    flash(f'Upload queued for processing (job #{job.id})', 'success')
                     return redirect(url_for('dashboard.home'))
                 
+                except ValueError as e:
+                    flash(str(e), 'danger')
+                    return redirect(request.url)
+                
                 except Exception as e:
                     logger.error(f"Error processing uploaded file: {str(e)}")
                     flash(f'Error processing file: {str(e)}', 'danger')
@@ -85,95 +86,163 @@ def upload():
                           pathogens=pathogens,
                           antibiotics=antibiotics)
 
+# Lab reports per page; pages are addressed by cursor, not number
+REPORTS_PER_PAGE = 20
+
 @data_bp.route('/view')
 @login_required
 def view_data():
     """View all submitted data with filtering options"""
-    # Get filter parameters
-    facility_id = request.args.get('facility_id', type=int)
-    pathogen_id = request.args.get('pathogen_id', type=int)
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
+    current_filters = _report_filters(request.args)
+    
+    # Execute query with keyset pagination
+    try:
+        reports = _paginate_reports(current_filters)
+    except ValueError:
+        flash('That page link is no longer valid', 'warning')
+        return redirect(url_for('data.view_data', **{k: v for k, v in current_filters.items() if v is not None}))
+    
+    # Get facilities and pathogens for filters
+    facilities = Facility.query.all()
+    pathogens = Pathogen.query.all()
+    
+    return render_template('view_data.html',
+                          reports=reports,
+                          facilities=facilities,
+                          pathogens=pathogens,
+                          current_filters=current_filters)
+
+@data_bp.route('/api/reports')
+@login_required
+def list_reports():
+    """API endpoint to page through submitted lab reports"""
+    try:
+        reports = _paginate_reports(_report_filters(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    return jsonify({
+        'reports': _serialize_reports(reports.items),
+        'next_cursor': reports.next_cursor,
+        'prev_cursor': reports.prev_cursor,
+        'total': reports.total
+    })
+
+def _report_filters(args):
+    """Read the lab report list filters from the query string"""
+    return {
+        'facility_id': args.get('facility_id', type=int),
+        'pathogen_id': args.get('pathogen_id', type=int),
+        'date_from': args.get('date_from'),
+        'date_to': args.get('date_to')
+    }
+
+def _paginate_reports(filters):
+    """Return a page of lab reports matching filters, newest first"""
     # Base query
-    query = LabReport.query
+    query = LabReport.query.options(joinedload(LabReport.facility))
     
     # Apply filters
-    if facility_id:
-        query = query.filter(LabReport.facility_id == facility_id)
+    if filters['facility_id']:
+        query = query.filter(LabReport.facility_id == filters['facility_id'])
     
-    if pathogen_id:
-        query = query.join(ResistanceProfile, LabReport.id == ResistanceProfile.lab_report_id) \
-                    .filter(ResistanceProfile.pathogen_id == pathogen_id)
+    if filters['pathogen_id']:
+        # EXISTS keeps one row per report however many profiles match
+        query = query.filter(LabReport.resistance_profiles.any(
+            ResistanceProfile.pathogen_id == filters['pathogen_id']
+        ))
     
-    if date_from:
-        date_from = datetime.strptime(date_from, '%Y-%m-%d')
+    if filters['date_from']:
+        date_from = datetime.strptime(filters['date_from'], '%Y-%m-%d')
         query = query.filter(LabReport.report_date >= date_from)
     
-    if date_to:
-        date_to = datetime.strptime(date_to, '%Y-%m-%d')
+    if filters['date_to']:
+        date_to = datetime.strptime(filters['date_to'], '%Y-%m-%d')
         query = query.filter(LabReport.report_date <= date_to)
     
-    # Execute query with pagination
-    page = request.args.get('page', 1, type=int)
-    reports = query.order_by(LabReport.report_date.desc()).paginate(page=page, per_page=20)
+    return keyset_paginate(
+        query,
+        (LabReport.report_date, LabReport.id),
+        cursor=request.args.get('cursor'),
+        per_page=REPORTS_PER_PAGE,
+        with_total=request.args.get('with_total', '').lower() == 'true'
+    )
+
+@data_bp.route('/jobs/<int:job_id>')
+@login_required
+def get_job_status(job_id):
+    """API endpoint to report progress of a background ingest job"""
+    job = IngestJob.query.get_or_404(job_id)
     
-    # Get facilities and pathogens for filters
-    facilities = Facility.query.all()
-    pathogens = Pathogen.query.all()
+    # Only the uploader and administrators can follow a job
+    if job.user_id != current_user.id and current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'You do not have permission to access this job'}), 403
     
-    return render_template('view_data.html',
-                          reports=reports,
-                          facilities=facilities,
-                          pathogens=pathogens,
-                          current_filters={
-                              'facility_id': facility_id,
-                              'pathogen_id': pathogen_id,
-                              'date_from': date_from,
-                              'date_to': date_to
-                          })
+    return jsonify(job_status(job))
 
 @data_bp.route('/api/latest')
 @login_required
 def get_latest_data():
     """API endpoint to get the latest data for dashboard"""
-    latest_reports = LabReport.query.order_by(LabReport.report_date.desc()).limit(10).all()
+    # Load the reports with their facility in one query
+    latest_reports = LabReport.query.options(
+        joinedload(LabReport.facility)
+    ).order_by(LabReport.report_date.desc()).limit(10).all()
+    
+    return jsonify(_serialize_reports(latest_reports))
+
+def _serialize_reports(reports):
+    """Serialize lab reports with their resistance data, loading all profiles in one query"""
+    # Load the resistance profiles of all these reports in one query
+    profiles = db.session.query(
+        ResistanceProfile.lab_report_id,
+        Pathogen.name.label('pathogen'),
+        Antibiotic.name.label('antibiotic'),
+        ResistanceProfile.result
+    ).outerjoin(
+        Pathogen, Pathogen.id == ResistanceProfile.pathogen_id
+    ).outerjoin(
+        Antibiotic, Antibiotic.id == ResistanceProfile.antibiotic_id
+    ).filter(
+        ResistanceProfile.lab_report_id.in_([report.id for report in reports])
+    ).order_by(
+        ResistanceProfile.id
+    ).all()
+    
+    profiles_by_report = {}
+    for profile in profiles:
+        profiles_by_report.setdefault(profile.lab_report_id, []).append({
+            'pathogen': profile.pathogen or 'Unknown',
+            'antibiotic': profile.antibiotic or 'Unknown',
+            'result': profile.result
+        })
     
     results = []
-    for report in latest_reports:
+    for report in reports:
         facility_name = report.facility.name if report.facility else 'Unknown'
         
-        # Get resistance profiles for this report
-        resistance_data = []
-        for profile in report.resistance_profiles:
-            resistance_data.append({
-                'pathogen': profile.pathogen.name if profile.pathogen else 'Unknown',
-                'antibiotic': profile.antibiotic.name if profile.antibiotic else 'Unknown',
-                'result': profile.result
-            })
-        
         results.append({
             'id': report.id,
             'report_date': report.report_date.strftime('%Y-%m-%d'),
             'facility': facility_name,
             'sample_type': report.sample_type,
-            'resistance_data': resistance_data
+            'resistance_data': profiles_by_report.get(report.id, [])
         })
     
-    return jsonify(results)
+    return results
 
 @data_bp.route('/api/resistance_by_region')
 @login_required
+@conditional_response
+@cached_response()
 def get_resistance_by_region():
     """API endpoint to get resistance data by region for maps"""
     regions = db.session.query(
         Facility.state,
-        db.func.count(ResistanceProfile.id).label('total_tests'),
-        db.func.sum(db.case([(ResistanceProfile.result == 'R', 1)], else_=0)).label('resistant_count')
+        db.func.sum(ResistanceRollup.total).label('total_tests'),
+        db.func.sum(ResistanceRollup.resistant).label('resistant_count')
     ).join(
-        LabReport, LabReport.facility_id == Facility.id
-    ).join(
-        ResistanceProfile, ResistanceProfile.lab_report_id == LabReport.id
+        ResistanceRollup, ResistanceRollup.facility_id == Facility.id
     ).filter(
         Facility.state.isnot(None)
     ).group_by(
@@ -192,22 +261,6 @@ def get_resistance_by_region():
     
     return jsonify(results)
 
-def process_csv_data(df, facility_id):
-    """Process CSV data upload."""
-    success_count = 0
-    
-    # TODO: Implement actual CSV processing logic
-    
-    return success_count
-
-def process_json_data(json_data, facility_id):
-    """Process JSON data upload."""
-    success_count = 0
-    
-    # TODO: Implement actual JSON processing logic
-    
-    return success_count
-
 def process_form_data(form_data):
     """Process direct form submission."""
     try:
@@ -220,16 +273,19 @@ def process_form_data(form_data):
         patient_identifier = form_data.get('patient_identifier')
         clinical_diagnosis = form_data.get('clinical_diagnosis')
         
-        # Hash the patient identifier for privacy
-        hashed_patient_id = hash_patient_id(patient_identifier)
+        # Hash the patient identifier for privacy (blank stays blank)
+        hashed_patient_id = hash_patient_id(patient_identifier) if patient_identifier else ''
         
         # Create the lab report
+        report_date = datetime.utcnow()
         report = LabReport(
             report_id=generate_report_id(),
             facility_id=facility_id,
             user_id=current_user.id,
+            report_date=report_date,
             sample_collection_date=sample_collection_date,
             sample_type=sample_type,
+            specimen_id=form_data.get('specimen_id') or None,
             patient_age=patient_age if patient_age else None,
             patient_gender=patient_gender,
             patient_identifier=hashed_patient_id,
@@ -248,6 +304,7 @@ def process_form_data(form_data):
         results = request.form.getlist('result')
         
         # Create resistance profiles
+        rollup_results = []
         for i in range(len(antibiotics)):
             if i < len(results):  # Ensure we have both antibiotic and result
                 profile = ResistanceProfile(
@@ -259,10 +316,26 @@ def process_form_data(form_data):
                     mutation_data=form_data.get(f'mutation_data_{antibiotics[i]}')
                 )
                 db.session.add(profile)
+                rollup_results.append((
+                    report_date.date(), int(facility_id), int(pathogen_id), int(antibiotics[i]), results[i]
+                ))
+        
+        # Update the dashboard rollups and outbreak series in the same transaction
+        update_rollups(rollup_results)
+        touched_series = update_outbreak_series(
+            ((day, pathogen, result) for day, _, pathogen, _, result in rollup_results),
+            Facility.query.get(int(facility_id))
+        )
         
         db.session.commit()
-        return True
+        bump_data_version()
+        request_refresh({((sample_collection_date or report_date).year, int(pathogen_id))})
         
+        # Re-score the touched series off the request, as uploads do
+        if touched_series:
+            submit(check_for_outbreaks, touched_series)
+        return True
+    
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error in process_form_data: {str(e)}")
@@ -1,8 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify
 from flask_login import login_required, current_user
 
-from app import db
-from models import Pathogen, TreatmentGuideline, ResistanceProfile, Antibiotic
+from models import Pathogen, TreatmentGuideline
+from analytics import antibiotic_susceptibility
+from antibiogram import antibiogram_for
+from cache import cached_response, conditional_response
+from utils import parse_date_arg
 
 # Create blueprint
 treatment_bp = Blueprint('treatment', __name__, url_prefix='/treatment')
@@ -26,44 +29,49 @@ def pathogen_guidance(pathogen_id):
     pathogen = Pathogen.query.get_or_404(pathogen_id)
     guidelines = TreatmentGuideline.query.filter_by(pathogen_id=pathogen_id).all()
     
-    # Get resistance statistics
-    resistance_stats = []
-    
-    # Get list of antibiotics tested against this pathogen
-    antibiotics = db.session.query(Antibiotic)\
-        .join(ResistanceProfile, ResistanceProfile.antibiotic_id == Antibiotic.id)\
-        .filter(ResistanceProfile.pathogen_id == pathogen_id)\
-        .distinct()\
-        .all()
-    
-    for antibiotic in antibiotics:
-        # Count total tests and resistant results
-        profiles = ResistanceProfile.query.filter_by(
-            pathogen_id=pathogen_id,
-            antibiotic_id=antibiotic.id
-        ).all()
-        
-        total = len(profiles)
-        resistant = sum(1 for p in profiles if p.result == 'R')
-        
-        # Calculate resistance percentage
-        percentage = round((resistant / total) * 100) if total > 0 else 0
-        
-        resistance_stats.append({
-            'antibiotic': antibiotic.name,
-            'total': total,
-            'resistant': resistant,
-            'percentage': percentage
-        })
+    # Look up the cumulative antibiogram (first isolate per patient) for this pathogen
+    antibiogram_period, resistance_stats = antibiogram_for(
+        pathogen_id,
+        region=request.args.get('region'),
+        facility_id=request.args.get('facility_id', type=int),
+        period=request.args.get('year', type=int)
+    )
     
     return render_template('treatment_guidance.html',
                           pathogen=pathogen,
                           guidelines=guidelines,
-                          resistance_stats=resistance_stats)
+                          resistance_stats=resistance_stats,
+                          antibiogram_period=antibiogram_period)
 
 @treatment_bp.route('/api/pathogen/<int:pathogen_id>/resistance')
 @login_required
+@conditional_response
+@cached_response()
 def pathogen_resistance_api(pathogen_id):
-    """API endpoint for resistance data for charts"""
-    # This would be implemented to return JSON data for the charts
-    pass
\ No newline at end of file
+    """API endpoint for resistance data for charts
+    
+    Reads the same cumulative antibiogram as the guidance page and takes
+    the same region, facility_id and year arguments. With a start and/or
+    end date (YYYY-MM-DD) it aggregates the daily rollups over that window
+    instead, counting every result.
+    """
+    Pathogen.query.get_or_404(pathogen_id)
+    
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    
+    region = request.args.get('region')
+    facility_id = request.args.get('facility_id', type=int)
+    
+    # One entry per antibiotic, most resistant first, ready for a bar chart
+    if start or end:
+        stats = antibiotic_susceptibility(pathogen_id, region=region, facility_id=facility_id, start=start, end=end)
+    else:
+        _, stats = antibiogram_for(pathogen_id, region=region, facility_id=facility_id,
+                                   period=request.args.get('year', type=int))
+    stats.sort(key=lambda stat: stat['percentage'], reverse=True)
+    
+    return jsonify(stats)
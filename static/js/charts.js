@@ -134,8 +134,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const pathogenId = antibioticChartElement.getAttribute('data-pathogen-id');
         
         if (pathogenId) {
-            // Fetch data from API
-            fetch(`/api/pathogen/${pathogenId}/resistance`)
+            // Fetch data from API, with the page's region/facility/year so it matches the table
+            fetch(`/treatment/api/pathogen/${pathogenId}/resistance${window.location.search}`)
                 .then(response => response.json())
                 .then(data => {
                     const ctx = antibioticChartElement.getContext('2d');
@@ -6,6 +6,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Initialize notification system
 async function initNotifications() {
+    // Alerts are pushed to logged-in users (the navbar badge only renders for them)
+    if (document.getElementById('alert-count-badge')) {
+        connectAlertStream();
+    }
+
     // Check if the browser supports notifications
     if (!('Notification' in window)) {
         console.log('This browser does not support desktop notifications');
@@ -26,11 +31,6 @@ async function initNotifications() {
             notificationToggle.checked = true;
         }
     }
-
-    // Setup periodical alerts checking
-    if (Notification.permission === 'granted') {
-        setupPeriodicAlertsCheck();
-    }
 }
 
 // Request permission for browser notifications
@@ -40,7 +40,6 @@ async function requestNotificationPermission() {
         
         if (permission === 'granted') {
             console.log('Notification permission granted');
-            setupPeriodicAlertsCheck();
         } else {
             console.log('Notification permission denied');
             const notificationToggle = document.getElementById('notification-toggle');
@@ -53,37 +52,86 @@ async function requestNotificationPermission() {
     }
 }
 
-// Setup periodic checking for new alerts
-function setupPeriodicAlertsCheck() {
-    // Check for new alerts immediately
-    checkForNewAlerts();
-    
-    // Then check every 5 minutes
-    setInterval(checkForNewAlerts, 5 * 60 * 1000);
-}
+// Number of unread alerts shown in the navbar
+let unreadAlertCount = 0;
 
-// Check for new alerts from the server
-async function checkForNewAlerts() {
+// Receive new alerts as they are created, instead of polling
+async function connectAlertStream() {
+    // One request for the starting count, then the stream keeps it current
     try {
-        const response = await fetch('/alerts/api/latest');
-        const alerts = await response.json();
-        
-        // Filter for only new alerts
-        const newAlerts = alerts.filter(alert => alert.status === 'new');
-        
-        // Show notifications for new alerts
-        newAlerts.forEach(alert => {
-            showNotification(alert);
-        });
-        
-        // Update alert counter in navbar
-        updateAlertCounter(newAlerts.length);
-        
+        const response = await fetch('/alerts/api/counts');
+        const counts = await response.json();
+        unreadAlertCount = counts.unread_count;
+        updateAlertCounter(unreadAlertCount);
     } catch (error) {
-        console.error('Error checking for new alerts:', error);
+        console.error('Error fetching alert counts:', error);
+    }
+
+    if ('EventSource' in window) {
+        // EventSource reconnects by itself and resumes with Last-Event-ID
+        let lastId = null;
+        const source = new EventSource('/alerts/stream');
+        source.addEventListener('alert', function(event) {
+            const alert = JSON.parse(event.data);
+            lastId = alert.id;
+            handleNewAlert(alert);
+        });
+        source.addEventListener('error', function() {
+            // A 503 (every stream slot taken) closes the source for good
+            if (source.readyState === EventSource.CLOSED) {
+                longPollAlerts(lastId);
+            }
+        });
+    } else {
+        longPollAlerts(null);
+    }
+}
+
+// Long-polling fallback for browsers without EventSource
+async function longPollAlerts(lastId) {
+    while (true) {
+        try {
+            const query = lastId !== null ? '?after=' + lastId : '';
+            const response = await fetch('/alerts/api/poll' + query);
+            const data = await response.json();
+
+            data.alerts.forEach(handleNewAlert);
+            if (data.last_id !== null) {
+                lastId = data.last_id;
+            }
+            // The server is busy: wait before polling again
+            if (data.retry_after) {
+                await new Promise(resolve => setTimeout(resolve, data.retry_after * 1000));
+            }
+        } catch (error) {
+            console.error('Error polling for alerts:', error);
+            await new Promise(resolve => setTimeout(resolve, 5000));
+        }
     }
 }
 
+// Handle an alert pushed by the server
+function handleNewAlert(alert) {
+    unreadAlertCount += 1;
+    updateAlertCounter(unreadAlertCount);
+
+    // Let other scripts (e.g. the dashboard) react to the alert
+    document.dispatchEvent(new CustomEvent('amr:alert', { detail: alert }));
+
+    if ('Notification' in window && Notification.permission === 'granted') {
+        alert.priority = getAlertPriority(alert.severity);
+        showNotification(alert);
+    }
+}
+
+// Map a 1-5 alert severity to a notification priority
+function getAlertPriority(severity) {
+    if (severity >= 5) return 'critical';
+    if (severity === 4) return 'high';
+    if (severity === 3) return 'medium';
+    return 'low';
+}
+
 // Show a browser notification for an alert
 function showNotification(alert) {
     // Get appropriate icon based on priority
@@ -212,5 +260,5 @@ export {
     initNotifications, 
     sendNotification, 
     registerForPushNotifications,
-    checkForNewAlerts
+    connectAlertStream
 };
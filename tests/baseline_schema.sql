@@ -0,0 +1,131 @@
+-- Schema created by db.create_all() before the migration step existed (baseline models.py)
+CREATE TABLE user (
+	id INTEGER NOT NULL,
+	username VARCHAR(64) NOT NULL,
+	email VARCHAR(120) NOT NULL,
+	password_hash VARCHAR(256),
+	firebase_uid VARCHAR(128),
+	role VARCHAR(22) NOT NULL,
+	full_name VARCHAR(100),
+	profile_picture VARCHAR(255),
+	created_at DATETIME,
+	last_login DATETIME,
+	phone_number VARCHAR(20),
+	is_active BOOLEAN,
+	PRIMARY KEY (id),
+	UNIQUE (username),
+	UNIQUE (email),
+	UNIQUE (firebase_uid)
+);
+CREATE TABLE facility (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	facility_type VARCHAR(50),
+	address VARCHAR(200),
+	city VARCHAR(100),
+	state VARCHAR(100),
+	country VARCHAR(100),
+	latitude FLOAT,
+	longitude FLOAT,
+	contact_email VARCHAR(120),
+	contact_phone VARCHAR(20),
+	created_at DATETIME,
+	PRIMARY KEY (id)
+);
+CREATE TABLE pathogen (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	scientific_name VARCHAR(150),
+	pathogen_type VARCHAR(50),
+	description TEXT,
+	PRIMARY KEY (id)
+);
+CREATE TABLE antibiotic (
+	id INTEGER NOT NULL,
+	name VARCHAR(100) NOT NULL,
+	drug_class VARCHAR(100),
+	description TEXT,
+	PRIMARY KEY (id)
+);
+CREATE TABLE lab_report (
+	id INTEGER NOT NULL,
+	report_id VARCHAR(50),
+	facility_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	report_date DATETIME,
+	sample_collection_date DATETIME,
+	sample_type VARCHAR(50),
+	patient_age INTEGER,
+	patient_gender VARCHAR(20),
+	patient_identifier VARCHAR(100),
+	clinical_diagnosis VARCHAR(200),
+	PRIMARY KEY (id),
+	UNIQUE (report_id),
+	FOREIGN KEY(facility_id) REFERENCES facility (id),
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE alert (
+	id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	title VARCHAR(200) NOT NULL,
+	message TEXT NOT NULL,
+	alert_type VARCHAR(50),
+	severity INTEGER,
+	created_at DATETIME,
+	read BOOLEAN,
+	action_taken BOOLEAN,
+	latitude FLOAT,
+	longitude FLOAT,
+	region VARCHAR(100),
+	pathogen_id INTEGER,
+	antibiotic_id INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(user_id) REFERENCES user (id),
+	FOREIGN KEY(pathogen_id) REFERENCES pathogen (id),
+	FOREIGN KEY(antibiotic_id) REFERENCES antibiotic (id)
+);
+CREATE TABLE treatment_guideline (
+	id INTEGER NOT NULL,
+	pathogen_id INTEGER NOT NULL,
+	condition VARCHAR(200) NOT NULL,
+	first_line_treatment TEXT NOT NULL,
+	alternative_treatments TEXT,
+	notes TEXT,
+	source VARCHAR(200),
+	published_date DATETIME,
+	last_updated DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(pathogen_id) REFERENCES pathogen (id)
+);
+CREATE TABLE environmental_sample (
+	id INTEGER NOT NULL,
+	sample_id VARCHAR(50),
+	sample_type VARCHAR(50),
+	collection_date DATETIME NOT NULL,
+	latitude FLOAT NOT NULL,
+	longitude FLOAT NOT NULL,
+	location_description VARCHAR(200),
+	pathogen_detected BOOLEAN,
+	pathogen_id INTEGER,
+	pathogen_load FLOAT,
+	user_id INTEGER NOT NULL,
+	notes TEXT,
+	PRIMARY KEY (id),
+	UNIQUE (sample_id),
+	FOREIGN KEY(pathogen_id) REFERENCES pathogen (id),
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE resistance_profile (
+	id INTEGER NOT NULL,
+	lab_report_id INTEGER NOT NULL,
+	pathogen_id INTEGER NOT NULL,
+	antibiotic_id INTEGER NOT NULL,
+	result VARCHAR(1) NOT NULL,
+	mic_value FLOAT,
+	mutation_data TEXT,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(lab_report_id) REFERENCES lab_report (id),
+	FOREIGN KEY(pathogen_id) REFERENCES pathogen (id),
+	FOREIGN KEY(antibiotic_id) REFERENCES antibiotic (id)
+);
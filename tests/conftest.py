@@ -0,0 +1,75 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# Point the app at a throwaway database and no response cache before it is imported
+_database_dir = tempfile.mkdtemp(prefix='amr-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_database_dir, 'test.db')}"
+os.environ['CACHE_BACKEND'] = 'null'
+
+from app import app as flask_app, db
+from cache import MemoryCache
+from models import Facility, User, UserRole
+
+@pytest.fixture
+def app():
+    """The application inside an app context; tables are emptied afterwards"""
+    with flask_app.app_context():
+        yield flask_app
+        
+        db.session.remove()
+        with db.engine.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                connection.execute(table.delete())
+
+@pytest.fixture
+def facility(app):
+    facility = Facility(name='General Hospital', city='Pune', state='Maharashtra', country='India',
+                        latitude=18.52, longitude=73.85)
+    db.session.add(facility)
+    db.session.commit()
+    return facility
+
+@pytest.fixture
+def user(app):
+    user = User(username='tech', email='tech@example.org', role=UserRole.LAB_TECHNICIAN)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    """Test client logged in as ``user``"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+@pytest.fixture
+def memory_cache(app, monkeypatch):
+    """A fresh in-process cache in place of the null cache, for this test only"""
+    cache = MemoryCache()
+    monkeypatch.setitem(app.extensions, 'amr_cache', cache)
+    return cache
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting the SQL statements executed inside it"""
+    @contextmanager
+    def counter():
+        statements = []
+        
+        def record(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    
+    return counter
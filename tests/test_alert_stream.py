@@ -0,0 +1,51 @@
+import pytest
+
+import routes.alerts
+from app import db
+from models import Alert, AlertRecipient
+from alerting import AlertWatcher, alert_broker
+
+@pytest.fixture
+def stream(app, client, monkeypatch):
+    """Open /alerts/stream with short heartbeats; yields the chunk iterator"""
+    monkeypatch.setitem(app.config, 'ALERT_STREAM_HEARTBEAT_SECONDS', 0.05)
+    monkeypatch.setattr(routes.alerts, 'alert_watcher', AlertWatcher(alert_broker))
+    
+    def open_stream():
+        response = client.get('/alerts/stream', buffered=False)
+        streams.append(response)
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'retry:')
+        return chunks
+    
+    streams = []
+    yield open_stream
+    for response in streams:
+        response.close()
+
+def test_idle_stream_makes_no_queries(app, stream, count_queries, monkeypatch):
+    monkeypatch.setitem(app.config, 'ALERT_WATCH_INTERVAL_SECONDS', 60)
+    chunks = stream()
+    
+    with count_queries() as statements:
+        heartbeats = [next(chunks) for _ in range(5)]
+    
+    assert heartbeats == [b': keep-alive\n\n'] * 5
+    assert statements == []
+
+def test_alerts_from_other_processes_are_streamed(app, user, stream, monkeypatch):
+    monkeypatch.setitem(app.config, 'ALERT_WATCH_INTERVAL_SECONDS', 0.05)
+    chunks = stream()
+    
+    # Written without the ORM session, so this process publishes nothing itself
+    alert_id = db.session.execute(
+        db.insert(Alert).returning(Alert.id), {'title': 'Outbreak', 'message': 'Cluster detected'}
+    ).scalar()
+    db.session.execute(db.insert(AlertRecipient), {'alert_id': alert_id, 'user_id': user.id})
+    db.session.commit()
+    
+    for _ in range(100):
+        chunk = next(chunks)
+        if chunk != b': keep-alive\n\n':
+            break
+    assert chunk.startswith(f'id: {alert_id}\nevent: alert\n'.encode())
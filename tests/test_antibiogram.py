@@ -0,0 +1,100 @@
+import threading
+
+from app import db
+from models import Antibiogram, Pathogen
+from data_processing import process_lab_data
+from antibiogram import antibiogram_for, rebuild_antibiogram
+
+def add_isolates(facility, user):
+    """Two patients per pathogen, one of them cultured twice"""
+    records = []
+    for pathogen in ('Escherichia coli', 'Klebsiella pneumoniae'):
+        for patient, sample_date, result in (('a', '2024-03-01', 'R'), ('a', '2024-03-09', 'R'),
+                                             ('b', '2024-04-01', 'S')):
+            records.append({
+                'pathogen': pathogen,
+                'antibiotic': 'Meropenem',
+                'result': result,
+                'patient_id': f'{pathogen}-{patient}',
+                'sample_date': sample_date,
+                'sample_type': 'urine'
+            })
+    process_lab_data(records, facility.id, user.id)
+    return {pathogen.name: pathogen.id for pathogen in Pathogen.query}
+
+def rows_by_pathogen():
+    return {
+        (row.pathogen_id, row.region, row.facility_id): (row.id, row.resistant, row.total)
+        for row in Antibiogram.query
+    }
+
+def test_first_isolate_counts(facility, user):
+    pathogens = add_isolates(facility, user)
+    rebuild_antibiogram()
+    
+    period, stats = antibiogram_for(pathogens['Escherichia coli'])
+    assert period == 2024
+    assert [(stat['resistant'], stat['total'], stat['percentage']) for stat in stats] == [(1, 2, 50)]
+
+def test_rebuild_limited_to_pathogens(facility, user):
+    pathogens = add_isolates(facility, user)
+    rebuild_antibiogram()
+    before = rows_by_pathogen()
+    
+    rebuild_antibiogram([2024], [pathogens['Escherichia coli']])
+    after = rows_by_pathogen()
+    
+    # Only the E. coli rows were replaced; the counts are unchanged
+    assert after.keys() == before.keys()
+    for key, (row_id, resistant, total) in after.items():
+        assert (resistant, total) == before[key][1:]
+        assert (row_id == before[key][0]) == (key[0] != pathogens['Escherichia coli'])
+
+def test_chart_matches_guidance_table(client, facility, user):
+    pathogens = add_isolates(facility, user)
+    rebuild_antibiogram()
+    db.session.commit()
+    
+    pathogen_id = pathogens['Klebsiella pneumoniae']
+    response = client.get(f'/treatment/api/pathogen/{pathogen_id}/resistance', query_string={'region': 'Maharashtra'})
+    assert response.status_code == 200
+    assert response.get_json() == antibiogram_for(pathogen_id, region='Maharashtra')[1]
+
+def test_concurrent_rebuilds_do_not_duplicate_rows(app, facility, user):
+    add_isolates(facility, user)
+    
+    def rebuild():
+        with app.app_context():
+            rebuild_antibiogram()
+    
+    threads = [threading.Thread(target=rebuild) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    keys = db.session.query(
+        Antibiogram.period, Antibiogram.region, Antibiogram.facility_id,
+        Antibiogram.pathogen_id, Antibiogram.antibiotic_id
+    ).all()
+    assert len(keys) == len(set(keys)) == 6
+
+def test_chart_date_window_uses_rollups(client, facility, user):
+    records = [{
+        'pathogen': 'Escherichia coli',
+        'antibiotic': 'Meropenem',
+        'result': result,
+        'patient_id': 'patient-1',
+        'report_date': report_date,
+        'sample_date': report_date
+    } for report_date, result in (('2024-03-01', 'R'), ('2024-03-09', 'R'), ('2024-04-01', 'S'))]
+    process_lab_data(records, facility.id, user.id)
+    pathogen_id = Pathogen.query.filter_by(name='Escherichia coli').one().id
+    
+    # Every result in the window counts, repeat cultures included
+    response = client.get(f'/treatment/api/pathogen/{pathogen_id}/resistance',
+                          query_string={'start': '2024-03-01', 'end': '2024-03-31'})
+    assert [(stat['resistant'], stat['total'], stat['percentage']) for stat in response.get_json()] == [(2, 2, 100)]
+    
+    response = client.get(f'/treatment/api/pathogen/{pathogen_id}/resistance', query_string={'end': '2024-03'})
+    assert response.status_code == 400
@@ -0,0 +1,136 @@
+import gzip
+
+import pytest
+
+from app import db
+from models import Facility
+from cache import SQLiteCache, bump_data_version
+import cache
+
+def add_facilities(count, start=0):
+    db.session.add_all([
+        Facility(name=f'Clinic {index}', state='Karnataka', latitude=12.9 + index / 100, longitude=77.5)
+        for index in range(start, start + count)
+    ])
+    db.session.commit()
+
+def names(response):
+    return [point['name'] for point in response.get_json()]
+
+def test_cached_response_is_served_until_the_data_changes(client, memory_cache, count_queries):
+    add_facilities(2)
+    assert names(client.get('/dashboard/api/map_data')) == ['Clinic 0', 'Clinic 1']
+    
+    add_facilities(1, start=2)
+    with count_queries() as statements:
+        response = client.get('/dashboard/api/map_data')
+    assert names(response) == ['Clinic 0', 'Clinic 1']
+    assert not any('resistance_rollup' in statement for statement in statements)
+    
+    bump_data_version()
+    assert names(client.get('/dashboard/api/map_data')) == ['Clinic 0', 'Clinic 1', 'Clinic 2']
+
+def test_cache_key_includes_query_arguments(client, memory_cache):
+    client.get('/dashboard/api/map_data?a=1')
+    client.get('/dashboard/api/map_data?a=2')
+    client.get('/dashboard/api/map_data?a=1')
+    assert sorted(memory_cache._entries) == ['dashboard.map_data/?a=1', 'dashboard.map_data/?a=2']
+
+def test_errors_are_not_cached(client, memory_cache):
+    assert client.get('/treatment/api/pathogen/1/resistance').status_code == 404
+    assert not memory_cache._entries
+
+def test_ingest_invalidates_cached_responses(client, facility, user, memory_cache):
+    from data_processing import process_lab_data
+    
+    client.get('/dashboard/api/map_data')
+    assert memory_cache._entries
+    
+    process_lab_data([{'pathogen': 'Escherichia coli', 'antibiotic': 'Meropenem', 'result': 'R'}], facility.id, user.id)
+    assert memory_cache.data_version() > 0 and not memory_cache._entries
+
+def test_sqlite_cache_entries_expire_with_the_data_version(tmp_path):
+    first = SQLiteCache(str(tmp_path / 'cache.sqlite3'))
+    second = SQLiteCache(str(tmp_path / 'cache.sqlite3'))  # another worker on the same host
+    
+    first.set('key', {'body': '[]'}, 300, first.data_version())
+    assert second.get('key') == {'body': '[]'}
+    
+    second.bump_data_version()
+    assert first.get('key') is None
+    
+    # A value computed before the bump is stored under the old version and never served
+    first.set('key', {'body': 'stale'}, 300, 0)
+    assert first.get('key') is None
+    
+    first.set('key', {'body': 'fresh'}, 300, first.data_version())
+    assert second.get('key') == {'body': 'fresh'}
+
+def test_memory_cache_drops_writes_from_an_old_version(memory_cache):
+    version = memory_cache.data_version()
+    memory_cache.bump_data_version()
+    memory_cache.set('key', 'stale', 300, version)
+    assert memory_cache.get('key') is None
+
+def test_etag_changes_with_the_data_version(client, memory_cache):
+    first = client.get('/dashboard/api/map_data').headers['ETag']
+    assert client.get('/dashboard/api/map_data').headers['ETag'] == first
+    assert client.get('/dashboard/api/map_data?state=Kerala').headers['ETag'] != first
+    
+    bump_data_version()
+    assert client.get('/dashboard/api/map_data').headers['ETag'] != first
+
+def test_if_none_match_revalidates_without_running_the_view(client, memory_cache, count_queries):
+    etag = client.get('/dashboard/api/map_data').headers['ETag']
+    
+    with count_queries() as statements:
+        response = client.get('/dashboard/api/map_data', headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag and 'Accept-Encoding' in response.vary
+    assert not any('facility' in statement for statement in statements)
+    
+    bump_data_version()
+    assert client.get('/dashboard/api/map_data', headers={'If-None-Match': etag}).status_code == 200
+
+def test_gzip_when_accepted(client, memory_cache):
+    add_facilities(20)
+    plain = client.get('/dashboard/api/map_data')
+    assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.vary
+    
+    response = client.get('/dashboard/api/map_data', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.data) == plain.data
+    
+    # Each encoding has its own ETag, and either revalidates
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert client.get('/dashboard/api/map_data', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+    }).status_code == 304
+
+def test_brotli_preferred_when_installed(client, memory_cache):
+    brotli = pytest.importorskip('brotli')
+    add_facilities(20)
+    plain = client.get('/dashboard/api/map_data')
+    
+    response = client.get('/dashboard/api/map_data', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br' and 'Accept-Encoding' in response.vary
+    assert brotli.decompress(response.data) == plain.data
+
+def test_encoding_choice():
+    assert cache._choose_encoding('') is None
+    assert cache._choose_encoding('identity') is None
+    assert cache._choose_encoding('gzip;q=0, deflate') is None
+    assert cache._choose_encoding('GZIP;q=0.5') == 'gzip'
+    assert cache._choose_encoding('br;q=0, gzip') == 'gzip'
+
+def test_gzip_without_brotli(monkeypatch):
+    monkeypatch.setattr(cache, 'brotli', None)
+    assert cache._choose_encoding('br, gzip') == 'gzip'
+    assert cache._choose_encoding('br') is None
+
+def test_small_bodies_are_not_compressed(client, memory_cache):
+    response = client.get('/dashboard/api/map_data', headers={'Accept-Encoding': 'gzip'})
+    assert response.get_json() == []
+    assert 'Content-Encoding' not in response.headers
+    assert not response.headers['ETag'].endswith('-gzip"') and 'Accept-Encoding' in response.vary
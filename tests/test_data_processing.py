@@ -0,0 +1,28 @@
+from models import LabReport
+from data_processing import process_lab_data
+
+def result(pathogen='Escherichia coli', antibiotic='Meropenem', patient='patient-1', sample_date='2024-03-01'):
+    return {
+        'pathogen': pathogen,
+        'antibiotic': antibiotic,
+        'result': 'R',
+        'patient_id': patient,
+        'sample_date': sample_date,
+        'sample_type': 'urine'
+    }
+
+def test_isolate_rows_share_a_report(facility, user):
+    # The rows of one isolate span chunks
+    records = [result(antibiotic=antibiotic) for antibiotic in ('Meropenem', 'Ciprofloxacin', 'Colistin')]
+    process_lab_data(records, facility.id, user.id, chunk_size=2)
+    assert LabReport.query.count() == 1
+
+def test_isolates_split_by_pathogen(facility, user):
+    records = [result(), result(pathogen='Klebsiella pneumoniae')]
+    process_lab_data(records, facility.id, user.id)
+    assert LabReport.query.count() == 2
+
+def test_undated_rows_are_not_merged(facility, user):
+    records = [result(sample_date=None), result(antibiotic='Ciprofloxacin', sample_date=None)]
+    process_lab_data(records, facility.id, user.id)
+    assert LabReport.query.count() == 2
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import numpy as np
+
+from models import LabReport
+from data_processing import process_lab_data
+from utils import infer_date_format, parse_date_column
+
+def test_infers_day_first_for_ambiguous_slashed_dates():
+    # 03/04 could be either order; 25/04 settles it, and only day-first formats are accepted
+    values = ['03/04/2024', '25/04/2024', '01/12/2023']
+    assert infer_date_format(values) == '%d/%m/%Y'
+    
+    dates, invalid = parse_date_column(values, '%d/%m/%Y')
+    assert dates == [datetime(2024, 4, 3), datetime(2024, 4, 25), datetime(2023, 12, 1)]
+    assert not invalid.any()
+
+def test_month_first_dates_are_rejected_not_swapped():
+    dates, invalid = parse_date_column(['04/25/2024', '03/04/2024'], infer_date_format(['04/25/2024', '03/04/2024']))
+    assert dates == [None, datetime(2024, 4, 3)]
+    assert invalid.tolist() == [True, False]
+
+def test_mixed_formats_fall_back_per_value():
+    values = ['2024-03-01', '2024-03-02', '02/03/2024', '2024/03/04 10:30:00']
+    assert infer_date_format(values) == '%Y-%m-%d'
+    
+    dates, invalid = parse_date_column(values, infer_date_format(values))
+    assert dates == [datetime(2024, 3, 1), datetime(2024, 3, 2), datetime(2024, 3, 2), datetime(2024, 3, 4, 10, 30)]
+    assert not invalid.any()
+
+def test_blanks_are_missing_not_invalid():
+    values = ['2024-03-01', '', None, '   ', np.nan]
+    dates, invalid = parse_date_column(values, infer_date_format(values))
+    assert dates == [datetime(2024, 3, 1), None, None, None, None]
+    assert not invalid.any()
+
+def test_blank_or_unparseable_column_has_no_format():
+    assert infer_date_format(['', None]) is None
+    assert infer_date_format(['yesterday', 'n/a']) is None
+    
+    dates, invalid = parse_date_column(['yesterday', ''], None)
+    assert dates == [None, None]
+    assert invalid.tolist() == [True, False]
+
+def test_unparseable_dates_reject_the_row(facility, user):
+    records = [{
+        'pathogen': 'Escherichia coli',
+        'antibiotic': 'Meropenem',
+        'result': 'R',
+        'patient_id': f'patient-{index}',
+        'report_date': report_date,
+        'sample_date': sample_date
+    } for index, (report_date, sample_date) in enumerate([
+        ('2024-03-01', '2024-02-28'),
+        ('2024-13-45', '2024-02-28'),
+        ('2024-03-02', 'last week'),
+        ('', '')
+    ])]
+    summary = process_lab_data(records, facility.id, user.id)
+    
+    assert (summary['inserted'], summary['rejected']) == (2, 2)
+    assert summary['rejects'] == [
+        {'row': 2, 'reason': 'Invalid report_date: 2024-13-45'},
+        {'row': 3, 'reason': 'Invalid sample_date: last week'}
+    ]
+    
+    # A blank report date is not an error; the report is dated on arrival
+    dates = sorted(report.report_date.date() for report in LabReport.query)
+    assert dates[0] == datetime(2024, 3, 1).date() and dates[1] == datetime.utcnow().date()
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from models import Alert, AlertRecipient
+from data_processing import process_lab_data
+
+@pytest.fixture
+def query_plans(app):
+    """Collect the SQLite query plan of every statement executed inside the block"""
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('query plans are checked on SQLite')
+    
+    class Recorder:
+        def __init__(self):
+            self.statements = []
+        
+        def __enter__(self):
+            event.listen(db.engine, 'before_cursor_execute', self.record)
+            return self
+        
+        def __exit__(self, *exc_info):
+            event.remove(db.engine, 'before_cursor_execute', self.record)
+        
+        def record(self, connection, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT') and not executemany:
+                self.statements.append((statement, parameters))
+        
+        def plans(self, table):
+            """Plans of the recorded statements that read ``table``"""
+            plans = []
+            with db.engine.connect() as connection:
+                for statement, parameters in self.statements:
+                    if f'FROM {table}' not in statement and f'JOIN {table}' not in statement:
+                        continue
+                    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+                    plans.append(' | '.join(row[-1] for row in rows))
+            assert plans, f'no recorded query reads {table}'
+            return plans
+    
+    return Recorder
+
+def add_alert(user):
+    alert = Alert(title='Carbapenem resistance', message='Rising resistance', alert_type='resistance', severity=4)
+    db.session.add(alert)
+    db.session.flush()
+    db.session.add(AlertRecipient(alert_id=alert.id, user_id=user.id, created_at=datetime.now()))
+    db.session.commit()
+
+def add_reports(facility, user):
+    process_lab_data([
+        {'pathogen': 'Escherichia coli', 'antibiotic': 'Meropenem', 'result': 'R', 'patient_id': 'p1'},
+        {'pathogen': 'Klebsiella pneumoniae', 'antibiotic': 'Colistin', 'result': 'S', 'patient_id': 'p2'}
+    ], facility.id, user.id)
+
+def test_alert_queries_use_recipient_index(client, user, query_plans):
+    add_alert(user)
+    
+    with query_plans() as recorder:
+        assert client.get('/alerts/api/latest').status_code == 200
+        assert client.get('/alerts/api/list?read=false').status_code == 200
+    
+    for plan in recorder.plans('alert_recipient'):
+        assert 'ix_alert_recipient_user' in plan, plan
+
+def test_report_listing_uses_facility_date_index(client, facility, user, query_plans):
+    add_reports(facility, user)
+    
+    with query_plans() as recorder:
+        response = client.get(f'/data/api/reports?facility_id={facility.id}')
+    assert response.status_code == 200
+    
+    plans = recorder.plans('lab_report')
+    assert any('ix_lab_report_facility_date' in plan for plan in plans), plans
+
+def test_dashboard_aggregates_use_rollup_indexes(client, facility, user, query_plans):
+    add_reports(facility, user)
+    
+    with query_plans() as recorder:
+        assert client.get('/dashboard/api/regional_comparison').status_code == 200
+    plan, = recorder.plans('resistance_rollup')
+    assert 'ix_facility_state' in plan and 'ix_resistance_rollup_facility' in plan, plan
+    
+    with query_plans() as recorder:
+        assert client.get('/dashboard/api/map_data').status_code == 200
+    plan, = recorder.plans('resistance_rollup')
+    assert 'ix_resistance_rollup_facility' in plan, plan
+    
+    with query_plans() as recorder:
+        assert client.get('/dashboard/api/pathogen_distribution').status_code == 200
+    plan, = recorder.plans('resistance_rollup')
+    assert 'ix_resistance_rollup_pathogen_antibiotic' in plan, plan
+
+def test_name_lookups_use_unique_name_index(facility, user, query_plans):
+    with query_plans() as recorder:
+        add_reports(facility, user)
+    
+    for plan in recorder.plans('pathogen'):
+        assert 'ix_pathogen_name' in plan, plan
+    for plan in recorder.plans('antibiotic'):
+        assert 'ix_antibiotic_name' in plan, plan
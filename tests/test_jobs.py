@@ -0,0 +1,35 @@
+import jobs
+from app import db
+from models import IngestJob
+
+def spool(tmp_path, facility, user, status, name):
+    path = tmp_path / name
+    path.write_text('pathogen,antibiotic,result\n')
+    job = IngestJob(user_id=user.id, facility_id=facility.id, filename=name, file_path=str(path),
+                    file_format='csv', status=status, rows_parsed=0)
+    db.session.add(job)
+    db.session.commit()
+    return job, path
+
+def test_recover_settles_interrupted_jobs(app, tmp_path, facility, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    running, running_path = spool(tmp_path, facility, user, 'running', 'running.csv')
+    queued, queued_path = spool(tmp_path, facility, user, 'queued', 'queued.csv')
+    orphan = tmp_path / 'orphan.csv'
+    orphan.write_text('')
+    
+    submitted = []
+    monkeypatch.setattr(jobs, 'submit', lambda func, *args: submitted.append(args))
+    jobs.recover_ingest_jobs()
+    
+    db.session.expire_all()
+    assert running.status == 'failed'
+    assert running.error == 'Interrupted by a server restart'
+    assert queued.status == 'queued'
+    assert queued_path.exists()
+    assert not orphan.exists() and not running_path.exists()
+    
+    # Queued jobs are left to the workers
+    assert submitted == []
+    jobs.resume_queued_jobs()
+    assert submitted == [(queued.id,)]
@@ -0,0 +1,127 @@
+import shutil
+import sqlite3
+from pathlib import Path
+
+from flask import Flask
+
+from app import db
+from migrations import upgrade_database, LEGACY_ALERT_COLUMNS
+from utils import PatientIdHasher, PATIENT_ID_VERSION
+
+BASELINE_SCHEMA = Path(__file__).with_name('baseline_schema.sql')
+INSTANCE_DATABASE = Path(__file__).parent.parent / 'instance' / 'amr_network.db'
+
+BASELINE_ROWS = """
+INSERT INTO user (id, username, email, role) VALUES
+    (1, 'doctor', 'doctor@example.org', 'DOCTOR'),
+    (2, 'official', 'official@example.org', 'PUBLIC_HEALTH_OFFICIAL');
+INSERT INTO facility (id, name, city, state) VALUES (1, 'General Hospital', 'Pune', 'Maharashtra');
+INSERT INTO pathogen (id, name) VALUES (1, 'Escherichia coli');
+INSERT INTO antibiotic (id, name) VALUES (1, 'Meropenem');
+INSERT INTO lab_report (id, report_id, facility_id, user_id, report_date, patient_identifier) VALUES
+    (1, 'LR-1', 1, 1, '2024-03-01 10:00:00.000000', 'e6c1793a56566e6ad130456e7184a94b6618ab6da748e3deaafe82750e0ff199');
+INSERT INTO resistance_profile (id, lab_report_id, pathogen_id, antibiotic_id, result) VALUES (1, 1, 1, 1, 'R');
+INSERT INTO alert (id, user_id, title, message, alert_type, severity, created_at, "read", action_taken) VALUES
+    (1, 1, 'Resistance', 'Meropenem resistance', 'resistance', 4, '2024-03-01 10:00:00.000000', 1, 0),
+    (2, 2, 'Resistance', 'Meropenem resistance', 'resistance', 4, '2024-03-01 10:00:00.000000', 0, 1);
+"""
+
+def create_database(path, schema, rows=''):
+    connection = sqlite3.connect(path)
+    connection.executescript(schema + rows)
+    connection.commit()
+    connection.close()
+    return path
+
+def upgrade(path):
+    """Run upgrade_database against the SQLite file at ``path`` as app startup would"""
+    upgrade_app = Flask(__name__)
+    upgrade_app.config.from_object('config.Config')
+    upgrade_app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{path}', CACHE_BACKEND='null')
+    db.init_app(upgrade_app)
+    
+    with upgrade_app.app_context():
+        try:
+            return upgrade_database()
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+def test_upgrade_baseline_database(tmp_path):
+    path = create_database(tmp_path / 'baseline.db', BASELINE_SCHEMA.read_text(), BASELINE_ROWS)
+    assert upgrade(path) > 0
+    
+    connection = sqlite3.connect(path)
+    alert_columns = {row[1] for row in connection.execute('PRAGMA table_info(alert)')}
+    assert not alert_columns & set(LEGACY_ALERT_COLUMNS)
+    
+    # Per-user alert state moved to alert_recipient
+    assert connection.execute(
+        'SELECT alert_id, user_id, "read", action_taken FROM alert_recipient ORDER BY alert_id'
+    ).fetchall() == [(1, 1, 1, 0), (2, 2, 0, 1)]
+    
+    # Every declared index exists, including those of the rebuilt alert table
+    indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    declared = {index.name for table in db.metadata.sorted_tables for index in table.indexes}
+    assert declared <= indexes
+    connection.close()
+    
+    # A second run has nothing left to do
+    assert upgrade(path) == 0
+
+def test_upgrade_alerts_without_flags(tmp_path):
+    # Older databases kept the recipient on the alert but no read/action_taken flags
+    schema = BASELINE_SCHEMA.read_text().replace('\tread BOOLEAN,\n\taction_taken BOOLEAN,\n', '')
+    rows = BASELINE_ROWS[:BASELINE_ROWS.index('INSERT INTO alert')] + (
+        "INSERT INTO alert (id, user_id, title, message) VALUES (1, 1, 'Resistance', 'Meropenem resistance');"
+    )
+    path = create_database(tmp_path / 'legacy.db', schema, rows)
+    upgrade(path)
+    
+    connection = sqlite3.connect(path)
+    assert connection.execute(
+        'SELECT alert_id, user_id, "read", action_taken FROM alert_recipient'
+    ).fetchall() == [(1, 1, 0, 0)]
+    connection.close()
+
+def test_upgrade_instance_database(tmp_path):
+    # The committed development database predates most of models.py
+    path = tmp_path / 'amr_network.db'
+    shutil.copyfile(INSTANCE_DATABASE, path)
+    assert upgrade(path) > 0
+    
+    connection = sqlite3.connect(path)
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'cumulative_antibiogram', 'alert_recipient'} <= tables
+    
+    # The unrelated legacy antibiogram table is left alone
+    legacy_columns = {row[1] for row in connection.execute('PRAGMA table_info(antibiogram)')}
+    assert 'antibiotic_name' in legacy_columns
+    connection.close()
+    
+    assert upgrade(path) == 0
+
+def test_upgrade_fills_rollups(tmp_path):
+    path = create_database(tmp_path / 'baseline.db', BASELINE_SCHEMA.read_text(), BASELINE_ROWS)
+    upgrade(path)
+    
+    # The dashboards read only from the rollups, so existing lab data must be in them
+    connection = sqlite3.connect(path)
+    assert connection.execute(
+        'SELECT day, facility_id, pathogen_id, antibiotic_id, resistant, total FROM resistance_rollup'
+    ).fetchall() == [('2024-03-01', 1, 1, 1, 1, 1)]
+    assert connection.execute(
+        'SELECT state, city, pathogen_id, day, resistant, total FROM outbreak_series_day'
+    ).fetchall() == [('Maharashtra', 'Pune', 1, '2024-03-01', 1, 1)]
+    connection.close()
+
+def test_upgrade_rekeys_legacy_patient_identifiers(tmp_path):
+    path = create_database(tmp_path / 'baseline.db', BASELINE_SCHEMA.read_text(), BASELINE_ROWS)
+    upgrade(path)
+    
+    # The stored SHA256(id + salt) now equals what ingesting patient-1 produces today
+    connection = sqlite3.connect(path)
+    assert connection.execute('SELECT patient_identifier, patient_id_version FROM lab_report').fetchall() == [
+        (PatientIdHasher('default_salt').hash_batch(['patient-1'])[0], PATIENT_ID_VERSION)
+    ]
+    connection.close()
@@ -0,0 +1,133 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import notifications
+from app import db
+from models import Alert, NotificationOutbox
+from notifications import StubTransport, enqueue_notifications, dispatch_pending, delivery_status
+
+# The fixture stubs the timer out; its own test calls the real one
+schedule_retry = notifications._schedule_retry
+
+@pytest.fixture
+def outbox(app, user, monkeypatch):
+    """Queue one email and one SMS for an alert; dispatch is driven by the test"""
+    for channel in ('EMAIL', 'SMS', 'PUSH'):
+        monkeypatch.setitem(app.config, f'NOTIFY_{channel}_TRANSPORT', 'stub')
+    monkeypatch.setattr(notifications, 'request_dispatch', lambda: None)
+    monkeypatch.setattr(notifications, '_schedule_retry', lambda: None)
+    monkeypatch.setattr(StubTransport, 'sent', [])
+    
+    user.phone_number = '+911234567890'
+    alert = Alert(title='Carbapenem resistance', message='Cluster in Pune', severity=5)
+    db.session.add(alert)
+    db.session.flush()
+    enqueue_notifications(user, alert)
+    db.session.commit()
+    return alert
+
+def messages():
+    db.session.expire_all()
+    return {message.channel: message for message in NotificationOutbox.query}
+
+def make_due():
+    NotificationOutbox.query.update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+def test_dispatch_sends_each_channel(outbox):
+    assert dispatch_pending() == 2
+    
+    assert sorted(channel for channel, _ in StubTransport.sent) == ['email', 'sms']
+    assert {message.status for message in messages().values()} == {'sent'}
+    assert delivery_status(outbox.id) == {'email': {'sent': 1}, 'sms': {'sent': 1}}
+
+def test_failed_message_backs_off_then_gives_up(app, outbox, monkeypatch):
+    monkeypatch.setitem(app.config, 'NOTIFY_STUB_FAIL_RECIPIENTS', {'+911234567890'})
+    monkeypatch.setitem(app.config, 'NOTIFY_MAX_ATTEMPTS', 3)
+    
+    before = datetime.utcnow()
+    assert dispatch_pending() == 1
+    sms = messages()['sms']
+    assert (sms.status, sms.attempts, sms.claim_token) == ('pending', 1, None)
+    assert sms.last_error == 'Stub rejected +911234567890'
+    assert timedelta(seconds=30) <= sms.next_attempt_at - before < timedelta(seconds=35)
+    
+    # Not due yet: nothing is sent again
+    assert dispatch_pending() == 0
+    assert messages()['sms'].attempts == 1
+    
+    make_due()
+    before = datetime.utcnow()
+    dispatch_pending()
+    sms = messages()['sms']
+    assert (sms.status, sms.attempts) == ('pending', 2)
+    assert timedelta(seconds=60) <= sms.next_attempt_at - before < timedelta(seconds=65)
+    
+    make_due()
+    dispatch_pending()
+    sms = messages()['sms']
+    assert (sms.status, sms.attempts) == ('failed', 3)
+    assert delivery_status(outbox.id) == {'email': {'sent': 1}, 'sms': {'failed': 1}}
+
+def test_unavailable_transport_fails_the_whole_batch(app, outbox, monkeypatch):
+    monkeypatch.setitem(app.config, 'NOTIFY_STUB_UNAVAILABLE', True)
+    
+    assert dispatch_pending() == 0
+    assert {(message.status, message.last_error) for message in messages().values()} == {
+        ('pending', 'Stub transport unavailable')
+    }
+
+def test_claimed_messages_are_not_sent_twice(app, outbox, monkeypatch):
+    second = []
+    once = threading.Lock()
+    
+    class ConcurrentStub(StubTransport):
+        # Another dispatcher runs while this one holds its claim
+        def send_batch(self, channel, payload):
+            if once.acquire(blocking=False):
+                thread = threading.Thread(target=rival_dispatch)
+                thread.start()
+                thread.join()
+            return super().send_batch(channel, payload)
+    
+    def rival_dispatch():
+        with app.app_context():
+            second.append(notifications._dispatch_claimed_batch())
+    
+    monkeypatch.setitem(notifications.TRANSPORTS, 'stub', ConcurrentStub)
+    assert dispatch_pending() == 2
+    
+    assert second == [(0, 0)]
+    assert len(StubTransport.sent) == 2
+
+def test_expired_lease_is_retried(outbox):
+    # A dispatcher died while sending; once its lease expires the message is due again
+    NotificationOutbox.query.update({'status': 'sending', 'claim_token': 'dead',
+                                     'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    
+    assert dispatch_pending() == 2
+    assert {message.status for message in messages().values()} == {'sent'}
+
+def test_retry_timer_wakes_for_the_next_due_message(app, outbox, monkeypatch):
+    timers = []
+    
+    class Timer:
+        def __init__(self, delay, callback):
+            timers.append(delay)
+        
+        def start(self):
+            pass
+        
+        def cancel(self):
+            pass
+    
+    monkeypatch.setattr(notifications.threading, 'Timer', Timer)
+    monkeypatch.setattr(notifications, '_retry_timer', None)
+    NotificationOutbox.query.update({'next_attempt_at': datetime.utcnow() + timedelta(seconds=120)})
+    db.session.commit()
+    
+    schedule_retry()
+    assert len(timers) == 1 and 115 < timers[0] <= 120
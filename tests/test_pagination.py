@@ -0,0 +1,33 @@
+import base64
+import json
+
+import pytest
+
+from models import LabReport
+from utils import encode_cursor, decode_cursor
+
+COLUMNS = (LabReport.report_date, LabReport.id)
+
+def token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+@pytest.mark.parametrize('cursor', [
+    token(['next', 5, 1]),  # date is not a string
+    token(['next', '2024-03-01T00:00:00', 'x']),  # id is not a number
+    token(['next', '2024-03-01T00:00:00']),
+    token({'next': 1}),
+    token(7),
+    'not base64!'
+])
+def test_tampered_cursor_is_rejected(client, cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, COLUMNS)
+    
+    response = client.get('/data/api/reports', query_string={'cursor': cursor})
+    assert response.status_code == 400
+
+def test_cursor_round_trip(app):
+    from datetime import datetime
+    
+    values = [datetime(2024, 3, 1, 12, 30), 42]
+    assert decode_cursor(encode_cursor('prev', values), COLUMNS) == ('prev', values)
@@ -0,0 +1,74 @@
+import io
+import json
+
+import pytest
+
+from utils import iter_json_records, iter_json_batches, iter_csv_batches
+
+RECORDS = [
+    {'pathogen': 'Escherichia coli', 'antibiotic': 'Meropenem', 'result': 'R', 'mic_value': 16},
+    {'pathogen': 'Klebsiella pneumoniae', 'antibiotic': 'Colistin', 'result': 'S', 'mic_value': 0.5},
+    {'pathogen': 'Acinetobacter baumannii', 'antibiotic': 'Amikacin', 'result': 'I', 'mic_value': None}
+]
+
+class CountingStream(io.BytesIO):
+    """Byte stream recording how much of it has been read"""
+    
+    def read(self, size=-1):
+        data = super().read(size)
+        self.consumed = self.tell()
+        return data
+
+def stream(text):
+    return CountingStream(text.encode('utf-8'))
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 65536])
+def test_json_array_across_block_boundaries(block_size):
+    text = json.dumps(RECORDS, indent=2)
+    assert list(iter_json_records(stream(text), block_size)) == RECORDS
+
+@pytest.mark.parametrize('block_size', [1, 5, 65536])
+def test_ndjson(block_size):
+    text = '\n'.join(json.dumps(record) for record in RECORDS) + '\n'
+    assert list(iter_json_records(stream(text), block_size)) == RECORDS
+
+def test_numbers_split_across_blocks():
+    # 12345 must not be yielded as 1, 12, ... when a block ends inside it
+    assert list(iter_json_records(stream('[12345, 6789]'), 2)) == [12345, 6789]
+
+def test_byte_order_mark_and_trailing_comma():
+    text = '\ufeff[' + ', '.join(json.dumps(record) for record in RECORDS) + ',]'
+    assert list(iter_json_records(stream(text), 8)) == RECORDS
+
+def test_malformed_record_at_end_of_file():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_records(stream('[{"pathogen": "E. coli"}, {"pathogen": }]'), 8))
+
+def test_malformed_record_does_not_buffer_the_file():
+    good = json.dumps(RECORDS[0])
+    text = '[' + good + ', {"pathogen": oops}, ' + ', '.join([good] * 5000) + ']'
+    source = stream(text)
+    
+    records = iter_json_records(source, block_size=64, max_record_size=1024)
+    assert next(records) == RECORDS[0]
+    with pytest.raises(json.JSONDecodeError):
+        next(records)
+    assert source.consumed < 2048
+
+def test_json_batches():
+    text = json.dumps(RECORDS)
+    assert list(iter_json_batches(stream(text), batch_size=2)) == [RECORDS[:2], RECORDS[2:]]
+
+def test_csv_batches_read_text_columns():
+    text = (
+        '\ufeffpathogen,antibiotic,result,patient_id\n'
+        'Escherichia coli,Meropenem,R,007\n'
+        'Klebsiella pneumoniae,Colistin,S,008\n'
+        'Acinetobacter baumannii,Amikacin,I,009\n'
+    )
+    batches = list(iter_csv_batches(stream(text), batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    
+    # Identifiers keep their leading zeros
+    assert batches[0][0] == {'pathogen': 'Escherichia coli', 'antibiotic': 'Meropenem',
+                             'result': 'R', 'patient_id': '007'}
@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+
+from models import LabReport
+from data_processing import process_lab_data
+from utils import PatientIdHasher, PATIENT_ID_VERSION, hash_patient_ids
+
+def legacy_hash(patient_id, salt):
+    """SHA256(id + salt), as stored by earlier releases"""
+    return hashlib.sha256(f"{patient_id}{salt}".encode()).hexdigest()
+
+def test_pseudonym_is_keyed_legacy_hash():
+    hasher = PatientIdHasher('secret')
+    expected = hmac.new(b'secret', legacy_hash('patient-1', 'secret').encode(), hashlib.sha256).hexdigest()
+    assert hasher.hash_batch(['patient-1']) == [expected]
+    assert hasher.rekey(legacy_hash('patient-1', 'secret')) == expected
+
+def test_key_changes_every_pseudonym():
+    assert PatientIdHasher('one').hash_batch(['patient-1']) != PatientIdHasher('two').hash_batch(['patient-1'])
+
+def test_batch_is_aligned_with_blank_ids():
+    hasher = PatientIdHasher('secret')
+    hashes = hasher.hash_batch(['a', None, '', 'b', 'a', 7])
+    
+    assert hashes[1] == hashes[2] == ''
+    assert hashes[0] == hashes[4] != hashes[3]
+    assert hashes[5] == hasher.hash_batch(['7'])[0]
+
+def test_lru_is_bounded_and_evicts_least_recent():
+    hasher = PatientIdHasher('secret', max_entries=2)
+    hasher.hash_batch(['a', 'b'])
+    hasher.hash_batch(['a'])  # b is now least recently used
+    hasher.hash_batch(['c'])
+    
+    assert list(hasher._hashes) == ['a', 'c']
+
+def test_cached_pseudonyms_are_reused(monkeypatch):
+    hasher = PatientIdHasher('secret')
+    first = hasher.hash_batch(['a', 'a', 'b'])
+    
+    calls = []
+    monkeypatch.setattr(hasher, 'rekey', lambda value: calls.append(value))
+    assert hasher.hash_batch(['b', 'a']) == [first[2], first[0]]
+    assert calls == []
+
+def test_app_hasher_uses_configured_key(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PATIENT_ID_SALT', 'configured')
+    app.extensions.pop('patient_id_hasher', None)
+    try:
+        assert hash_patient_ids(['patient-1']) == PatientIdHasher('configured').hash_batch(['patient-1'])
+    finally:
+        app.extensions.pop('patient_id_hasher', None)
+
+def test_ingested_reports_use_current_scheme(facility, user):
+    process_lab_data([{'pathogen': 'Escherichia coli', 'antibiotic': 'Meropenem', 'result': 'R',
+                       'patient_id': 'patient-1', 'sample_date': '2024-03-01'}], facility.id, user.id)
+    report = LabReport.query.one()
+    assert report.patient_identifier == hash_patient_ids(['patient-1'])[0]
+    assert report.patient_id_version == PATIENT_ID_VERSION
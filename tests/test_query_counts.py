@@ -0,0 +1,59 @@
+from app import db
+from models import Facility
+from data_processing import process_lab_data
+
+def add_reports(facility, user, count, start=0):
+    """Ingest ``count`` lab reports with two resistance results each"""
+    records = []
+    for index in range(start, start + count):
+        for antibiotic in ('Ciprofloxacin', 'Meropenem'):
+            records.append({
+                'pathogen': ('Escherichia coli', 'Klebsiella pneumoniae')[index % 2],
+                'antibiotic': antibiotic,
+                'result': 'RS'[index % 2],
+                'patient_id': f'patient-{index}',
+                'sample_date': '2024-03-01',
+                'sample_type': 'urine'
+            })
+    summary = process_lab_data(records, facility.id, user.id)
+    assert summary['inserted'] == len(records)
+
+def add_facilities(count):
+    db.session.add_all([
+        Facility(name=f'Clinic {index}', state='Karnataka', latitude=12.9 + index / 100, longitude=77.5)
+        for index in range(count)
+    ])
+    db.session.commit()
+
+def test_latest_data_query_count_is_constant(client, facility, user, count_queries):
+    add_reports(facility, user, 3)
+    with count_queries() as few:
+        response = client.get('/data/api/latest')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 3
+    
+    add_reports(facility, user, 40, start=3)
+    with count_queries() as many:
+        response = client.get('/data/api/latest')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 10
+    assert all(len(report['resistance_data']) == 2 for report in response.get_json())
+    
+    assert len(many) == len(few)
+
+def test_map_data_query_count_is_constant(client, facility, user, count_queries):
+    add_reports(facility, user, 5)
+    add_facilities(2)
+    with count_queries() as few:
+        response = client.get('/dashboard/api/map_data')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 3
+    
+    add_reports(facility, user, 50, start=5)
+    add_facilities(30)
+    with count_queries() as many:
+        response = client.get('/dashboard/api/map_data')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 33
+    
+    assert len(many) == len(few)
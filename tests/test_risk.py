@@ -0,0 +1,30 @@
+from models import Pathogen
+from data_processing import process_lab_data
+from analytics import resistance_risk_matrix
+from utils import calculate_resistance_risk
+
+def add_results(facility, user, results):
+    records = [{
+        'pathogen': 'Escherichia coli',
+        'antibiotic': 'Meropenem',
+        'result': result,
+        'patient_id': f'patient-{index}',
+        'sample_date': '2024-03-01'
+    } for index, result in enumerate(results)]
+    assert process_lab_data(records, facility.id, user.id)['inserted'] == len(records)
+    return Pathogen.query.filter_by(name='Escherichia coli').one().id
+
+def test_single_pair_risk_is_not_cached(facility, user, memory_cache):
+    pathogen_id = add_results(facility, user, 'RRRS')
+    
+    assert calculate_resistance_risk(pathogen_id, 'Maharashtra') == 75
+    assert calculate_resistance_risk(pathogen_id, 'Kerala') == 0
+    assert calculate_resistance_risk(pathogen_id + 1, 'Maharashtra') == 0
+    assert not memory_cache._entries
+
+def test_single_pair_risk_matches_the_matrix(facility, user, memory_cache):
+    pathogen_id = add_results(facility, user, 'RSSSS')
+    matrix = resistance_risk_matrix()
+    
+    assert calculate_resistance_risk(pathogen_id, 'Maharashtra') == matrix.score(pathogen_id, 'Maharashtra') == 20
+    assert len(memory_cache._entries) == 1
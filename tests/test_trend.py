@@ -0,0 +1,82 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import db
+from models import ResistanceRollup, Pathogen, Antibiotic
+from analytics import GRANULARITIES, truncate_date, next_bucket, resistance_trend, _bucket_expression
+
+# Mid-December to mid-January; 31 Dec 2023 is a Sunday and 1 Jan 2024 a Monday
+START = date(2023, 12, 18)
+END = date(2024, 1, 16)
+
+@pytest.fixture
+def rollups(facility):
+    """One rollup per day in [START, END]; day n has n + 1 results, one resistant on even days"""
+    pathogen = Pathogen(name='Escherichia coli')
+    antibiotic = Antibiotic(name='Meropenem')
+    db.session.add_all([pathogen, antibiotic])
+    db.session.flush()
+    
+    days = [START + timedelta(days=n) for n in range((END - START).days + 1)]
+    db.session.add_all([
+        ResistanceRollup(day=day, facility_id=facility.id, pathogen_id=pathogen.id, antibiotic_id=antibiotic.id,
+                         susceptible=n + 1 - (n % 2 == 0), resistant=int(n % 2 == 0), total=n + 1)
+        for n, day in enumerate(days)
+    ])
+    db.session.commit()
+    return days
+
+@pytest.mark.parametrize('granularity', GRANULARITIES)
+def test_sql_buckets_match_truncate_date(rollups, granularity):
+    bucket = _bucket_expression(granularity)
+    rows = db.session.query(ResistanceRollup.day, bucket).order_by(ResistanceRollup.day).all()
+    
+    assert [date.fromisoformat(str(value)[:10]) for _, value in rows] == [
+        truncate_date(day, granularity) for day, _ in rows
+    ]
+
+def test_week_buckets_start_on_monday():
+    # Sunday 31 Dec 2023 belongs to the week of Monday 25 Dec; Monday 1 Jan starts its own
+    assert truncate_date(date(2023, 12, 31), 'week') == date(2023, 12, 25)
+    assert truncate_date(date(2024, 1, 1), 'week') == date(2024, 1, 1)
+    assert next_bucket(date(2023, 12, 25), 'week') == date(2024, 1, 1)
+
+def test_month_buckets_roll_over_the_year():
+    assert truncate_date(date(2023, 12, 31), 'month') == date(2023, 12, 1)
+    assert next_bucket(date(2023, 12, 1), 'month') == date(2024, 1, 1)
+    assert next_bucket(date(2024, 1, 1), 'month') == date(2024, 2, 1)
+    assert next_bucket(date(2023, 11, 1), 'month') == date(2023, 12, 1)
+
+@pytest.mark.parametrize('granularity', GRANULARITIES)
+def test_trend_matches_python_grouping(rollups, granularity):
+    expected = {}
+    for n, day in enumerate(rollups):
+        total, resistant = expected.get(truncate_date(day, granularity), (0, 0))
+        expected[truncate_date(day, granularity)] = (total + n + 1, resistant + int(n % 2 == 0))
+    
+    trend = resistance_trend(granularity, START, END)
+    assert {entry['bucket']: (entry['total'], entry['resistant']) for entry in trend} == expected
+    assert sum(entry['total'] for entry in trend) == sum(range(1, len(rollups) + 1))
+
+def test_weekly_trend_from_midweek_start(rollups):
+    trend = resistance_trend('week', date(2023, 12, 28), date(2024, 1, 3))
+    
+    # Thursday start is widened to its Monday; the window ends mid-week
+    assert [entry['bucket'] for entry in trend] == [date(2023, 12, 25), date(2024, 1, 1)]
+    assert [entry['total'] for entry in trend] == [sum(range(8, 15)), sum(range(15, 18))]
+
+def test_empty_buckets_are_filled(rollups):
+    trend = resistance_trend('month', date(2023, 10, 15), date(2024, 3, 1))
+    
+    assert [entry['bucket'] for entry in trend] == [
+        date(2023, 10, 1), date(2023, 11, 1), date(2023, 12, 1), date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)
+    ]
+    assert [entry['total'] > 0 for entry in trend] == [False, False, True, True, False, False]
+    assert all(entry['resistant'] == 0 and entry['percentage'] == 0 for entry in trend if not entry['total'])
+
+def test_trend_without_data(app):
+    trend = resistance_trend('week', date(2024, 1, 1), date(2024, 1, 21))
+    assert [(entry['bucket'], entry['total'], entry['percentage']) for entry in trend] == [
+        (date(2024, 1, 1), 0, 0), (date(2024, 1, 8), 0, 0), (date(2024, 1, 15), 0, 0)
+    ]
@@ -0,0 +1,92 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from models import ResistanceProfile
+from data_processing import process_lab_data
+from utils import antibiotic_columns, melt_wide_frame, iter_csv_batches
+
+CODES = Config.ANTIBIOTIC_CODES
+ORGANISMS = Config.ORGANISM_CODES
+
+def by_antibiotic(records):
+    return {record['antibiotic']: record for record in records}
+
+def test_suffixed_codes_map_to_antibiotics():
+    columns = ['ORGANISM', 'SPEC_DATE', 'AMP', 'amp_nm', 'CIP_ND5', 'MEM_NM', 'XYZ', 'patient_id', 'NOTES_AMP']
+    assert antibiotic_columns(columns, CODES) == {
+        'AMP': 'Ampicillin',
+        'amp_nm': 'Ampicillin',
+        'CIP_ND5': 'Ciprofloxacin',
+        'MEM_NM': 'Meropenem'
+    }
+
+def test_long_format_frames_have_no_antibiotic_columns():
+    assert antibiotic_columns(['pathogen', 'antibiotic', 'result', 'AMP'], CODES) == {}
+
+def test_mic_and_interpretation_columns_merge():
+    frame = pd.DataFrame({
+        'ORGANISM': ['eco', 'kpn'],
+        'PATIENT_ID': ['p-1', 'p-2'],
+        'AMP': ['R', 's '],
+        'AMP_NM': ['>=32', '2'],
+        'CIP_ND5': ['12', None],
+        'CIP': ['I', ''],
+        'MEM_NM': ['<=0.25', '']
+    })
+    first, second = [by_antibiotic(record for record in melt_wide_frame(frame, CODES, ORGANISMS)
+                                   if record['patient_id'] == patient) for patient in ('p-1', 'p-2')]
+    
+    assert first['Ampicillin']['result'] == 'R' and first['Ampicillin']['mic_value'] == 32
+    assert first['Ampicillin']['pathogen'] == 'Escherichia coli'
+    # Disk zone diameters are not MICs
+    assert first['Ciprofloxacin']['result'] == 'I' and np.isnan(first['Ciprofloxacin']['mic_value'])
+    # An MIC without an interpretation leaves the result for ingest to reject
+    assert pd.isna(first['Meropenem']['result']) and first['Meropenem']['mic_value'] == 0.25
+    
+    # Empty cells produce no record
+    assert set(second) == {'Ampicillin'}
+    assert second['Ampicillin']['result'] == 'S' and second['Ampicillin']['mic_value'] == 2
+    assert second['Ampicillin']['pathogen'] == 'Klebsiella pneumoniae'
+
+def test_unknown_organism_codes_are_kept():
+    frame = pd.DataFrame({'ORGANISM': [' xyz ', 'Salmonella Typhi', None], 'SPEC_DATE': ['2024-03-01'] * 3, 'VAN': ['R'] * 3})
+    records = melt_wide_frame(frame, CODES, ORGANISMS)
+    assert [record['pathogen'] for record in records] == ['xyz', 'Salmonella Typhi', None]
+    assert all(record['sample_date'] == '2024-03-01' for record in records)
+
+def test_wide_csv_through_batches():
+    text = (
+        'ORGANISM,SPEC_DATE,SPEC_TYPE,PATIENT_ID,AMP,AMP_NM,GEN,COL_NM\n'
+        'eco,2024-03-01,ur,p-1,R,>32,S,\n'
+        'pae,2024-03-02,bl,p-2,,,R,4\n'
+        'aba,2024-03-03,bl,p-3,,,,\n'
+    )
+    batches = list(iter_csv_batches(io.BytesIO(text.encode('utf-8')), batch_size=2,
+                                    antibiotic_codes=CODES, organism_codes=ORGANISMS))
+    records = [record for batch in batches for record in batch]
+    
+    assert all(len(batch) <= 2 for batch in batches)
+    assert [(record['patient_id'], record['antibiotic']) for record in records] == [
+        ('p-1', 'Ampicillin'), ('p-1', 'Gentamicin'), ('p-2', 'Colistin'), ('p-2', 'Gentamicin')
+    ]
+    assert [record['result'] for record in records if record['antibiotic'] != 'Colistin'] == ['R', 'S', 'R']
+    assert pd.isna(records[2]['result']) and records[2]['mic_value'] == 4
+    assert records[0]['mic_value'] == 32 and records[3]['pathogen'] == 'Pseudomonas aeruginosa'
+    assert records[0]['sample_date'] == '2024-03-01' and records[0]['sample_type'] == 'ur'
+    assert not any('AMP_NM' in record or 'ORGANISM' in record for record in records)
+
+def test_wide_csv_ingests(facility, user):
+    text = 'ORGANISM,SPEC_DATE,PATIENT_ID,MEM,MEM_NM,COL_NM\neco,2024-03-01,p-1,R,16,4\n'
+    records = [record for batch in iter_csv_batches(io.BytesIO(text.encode('utf-8')),
+                                                    antibiotic_codes=CODES, organism_codes=ORGANISMS)
+               for record in batch]
+    summary = process_lab_data(records, facility.id, user.id)
+    
+    assert (summary['inserted'], summary['rejected']) == (1, 1)
+    assert summary['rejects'][0]['reason'] == 'Missing required fields: result'
+    profile = ResistanceProfile.query.one()
+    assert (profile.pathogen.name, profile.antibiotic.name, profile.result) == ('Escherichia coli', 'Meropenem', 'R')
+    assert profile.mic_value == 16
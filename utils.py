@@ -1,157 +1,484 @@
-import os
 import csv
 import json
+import base64
+import codecs
 import pandas as pd
-import io
+import numpy as np
+import re
 import hashlib
+import hmac
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import requests
-from flask import current_app
+from flask import current_app, request
+from sqlalchemy import tuple_, text
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'csv', 'json'}
 
+# Default number of records per streamed batch
+DEFAULT_BATCH_SIZE = 1000
+
+# Characters read from a JSON stream per block
+JSON_BLOCK_SIZE = 64 * 1024
+# Longest record the parser buffers before it gives up on a malformed one
+JSON_MAX_RECORD_SIZE = 16 * JSON_BLOCK_SIZE
+
+# Whitespace allowed between JSON values
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Isolate-level columns of WHONET-style exports and the record fields they map to
+WHONET_FIELDS = {
+    'ORGANISM': 'pathogen',
+    'PATIENT_ID': 'patient_id',
+    'SPEC_DATE': 'sample_date',
+    'SPEC_TYPE': 'sample_type',
+    'SPEC_NUM': 'specimen_id',
+    'DATE_DATA': 'report_date',
+    'AGE': 'patient_age',
+    'SEX': 'patient_gender',
+    'DIAGNOSIS': 'clinical_diagnosis'
+}
+
+# Fields of long-format records; never read as antibiotic columns
+RECORD_FIELDS = {
+    'pathogen', 'antibiotic', 'result', 'report_date', 'sample_date', 'sample_type', 'specimen_id',
+    'patient_id', 'patient_age', 'patient_gender', 'clinical_diagnosis', 'mic_value', 'mutation_data',
+    'scientific_name', 'pathogen_type', 'drug_class', 'is_critical'
+}
+
+# Leading comparators on MIC values such as "<=0.25"
+MIC_COMPARATORS = '<>=≤≥ '
+
 def allowed_file(filename):
     """Check if file has allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_csv(file):
-    """Parse CSV file into a pandas DataFrame"""
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class KeysetPage:
+    """One page of a keyset-paginated query, with opaque cursors to its neighbours"""
+    
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+    
+    def __iter__(self):
+        return iter(self.items)
+
+def encode_cursor(direction, values):
+    """Encode a page boundary as an opaque URL-safe token"""
+    payload = [direction] + [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, columns):
+    """Decode a cursor token into (direction, values); raises ValueError if invalid"""
     try:
-        # Read CSV file
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        df = pd.read_csv(stream)
-        # Convert to dict for easier handling
-        result = df.to_dict(orient='records')
-        return result
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {str(e)}")
+    
+    if not isinstance(payload, list) or len(payload) != len(columns) + 1 or payload[0] not in ('next', 'prev'):
+        raise ValueError("Invalid page cursor")
+    direction, values = payload[0], payload[1:]
+    
+    # Restore datetimes serialized as ISO strings; a tampered cursor may hold any JSON type
+    decoded = []
+    for value, column in zip(values, columns):
+        python_type = column.type.python_type
+        if value is not None and python_type is datetime:
+            if not isinstance(value, str):
+                raise ValueError("Invalid page cursor")
+            value = datetime.fromisoformat(value)
+        elif value is not None and not isinstance(value, python_type):
+            raise ValueError("Invalid page cursor")
+        decoded.append(value)
+    return direction, decoded
+
+def keyset_paginate(query, columns, cursor=None, per_page=20, with_total=False):
+    """Paginate a query newest first on columns, e.g. (created_at, id)
+    
+    Pages are selected with a row-value comparison against the cursor
+    instead of OFFSET, so any page costs the same as the first one. The
+    last column must be unique. Raises ValueError for a malformed cursor.
+    """
+    columns = list(columns)
+    direction, values = ('next', None)
+    if cursor:
+        direction, values = decode_cursor(cursor, columns)
+    
+    total = approximate_count(query) if with_total else None
+    
+    if values is None:
+        page_query = query.order_by(*[column.desc() for column in columns])
+    elif direction == 'next':
+        page_query = query.filter(tuple_(*columns) < tuple_(*values)).order_by(*[column.desc() for column in columns])
+    else:
+        # Walk backwards from the cursor, then restore newest-first order
+        page_query = query.filter(tuple_(*columns) > tuple_(*values)).order_by(*[column.asc() for column in columns])
+    
+    # One extra row tells whether there is a page beyond this one
+    rows = page_query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+    
+    page = KeysetPage(rows, per_page, total=total)
+    if rows:
+        first_key = [getattr(rows[0], column.key) for column in columns]
+        last_key = [getattr(rows[-1], column.key) for column in columns]
+        if direction == 'next':
+            page.next_cursor = encode_cursor('next', last_key) if more else None
+            page.prev_cursor = encode_cursor('prev', first_key) if values is not None else None
+        else:
+            page.next_cursor = encode_cursor('next', last_key)
+            page.prev_cursor = encode_cursor('prev', first_key) if more else None
+    return page
+
+def approximate_count(query):
+    """Row count of a query; the planner estimate on PostgreSQL, exact elsewhere"""
+    session = query.session
+    bind = session.get_bind()
+    count_query = query.order_by(None)
+    
+    if bind.dialect.name == 'postgresql':
+        statement = count_query.statement.compile(dialect=bind.dialect, compile_kwargs={'literal_binds': True})
+        plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    
+    return count_query.count()
+
+def iter_csv_batches(stream, batch_size=DEFAULT_BATCH_SIZE, antibiotic_codes=None, organism_codes=None):
+    """Yield lists of record dicts from a binary CSV stream, batch_size rows at a time
+    
+    With ``antibiotic_codes``, wide files (one row per isolate, one column
+    per antibiotic code) are melted into long-format records.
+    """
+    try:
+        # Read everything as text so a column is typed the same way in every chunk
+        reader = pd.read_csv(stream, chunksize=batch_size, dtype=str, encoding='utf-8-sig')
+        for chunk in reader:
+            if antibiotic_codes and antibiotic_columns(chunk.columns, antibiotic_codes):
+                yield from batched(melt_wide_frame(chunk, antibiotic_codes, organism_codes), batch_size)
+            else:
+                yield chunk.to_dict(orient='records')
     except Exception as e:
         logging.error(f"Error parsing CSV: {str(e)}")
         raise
 
-def parse_json(file):
-    """Parse JSON file into a dict"""
+def antibiotic_columns(columns, antibiotic_codes):
+    """Map the antibiotic columns of a wide frame to antibiotic names
+    
+    A column is an antibiotic column when the part of its name before the
+    first underscore is a known code, e.g. AMP, AMP_ND10 or AMP_NM. Frames
+    that already have an antibiotic column are long format and get {}.
+    """
+    names = {str(column).strip() for column in columns}
+    if 'antibiotic' in names:
+        return {}
+    
+    mapped = {}
+    for column in columns:
+        name = str(column).strip()
+        if name in RECORD_FIELDS or name.upper() in WHONET_FIELDS:
+            continue
+        code = name.upper().split('_')[0]
+        if code in antibiotic_codes:
+            mapped[column] = antibiotic_codes[code]
+    return mapped
+
+def melt_wide_frame(frame, antibiotic_codes, organism_codes=None):
+    """Melt a one-row-per-isolate frame into long-format record dicts
+    
+    Antibiotic cells holding S/I/R become the result; numeric cells (with
+    an optional <, <=, > or >= comparator) become the MIC value, except
+    disk zone diameters (_ND columns), which are not stored. Several
+    columns for one antibiotic (interpretation plus MIC or disk zone) are
+    merged into one record; a cell without an interpretation leaves the
+    result empty, so ingest rejects it. WHONET isolate columns are renamed to record
+    fields and organism codes are mapped to pathogen names. Empty cells
+    produce no record.
+    """
+    columns = antibiotic_columns(frame.columns, antibiotic_codes)
+    isolate_columns = [column for column in frame.columns if column not in columns]
+    
+    isolates = frame[isolate_columns].reset_index(drop=True).rename(
+        columns=lambda column: WHONET_FIELDS.get(str(column).strip().upper(), str(column).strip())
+    )
+    if organism_codes and 'pathogen' in isolates.columns:
+        pathogen = isolates['pathogen'].astype('string').str.strip()
+        isolates['pathogen'] = pathogen.str.lower().map(organism_codes).fillna(pathogen)
+    isolates = isolates.drop(columns=['antibiotic', 'result', 'mic_value'], errors='ignore')
+    isolates = isolates.astype(object).where(isolates.notna(), None)
+    
+    # One row per (isolate, antibiotic column) cell, without a Python loop over cells
+    cells = frame[list(columns)].reset_index(drop=True).rename_axis('isolate').reset_index().melt(
+        id_vars='isolate', var_name='column', value_name='value'
+    )
+    
+    # Normalize the distinct values only; exports repeat a handful of them
+    codes, uniques = pd.factorize(cells['value'])
+    text = pd.Series(uniques, dtype='string').str.strip().str.upper().fillna('')
+    numeric = pd.to_numeric(text.str.lstrip(MIC_COMPARATORS), errors='coerce').to_numpy(dtype=float)
+    text = text.to_numpy(dtype=object)
+    
+    present = codes >= 0
+    present[present] = text[codes[present]] != ''
+    cells = cells[present]
+    codes = codes[present]
+    
+    # Numeric cells are MICs, except in disk zone (_ND) columns; anything else is kept as the result
+    disk = cells['column'].map({column: '_ND' in str(column).upper() for column in columns}).to_numpy(dtype=bool)
+    cell_numeric = numeric[codes]
+    cells = cells.assign(
+        antibiotic=cells['column'].map(columns),
+        result=np.where(np.isnan(cell_numeric), text[codes], None),
+        mic_value=np.where(disk, np.nan, cell_numeric)
+    )
+    
+    # One record per isolate and antibiotic; first() takes the first non-empty value
+    merged = cells.groupby(['isolate', 'antibiotic'], sort=True)[['result', 'mic_value']].first().reset_index()
+    records = merged.join(isolates, on='isolate').drop(columns='isolate')
+    
+    # Build the dicts from whole columns; DataFrame.to_dict boxes every cell
+    names = list(records.columns)
+    return [dict(zip(names, row)) for row in zip(*(records[name].tolist() for name in names))]
+
+def iter_json_records(stream, block_size=JSON_BLOCK_SIZE, max_record_size=JSON_MAX_RECORD_SIZE):
+    """Incrementally decode records from a binary JSON array or NDJSON stream
+    
+    Raises JSONDecodeError for a malformed record, at the latest once
+    max_record_size characters after its start still do not decode, so a
+    bad record does not pull the rest of the file into memory.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8-sig')(stream)
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    
+    while True:
+        position = JSON_WHITESPACE.match(buffer, position).end()
+        
+        if position < len(buffer):
+            # A leading '[' means a JSON array, anything else is NDJSON
+            if not started:
+                started = True
+                if buffer[position] == '[':
+                    position += 1
+                    continue
+            
+            if buffer[position] == ',':
+                position += 1
+                continue
+            
+            if buffer[position] == ']':
+                return
+            
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The record may continue in the next block, unless it is already too long
+                if eof or len(buffer) - position > max_record_size:
+                    raise
+            else:
+                # A number is only complete once a delimiter follows it
+                if eof or isinstance(record, (dict, list)) or (end < len(buffer) and buffer[end] in ' \t\n\r,]'):
+                    yield record
+                    position = end
+                    continue
+        elif eof:
+            return
+        
+        block = reader.read(block_size)
+        if block:
+            # Drop the decoded prefix once per block rather than once per record
+            buffer = buffer[position:] + block
+            position = 0
+        else:
+            eof = True
+
+def iter_json_batches(stream, batch_size=DEFAULT_BATCH_SIZE, antibiotic_codes=None, organism_codes=None):
+    """Yield lists of records from a binary JSON array or NDJSON stream
+    
+    With ``antibiotic_codes``, wide records (one per isolate, one key per
+    antibiotic code) are melted into long-format records.
+    """
     try:
-        # Read JSON file
-        stream = io.StringIO(file.stream.read().decode("UTF8"))
-        result = json.load(stream)
-        return result
+        for batch in batched(iter_json_records(stream), batch_size):
+            keys = {key for record in batch if isinstance(record, dict) for key in record}
+            if antibiotic_codes and antibiotic_columns(keys, antibiotic_codes):
+                frame = pd.DataFrame([record for record in batch if isinstance(record, dict)])
+                yield from batched(melt_wide_frame(frame, antibiotic_codes, organism_codes), batch_size)
+            else:
+                yield batch
     except Exception as e:
         logging.error(f"Error parsing JSON: {str(e)}")
         raise
 
+# Scheme of LabReport.patient_identifier; rows without one hold legacy hashes
+PATIENT_ID_VERSION = 2
+
+class PatientIdHasher:
+    """Keyed HMAC-SHA256 pseudonymizer with a bounded LRU of recent identifiers
+    
+    The pseudonym is HMAC(key, SHA256(id + key)), the legacy salted hash
+    keyed once more, so identifiers stored by the old scheme can be re-keyed
+    in place (see rekey) and still match the same patient's new rows.
+    Exports list the same patient on many rows, so repeat identifiers are
+    served from the LRU instead of being hashed again.
+    """
+    
+    def __init__(self, key, max_entries=100000):
+        self.salt = key
+        self.key = key.encode('utf-8')
+        self.max_entries = max_entries
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def hash_batch(self, patient_ids):
+        """Hash a list of identifiers, each distinct one once
+        
+        Returns a list aligned with the input; blank identifiers map to ''.
+        """
+        unique = {str(patient_id) for patient_id in patient_ids if patient_id not in (None, '')}
+        hashes = {}
+        
+        with self._lock:
+            for patient_id in unique:
+                hashed = self._hashes.get(patient_id)
+                if hashed is not None:
+                    self._hashes.move_to_end(patient_id)
+                    hashes[patient_id] = hashed
+        
+        missing = unique - hashes.keys()
+        for patient_id in missing:
+            hashes[patient_id] = self.rekey(hashlib.sha256(f"{patient_id}{self.salt}".encode()).hexdigest())
+        
+        if missing:
+            with self._lock:
+                for patient_id in missing:
+                    self._hashes[patient_id] = hashes[patient_id]
+                    self._hashes.move_to_end(patient_id)
+                while len(self._hashes) > self.max_entries:
+                    self._hashes.popitem(last=False)
+        
+        return [hashes[str(patient_id)] if patient_id not in (None, '') else '' for patient_id in patient_ids]
+    
+    def rekey(self, legacy_hash):
+        """Pseudonym for an identifier stored as a legacy SHA256(id + salt) hash"""
+        return hmac.new(self.key, legacy_hash.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def get_patient_hasher():
+    """Return the patient identifier hasher for this app, keyed once from config"""
+    hasher = current_app.extensions.get('patient_id_hasher')
+    if hasher is None:
+        hasher = PatientIdHasher(
+            current_app.config.get('PATIENT_ID_SALT', 'default_salt'),
+            current_app.config.get('PATIENT_ID_CACHE_SIZE', 100000)
+        )
+        current_app.extensions['patient_id_hasher'] = hasher
+    return hasher
+
+def hash_patient_ids(patient_ids):
+    """Pseudonymize a batch of patient identifiers; blank ones map to ''"""
+    return get_patient_hasher().hash_batch(patient_ids)
+
 def hash_patient_id(patient_id, salt=None):
     """Hash patient identifier for privacy"""
-    if not salt:
-        salt = os.environ.get('PATIENT_ID_SALT', 'default_salt')
-    
-    # Create a hash of patient ID with salt
-    combined = f"{patient_id}{salt}"
-    hashed = hashlib.sha256(combined.encode()).hexdigest()
-    return hashed
+    if salt:
+        return PatientIdHasher(salt, max_entries=0).hash_batch([patient_id])[0]
+    return hash_patient_ids([patient_id])[0]
 
 def calculate_resistance_risk(pathogen_id, region):
-    """Calculate resistance risk score for a pathogen in a region"""
-    from models import ResistanceProfile, LabReport, Facility
-    from app import db
+    """Calculate resistance risk score for a pathogen in a region
+    
+    Reads the one pair uncached, so single lookups do not fill the cache
+    with one-cell matrices. For many pairs use
+    analytics.resistance_risk_matrix, which scores them all with one query.
+    """
+    from analytics import _risk_counts
     
     try:
-        # Get resistance profiles for this pathogen in the region
-        resistance_count = db.session.query(db.func.count(ResistanceProfile.id)).join(
-            LabReport, ResistanceProfile.lab_report_id == LabReport.id
-        ).join(
-            Facility, LabReport.facility_id == Facility.id
-        ).filter(
-            ResistanceProfile.pathogen_id == pathogen_id,
-            ResistanceProfile.result == 'R',
-            Facility.state == region
-        ).scalar() or 0
-        
-        total_count = db.session.query(db.func.count(ResistanceProfile.id)).join(
-            LabReport, ResistanceProfile.lab_report_id == LabReport.id
-        ).join(
-            Facility, LabReport.facility_id == Facility.id
-        ).filter(
-            ResistanceProfile.pathogen_id == pathogen_id,
-            Facility.state == region
-        ).scalar() or 0
+        counts = _risk_counts([pathogen_id], [region])
+        resistant, total = counts['resistant'][0], counts['total'][0]
         
         # Calculate risk score (0-100)
-        if total_count > 0:
-            risk_score = (resistance_count / total_count) * 100
-        else:
-            risk_score = 0
-            
-        return risk_score
+        return resistant / total * 100 if total else 0
     
     except Exception as e:
         logging.error(f"Error calculating resistance risk: {str(e)}")
         return 0
 
 def send_alert(user, alert):
-    """Send alert notification to user via appropriate channels"""
-    try:
-        # Log the alert
-        logging.info(f"Sending alert to {user.email}: {alert.title}")
-        
-        # Email notification
-        if user.email:
-            send_email_alert(user.email, alert)
-        
-        # SMS notification for high severity alerts
-        if user.phone_number and alert.severity >= 4:
-            send_sms_alert(user.phone_number, alert)
-        
-        # Push notification (if using Firebase)
-        if current_app.config.get('FIREBASE_INITIALIZED', False):
-            send_push_notification(user, alert)
-            
-    except Exception as e:
-        logging.error(f"Error sending alert: {str(e)}")
-
-def send_email_alert(email, alert):
-    """Send email alert - placeholder for actual implementation"""
-    # This would use an email service like SMTP, SendGrid, etc.
-    logging.info(f"Email alert would be sent to {email}: {alert.title}")
+    """Queue alert notifications to user via appropriate channels
     
-    # Mock implementation - in a real app, you would use an email service
-    print(f"[EMAIL] To: {email}, Subject: AMR Alert: {alert.title}, Body: {alert.message}")
-
-def send_sms_alert(phone_number, alert):
-    """Send SMS alert - placeholder for actual implementation"""
-    # This would use an SMS service like Twilio, Vonage, etc.
-    logging.info(f"SMS alert would be sent to {phone_number}: {alert.title}")
+    Delivery happens in the background after the caller's transaction commits.
+    """
+    from notifications import enqueue_notifications
     
-    # Mock implementation - in a real app, you would use an SMS service
-    print(f"[SMS] To: {phone_number}, Message: AMR Alert: {alert.title[:50]}...")
-
-def send_push_notification(user, alert):
-    """Send push notification via Firebase Cloud Messaging"""
-    # This would use Firebase Cloud Messaging
-    logging.info(f"Push notification would be sent to user {user.id}: {alert.title}")
+    try:
+        logging.info(f"Queueing alert for {user.email}: {alert.title}")
+        enqueue_notifications(user, alert)
     
-    # Mock implementation - in a real app, you would use Firebase Cloud Messaging
-    print(f"[PUSH] To: User {user.id}, Title: {alert.title}, Body: {alert.message[:100]}...")
+    except Exception as e:
+        logging.error(f"Error queueing alert: {str(e)}")
 
 def validate_genomic_data(data):
     """Validate genomic sequencing data"""
     # Placeholder for genomic data validation
     return True
 
+def parse_date_arg(name):
+    """Parse an optional YYYY-MM-DD query argument; raises ValueError if malformed"""
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+# Accepted date formats for uploaded and submitted data
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%Y/%m/%d',
+    '%d-%m-%Y',
+    '%d/%m/%Y',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S'
+]
+
+# Non-blank values examined when inferring a column's date format
+DATE_SAMPLE_SIZE = 200
+
 def format_date(date_string):
     """Convert date string to datetime object"""
     try:
         # Try different date formats
-        formats = [
-            '%Y-%m-%d',
-            '%Y/%m/%d',
-            '%d-%m-%Y',
-            '%d/%m/%Y',
-            '%Y-%m-%d %H:%M:%S',
-            '%Y/%m/%d %H:%M:%S'
-        ]
-        
-        for fmt in formats:
+        for fmt in DATE_FORMATS:
             try:
                 return datetime.strptime(date_string, fmt)
             except ValueError:
@@ -164,6 +491,48 @@ def format_date(date_string):
         logging.error(f"Error formatting date: {str(e)}")
         raise
 
+def infer_date_format(values, sample_size=DATE_SAMPLE_SIZE):
+    """Pick the accepted format that parses most of a sample of date strings
+    
+    Returns None when the sample has no values or none of them parse.
+    """
+    text = _date_text(values)
+    sample = text[text != ''].head(sample_size)
+    
+    best_format, best_count = None, 0
+    for fmt in DATE_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best_format, best_count = fmt, count
+    return best_format
+
+def parse_date_column(values, date_format=None):
+    """Parse a whole column of date strings without per-value exceptions
+    
+    The column is parsed vectorized with ``date_format`` (typically from
+    infer_date_format) first; values it does not match are retried with
+    the other accepted formats. Returns (dates, invalid): a list of
+    datetimes with None for blank or unparseable values, and a boolean
+    array marking the non-blank values that matched no format.
+    """
+    text = _date_text(values)
+    blank = (text == '').to_numpy()
+    dates = pd.Series(pd.NaT, index=text.index, dtype='datetime64[us]')
+    
+    formats = [date_format] + [fmt for fmt in DATE_FORMATS if fmt != date_format] if date_format else DATE_FORMATS
+    for fmt in formats:
+        pending = dates.isna().to_numpy() & ~blank
+        if not pending.any():
+            break
+        dates[pending] = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+    
+    invalid = dates.isna().to_numpy() & ~blank
+    return [None if pd.isna(value) else value.to_pydatetime() for value in dates], invalid
+
+def _date_text(values):
+    """Date column as stripped strings, with '' for missing values"""
+    return pd.Series(values, dtype='string').fillna('').str.strip()
+
 def generate_report_id():
     """Generate a unique report ID"""
     import uuid